@@ -2,8 +2,12 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from .lp import Compiler
 from .feature import Features
+from .cost import CostModel
+from .tournament import Tournament, Job
+from .scheduler import Scheduler
 from .version import version
 from .error import AlreadyRunningException
+from .error import CallDepthExceededException
 from .error import ExecutionCountExceededException
 from .error import InvalidSyntaxException
 
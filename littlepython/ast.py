@@ -214,6 +214,8 @@ class Call(AST):
         assert isinstance(func, Var)
         self.func = func
         self.arglist = arglist
+        # The inline cache of the interpreters, see littlepython.interpreter.call_plan.
+        self.cache = None
 
     def __str__(self):
         return "{}({})".format(self.func, ", ".join(map(str, self.arglist)))
@@ -225,3 +227,45 @@ class Return(AST):
 
     def __str__(self):
         return "return " + str(self.expr)
+
+
+def iter_child_nodes(node):
+    """Yields the nodes an engine has to handle to run node, in the order LPProg handles them.
+
+    This leaves out the nodes which are only there to name something: the variable being assigned, the name of a called
+    function and the name and params of a function definition. The If nodes of a ControlBlock are left out as well,
+    their ctrl and block are yielded instead. A FunctionDef yields the block of its function.
+    """
+    node_type = type(node)
+    if node_type in (BinaryOp, GetArrayItem):
+        yield node.left
+        yield node.right
+    elif node_type in (Assign, UnaryOp):
+        yield node.right
+    elif node_type is Block:
+        for child in node.children:
+            yield child
+    elif node_type is Array:
+        for val in node.vals:
+            yield val
+    elif node_type is ControlBlock:
+        for _if in node.ifs:
+            yield _if.ctrl
+            yield _if.block
+        yield node.else_block
+    elif node_type is ForLoop:
+        yield node.init
+        yield node.ctrl
+        yield node.block
+        yield node.inc
+    elif node_type is SetArrayItem:
+        yield node.left
+        yield node.expr
+        yield node.right
+    elif node_type is Call:
+        for arg in node.arglist:
+            yield arg
+    elif node_type is Return:
+        yield node.expr
+    elif node_type is FunctionDef:
+        yield node.function.block
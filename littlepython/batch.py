@@ -0,0 +1,248 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import operator
+
+from littlepython.ast import Int, Var, NoOp, Block, Assign, BinaryOp, UnaryOp, ControlBlock, ForLoop, \
+    iter_child_nodes
+from littlepython.cost import UNIFORM
+from littlepython.feature import Features
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, without it run_batch runs every lane on its own.
+    numpy = None
+
+# The smallest batch which is evaluated with numpy. Below it setting up the vectors costs more than it saves.
+MIN_BATCH = 32
+
+# A numpy operation costs about as much as evaluating a node for a few lanes one at a time, so when a loop keeps
+# running for fewer lanes than this they are run on their own instead.
+MIN_LANES = 4
+
+# The lanes hold int64s, a lane which computes a value this large is run on its own with Python's unbounded ints.
+LIMIT = 2 ** 62
+
+# The nodes which can be evaluated for many lanes at once.
+VECTOR_NODES = (Int, Var, NoOp, Block, Assign, BinaryOp, UnaryOp, ControlBlock, ForLoop)
+
+ARITHMETIC = {"+": operator.add, "-": operator.sub, "*": operator.mul}
+DIVISION = {"/": operator.floordiv, "%": operator.mod}
+COMPARISONS = {"is": operator.eq, "is not": operator.ne, "<": operator.lt, ">": operator.gt, "<=": operator.le,
+               ">=": operator.ge}
+
+
+def vectorizable(program):
+    """Returns whether every node of the program can be evaluated for many lanes at once.
+
+    That leaves out functions, Arrays and returns, and rand since every lane would need its own draws.
+    """
+    random_var = Features.RANDOM_VAR in program.features
+    pending = [program.ast]
+    while pending:
+        node = pending.pop()
+        if type(node) not in VECTOR_NODES or random_var and type(node) is Var and node.value == "rand":
+            return False
+        pending.extend(iter_child_nodes(node))
+    return True
+
+
+def vector_state(static_vars):
+    """Returns whether the static vars of a lane fit in the int64 lanes."""
+    return all(isinstance(value, int) and -LIMIT < value < LIMIT for value in (static_vars or {}).values())
+
+
+class Lanes(object):
+    """Evaluates a program for many runs, its lanes, at once, keeping each variable in a numpy vector.
+
+    Every node is evaluated under a mask of the lanes which run it, so a ControlBlock runs each of its blocks for the
+    lanes which take it and a ForLoop keeps running until its ctrl is false in every lane. Each lane counts the
+    operations it runs like the program does. Lanes whose run can't be evaluated here, because they overflow an
+    int64, divide by zero, use up max_op_count or are the only ones still running a loop, are marked in scalar and
+    have to be run on their own.
+
+    Next to its vector, every variable has a vector of whether it holds a bool in each lane, since comparisons and not
+    give bools which the end state has to keep.
+    """
+    def __init__(self, states, cost_model, max_op_count):
+        size = len(states)
+        self.size = size
+        self.cost_model = cost_model
+        self.max_op_count = max_op_count
+        self.costs = {}
+        self.vars = {}
+        self.bools = {}
+        self.defined = {}
+        for i, state in enumerate(states):
+            for name, value in (state or {}).items():
+                self.add_var(name)
+                self.vars[name][i] = value
+                self.bools[name][i] = isinstance(value, bool)
+                self.defined[name][i] = True
+        self.ops = numpy.zeros(size, numpy.int64)
+        self.scalar = numpy.zeros(size, bool)
+
+    def add_var(self, name):
+        if name not in self.vars:
+            self.vars[name] = numpy.zeros(self.size, numpy.int64)
+            self.bools[name] = numpy.zeros(self.size, bool)
+            self.defined[name] = numpy.zeros(self.size, bool)
+
+    def cost(self, node):
+        if id(node) not in self.costs:
+            self.costs[id(node)] = self.cost_model.cost(node)
+        return self.costs[id(node)]
+
+    def state(self, lane):
+        """Returns the end state of a lane."""
+        # Names starting with $ are temporaries added by the optimizer, see dump_state.
+        return {name: bool(values[lane]) if self.bools[name][lane] else int(values[lane])
+                for name, values in self.vars.items() if self.defined[name][lane] and not name.startswith("$")}
+
+    def run(self, node):
+        self.statement(node, numpy.ones(self.size, bool))
+        if self.max_op_count > 0:
+            self.scalar |= self.ops >= self.max_op_count
+
+    def statement(self, node, mask):
+        node_type = type(node)
+        if node_type is Block:
+            self.ops[mask] += self.cost_model.node_cost(node)
+            for child in node.children:
+                self.statement(child, mask)
+        elif node_type is Assign:
+            self.ops[mask] += self.cost(node)
+            value, bools = self.value(node.right, mask)
+            name = node.left.value
+            self.add_var(name)
+            self.vars[name][mask] = value[mask]
+            self.bools[name][mask] = bools[mask]
+            self.defined[name] |= mask
+        elif node_type is ControlBlock:
+            self.ops[mask] += self.cost_model.node_cost(node)
+            remaining = mask
+            for _if in node.ifs:
+                self.ops[remaining] += self.cost(_if.ctrl)
+                taken = remaining & (self.value(_if.ctrl, remaining)[0] != 0)
+                if taken.any():
+                    self.statement(_if.block, taken)
+                remaining = remaining & ~taken
+                if not remaining.any():
+                    return
+            self.statement(node.else_block, remaining)
+        elif node_type is ForLoop:
+            self.ops[mask] += self.cost_model.node_cost(node)
+            self.statement(node.init, mask)
+            entered = mask.sum()
+            active = mask
+            while True:
+                active = active & ~self.scalar
+                if self.max_op_count > 0:
+                    # Stop the loop for lanes which used up max_op_count, otherwise it might never end.
+                    self.scalar |= active & (self.ops >= self.max_op_count)
+                    active = active & ~self.scalar
+                self.ops[active] += self.cost(node.ctrl)
+                active = active & (self.value(node.ctrl, active)[0] != 0)
+                running = active.sum()
+                if running == 0:
+                    break
+                if running < MIN_LANES and running < entered:
+                    self.scalar |= active
+                    break
+                self.statement(node.block, active)
+                self.statement(node.inc, active)
+        else:
+            # An expression or a NoOp used as a statement.
+            self.ops[mask] += self.cost(node)
+            self.value(node, mask)
+
+    def value(self, node, mask):
+        """Returns the value of the expression node in every lane and whether it is a bool in every lane, only the
+        lanes in mask are meaningful."""
+        node_type = type(node)
+        if node_type is Int:
+            if not -LIMIT < node.value < LIMIT:
+                self.scalar |= mask
+                return numpy.zeros(self.size, numpy.int64), self.all(False)
+            # Constant folding leaves bools in Ints.
+            return numpy.full(self.size, node.value, numpy.int64), self.all(isinstance(node.value, bool))
+        if node_type is Var:
+            if node.value in self.vars:
+                return self.vars[node.value], self.bools[node.value]
+            return numpy.zeros(self.size, numpy.int64), self.all(False)
+        if node_type is BinaryOp:
+            left, left_bools = self.value(node.left, mask)
+            right, right_bools = self.value(node.right, mask)
+            op = node.op.value
+            # Every lane is evaluated, including the ones outside mask and the ones moved to scalar, so a lane with
+            # a meaningless value may overflow or divide by zero without it mattering.
+            with numpy.errstate(over="ignore", divide="ignore"):
+                if op in ARITHMETIC:
+                    # Estimate the result with floats to find the lanes where the int64 result overflowed.
+                    estimate = ARITHMETIC[op](left.astype(numpy.float64), right.astype(numpy.float64))
+                    self.scalar |= mask & (numpy.abs(estimate) >= LIMIT)
+                    return ARITHMETIC[op](left, right), self.all(False)
+                if op in DIVISION:
+                    zero = right == 0
+                    self.scalar |= mask & zero
+                    return DIVISION[op](left, numpy.where(zero, 1, right)), self.all(False)
+            if op == "and":
+                return numpy.where(left != 0, right, left), numpy.where(left != 0, right_bools, left_bools)
+            if op == "or":
+                return numpy.where(left != 0, left, right), numpy.where(left != 0, left_bools, right_bools)
+            return COMPARISONS[op](left, right).astype(numpy.int64), self.all(True)
+        if node_type is UnaryOp:
+            right, right_bools = self.value(node.right, mask)
+            op = node.op.value
+            if op == "not":
+                return (right == 0).astype(numpy.int64), self.all(True)
+            if op == "-":
+                return -right, self.all(False)
+            return right, right_bools
+        # A NoOp, eg. the missing ctrl of a for loop, is false.
+        return numpy.zeros(self.size, numpy.int64), self.all(False)
+
+    def all(self, value):
+        return numpy.full(self.size, value, bool)
+
+
+def run_batch(program, batch, max_op_count=-1, random=None):
+    """Runs a program once for each of the static vars in batch and returns their end states.
+
+    When numpy is installed the lanes are evaluated together, see Lanes, as long as the program only uses ints,
+    variables, operators, if statements and for loops. The lanes which can't be evaluated together, and every lane of
+    any other program, are run on their own with program.run. Either way the end states are the same as running the
+    program for each of the static vars in turn, and so is the exception raised by the first run which fails.
+
+    Args:
+        program: A compiled program.
+        batch (list): The static vars of each run.
+        max_op_count (int): The maximum number of operations each run can use, unlimited if not positive.
+        random: The random number generator to use for rand.
+
+    Returns:
+        list: The end state of each run.
+    """
+    batch = list(batch)
+    states = [None] * len(batch)
+    if numpy is not None and len(batch) >= MIN_BATCH and vectorizable(program):
+        indexes = [i for i, static_vars in enumerate(batch) if vector_state(static_vars)]
+        if len(indexes) >= MIN_BATCH:
+            lanes = Lanes([batch[i] for i in indexes], getattr(program, "cost_model", UNIFORM), max_op_count)
+            lanes.run(program.ast)
+            for lane, i in enumerate(indexes):
+                if not lanes.scalar[lane]:
+                    states[i] = lanes.state(lane)
+    for i, static_vars in enumerate(batch):
+        if states[i] is None:
+            states[i] = program.run(static_vars, max_op_count, random)
+    return states
+
+
+class Batched(object):
+    """The base class of the programs of every engine, which gives them run_batch."""
+    def run_batch(self, batch, max_op_count=-1, random=None):
+        """Runs the program once for each of the static vars in batch, see littlepython.batch.run_batch."""
+        return run_batch(self, batch, max_op_count, random)
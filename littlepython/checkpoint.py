@@ -0,0 +1,195 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import random
+import zlib
+from collections import defaultdict
+
+from littlepython.ast import FunctionDef, Block, Function, Var, iter_child_nodes
+from littlepython.interpreter import Array, ScopedSymbolTable, dump_state
+from littlepython.stack import Continuation, VISIT, BLOCK, IF, LOOP_CTRL, LOOP_TEST, CALL, CALL_RETURN
+
+# Every checkpoint starts with MAGIC followed by the version of its format, a checkpoint with another version is
+# refused instead of being misread.
+MAGIC = b"LPCK"
+VERSION = 1
+
+# The work items which refer to a node of the program.
+NODE_ITEMS = (VISIT, IF, LOOP_CTRL, LOOP_TEST)
+
+
+def program_nodes(program):
+    """Returns every node of the program's AST in preorder, along with the Function of every FunctionDef.
+
+    A checkpoint refers to a node by its index in this list, which is the same for every copy of the program.
+    """
+    nodes = []
+    seen = set()
+    pending = [program.ast]
+    while pending:
+        node = pending.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        nodes.append(node)
+        if type(node) is FunctionDef:
+            nodes.append(node.function)
+        pending.extend(reversed(list(iter_child_nodes(node))))
+    return nodes
+
+
+def reads_rand(program):
+    """Returns whether running the program can draw from its random number generator."""
+    return program.random_var and any(type(node) is Var and node.value == "rand" for node in program_nodes(program))
+
+
+def fingerprint(program):
+    """Returns a checksum of the program's AST, to check that a checkpoint is restored into the same program."""
+    return zlib.crc32(str(program.ast).encode("utf-8"))
+
+
+class Encoder(object):
+    """Turns the state of a Continuation into plain JSON data.
+
+    Arrays are shared between variables, so they are stored once in a table and referred to by their index. That
+    keeps an Array which is changed through one name changed for all of them after the checkpoint is restored.
+    """
+    def __init__(self, program):
+        nodes = program_nodes(program)
+        self.node_index = {id(node): i for i, node in enumerate(nodes)}
+        self.block_index = {id(node.children): i for i, node in enumerate(nodes) if type(node) is Block}
+        self.array_index = {}
+        self.arrays = []
+
+    def value(self, value):
+        if isinstance(value, defaultdict):
+            if id(value) not in self.array_index:
+                self.array_index[id(value)] = len(self.arrays)
+                items = []
+                self.arrays.append(items)
+                for key, item in value.items():
+                    items.append([key, self.value(item)])
+            return ["a", self.array_index[id(value)]]
+        if isinstance(value, Function):
+            return ["f", self.node_index[id(value)]]
+        return value
+
+    def scope(self, scope):
+        return {name: self.value(value) for name, value in scope.items()}
+
+    def item(self, item):
+        kind = item[0]
+        if kind in NODE_ITEMS:
+            return [kind, self.node_index[id(item[1])]] + list(item[2:])
+        if kind == BLOCK:
+            return [kind, self.block_index[id(item[1])], item[2]]
+        if kind == CALL:
+            return [kind, self.node_index[id(item[1])], list(item[2])]
+        if kind == CALL_RETURN:
+            return [kind, self.value(item[1])]
+        return list(item)
+
+
+class Decoder(object):
+    """Turns the JSON data made by an Encoder back into the state of a Continuation."""
+    def __init__(self, program, arrays):
+        self.nodes = program_nodes(program)
+        # Create every Array first, since Arrays can hold each other.
+        self.arrays = [Array() for _ in arrays]
+        for array, items in zip(self.arrays, arrays):
+            for key, item in items:
+                array[key] = self.value(item)
+
+    def value(self, value):
+        if isinstance(value, list):
+            tag, index = value
+            return self.arrays[index] if tag == "a" else self.nodes[index]
+        return value
+
+    def scope(self, scope):
+        return {name: self.value(value) for name, value in scope.items()}
+
+    def item(self, item):
+        kind = item[0]
+        if kind in NODE_ITEMS:
+            return (kind, self.nodes[item[1]]) + tuple(item[2:])
+        if kind == BLOCK:
+            return kind, self.nodes[item[1]].children, item[2]
+        if kind == CALL:
+            return kind, self.nodes[item[1]], tuple(item[2])
+        if kind == CALL_RETURN:
+            return kind, self.value(item[1])
+        return tuple(item)
+
+
+def dump(run):
+    """Returns a checkpoint of a Continuation of a StackProg run as bytes.
+
+    The checkpoint holds everything the run needs to go on: the pending work, the values and frames of the active
+    LP calls, the variables with the contents of their Arrays, the op count and the state of the random number
+    generator, if the program reads rand. The program itself isn't included, load needs the same program to restore
+    the run into.
+
+    Raises:
+        ValueError: If the state of the run's random number generator can't be saved.
+    """
+    program = run.program
+    encoder = Encoder(program)
+    rng_state = None
+    if reads_rand(program):
+        if not hasattr(run.random, "getstate"):
+            raise ValueError("The random number generator of the run has no state which can be saved.")
+        version, internal, gauss = run.random.getstate()
+        rng_state = [version, list(internal), gauss]
+    data = {"program": fingerprint(program),
+            "op_count": run.op_count,
+            "max_call_depth": run.max_call_depth,
+            "random": rng_state,
+            "globals": encoder.scope(run.sym_tbl.global_state),
+            "scopes": [encoder.scope(scope) for scope in run.sym_tbl.scopes],
+            "work": [encoder.item(item) for item in run.work],
+            "values": [encoder.value(value) for value in run.values],
+            "frames": run.frames,
+            "arrays": encoder.arrays}
+    return MAGIC + bytes(bytearray([VERSION])) + zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def load(program, checkpoint):
+    """Restores a Continuation from a checkpoint made by dump, for a copy of the same program.
+
+    Resuming the restored run gives the same end state and op count as resuming the run the checkpoint was made of,
+    rand included, since the checkpoint brings its own random number generator along.
+
+    Raises:
+        ValueError: If checkpoint isn't a checkpoint of this version of the format, or was made for another program.
+    """
+    header = len(MAGIC) + 1
+    if checkpoint[:len(MAGIC)] != MAGIC or len(checkpoint) < header:
+        raise ValueError("Not a checkpoint of a run.")
+    version = bytearray(checkpoint[len(MAGIC):header])[0]
+    if version != VERSION:
+        raise ValueError("Can't load a checkpoint of version {}, only version {} is supported.".format(version,
+                                                                                                     VERSION))
+    data = json.loads(zlib.decompress(checkpoint[header:]).decode("utf-8"))
+    if data["program"] != fingerprint(program):
+        raise ValueError("The checkpoint was made for another program.")
+    decoder = Decoder(program, data["arrays"])
+    rng = None
+    if data["random"] is not None:
+        version, internal, gauss = data["random"]
+        rng = random.Random()
+        rng.setstate((version, tuple(internal), gauss))
+    sym_tbl = ScopedSymbolTable(decoder.scope(data["globals"]))
+    for scope in data["scopes"]:
+        sym_tbl.enter_scope()
+        sym_tbl.scopes[-1] = decoder.scope(scope)
+    run = Continuation(program, sym_tbl, rng, data["max_call_depth"])
+    run.work = [decoder.item(item) for item in data["work"]]
+    run.values = [decoder.value(value) for value in data["values"]]
+    run.frames = [tuple(frame) for frame in data["frames"]]
+    run.op_count = data["op_count"]
+    if run.done:
+        run.state = dump_state(sym_tbl.dump_cur_state())
+    return run
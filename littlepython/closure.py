@@ -0,0 +1,525 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import operator
+import random
+from collections import namedtuple, OrderedDict
+
+from littlepython.ast import Function, FunctionDef, Return, iter_child_nodes
+from littlepython.batch import Batched
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from littlepython.interpreter import Array, EXECUTION_COUNT_EXCEEDED_MSG, load_state, dump_state, reduce_program
+from littlepython.optimizer import pure_functions, function_assigned_names
+from littlepython.resolver import Resolver, UNSET, RAND, GLOBAL, LOCAL
+
+
+binaryOps = {"+": operator.add,
+             "-": operator.sub,
+             "*": operator.mul,
+             # This might become a problem in future versions this works for integers only
+             "/": operator.floordiv,
+             "%": operator.mod,
+             "or": lambda a, b: a or b,
+             "and": lambda a, b: a and b,
+             "is": operator.eq,
+             "is not": operator.ne,
+             "<": operator.lt,
+             ">": operator.gt,
+             "<=": operator.le,
+             ">=": operator.ge}
+unaryOps = {"not": operator.not_,
+            "+": lambda a: a,
+            "-": operator.neg}
+
+
+def can_return(node):
+    """Returns True if running the statement node can run a return statement of the enclosing function."""
+    if type(node) is Return:
+        return True
+    if type(node) is FunctionDef:
+        return False
+    return any(can_return(child) for child in iter_child_nodes(node))
+
+
+class CompiledFunction(Function):
+    """A function value whose body has already been compiled into a closure.
+
+    Calling it creates a frame with a slot for every name in its layout, see littlepython.resolver.
+    """
+    def __init__(self, function, body, layout, global_slots):
+        super(CompiledFunction, self).__init__(function.sig, function.block)
+        self.params = tuple(param.value for param in function.sig.params)
+        self.body = body
+        self.slots = layout.slots
+        self.size = len(layout)
+        # The global and frame slots to bind each param to.
+        self.param_slots = tuple((global_slots[param], layout.slots[param]) for param in self.params)
+        # The index of the function's Memo in Run.memos if the function is memoized.
+        self.memo = None
+
+
+MemoStats = namedtuple("MemoStats", ["hits", "misses"])
+
+
+class Memo(object):
+    """A bounded LRU cache of the results of a pure function during a run, keyed by the tuple of its args."""
+    __slots__ = ("results", "size", "hits", "misses")
+
+    def __init__(self, size):
+        self.results = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached result for key or UNSET."""
+        results = self.results
+        if key in results:
+            self.hits += 1
+            results.move_to_end(key)
+            return results[key]
+        self.misses += 1
+        return UNSET
+
+    def put(self, key, result):
+        self.results[key] = result
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+
+class Run(object):
+    """The state of a single run of a ClosureProg.
+
+    globals holds the global state, with a slot for every name in the program. frames holds a (slots, frame) pair for
+    each active call and frame is the frame of the innermost one.
+    """
+    __slots__ = ("globals", "global_slots", "frames", "frame", "count", "random", "memos")
+
+    def __init__(self, globals, global_slots, count, random, memos=()):
+        self.globals = globals
+        self.global_slots = global_slots
+        self.frames = []
+        self.frame = None
+        self.count = count
+        self.random = random
+        # The Memo of each memoized function, or None if it can't be memoized in this run.
+        self.memos = memos
+
+    def resolve(self, name):
+        """Looks up a name through the frames of the active calls and then the global state, like
+        ScopedSymbolTable.resolve."""
+        for slots, frame in reversed(self.frames):
+            slot = slots.get(name)
+            if slot is not None and frame[slot] is not UNSET:
+                return frame[slot]
+        value = self.globals[self.global_slots[name]]
+        return 0 if value is UNSET else value
+
+
+class ClosureCompiler(object):
+    """Turns every node of an AST into a Python closure which takes the Run as its only argument.
+
+    All the work of figuring out what a node does (handler lookup, operator lookup, feature checks) is done once here
+    so running a program is just a chain of closure calls. Every closure charges one operation for its node before
+    evaluating its children, which is the same order LPProg.handle uses, so both raise at the same point.
+
+    The closure of a statement returns None, except when a return statement runs. Then it returns the returned value,
+    which is never None, and every enclosing statement which can return passes it on until it reaches the call.
+
+    Names are resolved to slots by the Resolver, so most variables are read and written by indexing into a list
+    instead of going through the scopes of a ScopedSymbolTable.
+    """
+    def __init__(self, features, resolver, memoized=()):
+        self.features = features
+        self.resolver = resolver
+        # The memoized Functions, a function's index is the index of its Memo in Run.memos.
+        self.memoized = {id(function): i for i, function in enumerate(memoized)}
+        # The function whose body is being compiled, None for the top level.
+        self.function = None
+
+    def compile(self, node):
+        name = 'compile_' + type(node).__name__.lower()
+        compiler = getattr(self, name, None)
+        if compiler is None:
+            raise NotImplementedError("No {} found.".format(name))
+        return compiler(node)
+
+    def compile_noop(self, node):
+        def noop(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+        return noop
+
+    def callee(self, name):
+        """Returns a function which looks up the function called name in a run."""
+        kind, slot = self.resolver.classify(name, self.function, call=True)
+        if kind == GLOBAL:
+            def get_global(run):
+                value = run.globals[slot]
+                return 0 if value is UNSET else value
+            return get_global
+        if kind == LOCAL:
+            def get_local(run):
+                value = run.frame[slot]
+                if value is UNSET:
+                    return run.resolve(name)
+                return value
+            return get_local
+        return lambda run: run.resolve(name)
+
+    def target(self, name):
+        """Returns the global slot of name and, inside a function, its slot in the function's frame."""
+        if self.function is None:
+            return self.resolver.globals[name], None
+        return self.resolver.globals[name], self.resolver.layout(self.function).slots[name]
+
+    def compile_var(self, node):
+        name = node.value
+        kind, slot = self.resolver.classify(name, self.function)
+        if kind == RAND:
+            def rand(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                return run.random.randint(-2147483647, 2147483647)
+            return rand
+
+        if kind == GLOBAL:
+            def global_var(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                value = run.globals[slot]
+                return 0 if value is UNSET else value
+            return global_var
+
+        if kind == LOCAL:
+            def local_var(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                value = run.frame[slot]
+                if value is UNSET:
+                    # The function hasn't assigned to it (yet), so it is read from a caller or the global state.
+                    return run.resolve(name)
+                return value
+            return local_var
+
+        def var(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return run.resolve(name)
+        return var
+
+    def compile_int(self, node):
+        value = node.value
+
+        def const(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return value
+        return const
+
+    def compile_array(self, node):
+        vals = tuple(self.compile(val) for val in node.vals)
+
+        def array(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return Array([val(run) for val in vals])
+        return array
+
+    def compile_assign(self, node):
+        global_slot, slot = self.target(node.left.value)
+        right = self.compile(node.right)
+
+        if slot is None:
+            def assign_global(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                run.globals[global_slot] = right(run)
+            return assign_global
+
+        def assign(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            value = right(run)
+            # Like ScopedSymbolTable.set a name which is in the global state is always assigned there.
+            if run.globals[global_slot] is UNSET:
+                run.frame[slot] = value
+            else:
+                run.globals[global_slot] = value
+        return assign
+
+    def compile_block(self, node):
+        children = tuple(self.compile(child) for child in node.children)
+        if not can_return(node):
+            def block(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                for child in children:
+                    child(run)
+            return block
+
+        # Only the value of a child which can return is checked, other statements like calls can have a value too.
+        checked = tuple((child, can_return(statement)) for child, statement in zip(children, node.children))
+
+        def returning_block(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            for child, check in checked:
+                rtn = child(run)
+                if check and rtn is not None:
+                    return rtn
+        return returning_block
+
+    def compile_controlblock(self, node):
+        ifs = tuple((self.compile(_if.ctrl), self.compile(_if.block)) for _if in node.ifs)
+        else_block = self.compile(node.else_block)
+
+        def controlblock(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            for ctrl, block in ifs:
+                if ctrl(run):
+                    return block(run)
+            return else_block(run)
+        return controlblock
+
+    def compile_forloop(self, node):
+        init = self.compile(node.init)
+        ctrl = self.compile(node.ctrl)
+        inc = self.compile(node.inc)
+        block = self.compile(node.block)
+
+        if not can_return(node.block):
+            def forloop(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                init(run)
+                while ctrl(run):
+                    block(run)
+                    inc(run)
+            return forloop
+
+        def returning_forloop(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            init(run)
+            while ctrl(run):
+                rtn = block(run)
+                if rtn is not None:
+                    return rtn
+                inc(run)
+        return returning_forloop
+
+    def compile_binaryop(self, node):
+        op = binaryOps[node.op.value]
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        if node.op.value in ("/", "%"):
+            def division(run):
+                run.count -= 1
+                if run.count == 0:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                try:
+                    return op(left(run), right(run))
+                except ZeroDivisionError:
+                    raise DivisionByZeroException()
+            return division
+
+        def binaryop(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return op(left(run), right(run))
+        return binaryop
+
+    def compile_unaryop(self, node):
+        op = unaryOps[node.op.value]
+        right = self.compile(node.right)
+
+        def unaryop(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return op(right(run))
+        return unaryop
+
+    def compile_getarrayitem(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        def getarrayitem(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            var = left(run)
+            return var[right(run)]
+        return getarrayitem
+
+    def compile_setarrayitem(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        expr = self.compile(node.expr)
+
+        def setarrayitem(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            var = left(run)
+            var[right(run)] = expr(run)
+        return setarrayitem
+
+    def compile_functiondef(self, node):
+        global_slot, slot = self.target(node.name.value)
+        outer, self.function = self.function, node.function
+        body = self.compile(node.function.block)
+        self.function = outer
+        function = CompiledFunction(node.function, body, self.resolver.layout(node.function), self.resolver.globals)
+        function.memo = self.memoized.get(id(node.function))
+
+        def functiondef(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            if slot is None or run.globals[global_slot] is not UNSET:
+                run.globals[global_slot] = function
+            else:
+                run.frame[slot] = function
+        return functiondef
+
+    def compile_call(self, node):
+        get = self.callee(node.func.value)
+        args = tuple(self.compile(arg) for arg in node.arglist)
+        arg_count = len(args)
+        # The inline cache, the function this call site last called. It is shared by every run of the program, but it
+        # only ever holds a function whose params were checked against the args, so a run in another thread replacing
+        # it at worst makes this run check the params again.
+        cached = None
+
+        def call(run):
+            nonlocal cached
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            func = get(run)
+            if func is not cached:
+                # make sure that the arglist length matches the func signature
+                assert len(func.params) == arg_count
+                cached = func
+            values = [arg(run) for arg in args]
+
+            memo = None
+            if func.memo is not None and all(type(value) is int for value in values):
+                memo = run.memos[func.memo]
+                if memo is not None:
+                    key = tuple(values)
+                    rtn = memo.get(key)
+                    if rtn is not UNSET:
+                        return rtn
+
+            frame = [UNSET] * func.size
+            global_state = run.globals
+            for (global_slot, slot), value in zip(func.param_slots, values):
+                if global_state[global_slot] is UNSET:
+                    frame[slot] = value
+                else:
+                    global_state[global_slot] = value
+            outer = run.frame
+            run.frames.append((func.slots, frame))
+            run.frame = frame
+
+            rtn = func.body(run)
+            if rtn is None:
+                # The function didn't return a value.
+                rtn = 0
+            run.frames.pop()
+            run.frame = outer
+            if memo is not None and type(rtn) in (int, bool):
+                memo.put(key, rtn)
+            return rtn
+        return call
+
+    def compile_return(self, node):
+        expr = self.compile(node.expr)
+
+        def _return(run):
+            run.count -= 1
+            if run.count == 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            return expr(run)
+        return _return
+
+
+class ClosureProg(Batched):
+    """A program compiled into a tree of closures by the ClosureCompiler.
+
+    It runs the same programs as LPProg and produces the same end state, op counts and exceptions, but does not
+    have to figure out what each node means every time the node is evaluated.
+
+    With memoize the results of pure functions (see littlepython.optimizer.pure_functions) called with int args are
+    cached for the duration of a run, in a Memo of at most memo_size results per function. A call which is answered
+    from the cache doesn't run the function's body so it uses fewer operations. run_counted returns the MemoStats of
+    each memoized function with stats, they belong to the run since a program can run many times at once. Functions
+    which assign to a name in the static vars of a run aren't pure during that run and aren't memoized.
+    """
+    memo_size = 4096
+
+    def __init__(self, ast, features, memoize=False):
+        self.ast = ast
+        self.features = features
+        self.memoize = memoize
+        self.resolver = Resolver(features).resolve(ast)
+        self.memoized = pure_functions(ast) if memoize else {}
+        functions = [node.function for node in self.memoized.values()]
+        self.memo_names = [function_assigned_names(function) for function in functions]
+        self.code = ClosureCompiler(features, self.resolver, functions).compile(ast)
+        self.random = random
+
+    def run(self, static_vars=None, max_op_count=-1, random=None):
+        return self.run_counted(static_vars, max_op_count, random)[0]
+
+    def run_counted(self, static_vars=None, max_op_count=-1, random=None, stats=False):
+        """Runs the program like run and returns its end state along with the number of operations it used.
+
+        With stats a third item is returned: the MemoStats of each function memoized during the run, by name.
+        """
+        global_slots = self.resolver.globals
+        global_state = [UNSET] * len(global_slots)
+        # The program can't see the static vars it never names, they are passed through to the end state.
+        state = {}
+        for name, value in load_state(static_vars).items():
+            if name in global_slots:
+                global_state[global_slots[name]] = value
+            else:
+                state[name] = value
+        memos = [Memo(self.memo_size) if static_vars is None or names.isdisjoint(static_vars) else None
+                 for names in self.memo_names]
+        run = Run(global_state, global_slots, max_op_count, self.random if random is None else random, memos)
+        self.code(run)
+        for name, slot in global_slots.items():
+            if global_state[slot] is not UNSET:
+                state[name] = global_state[slot]
+        # A run without a max_op_count counts down from -1 without ever reaching 0.
+        if stats:
+            memo_stats = {name: MemoStats(memo.hits, memo.misses)
+                          for name, memo in zip(self.memoized, memos) if memo is not None}
+            return dump_state(state), max_op_count - run.count, memo_stats
+        return dump_state(state), max_op_count - run.count
+
+    def __reduce__(self):
+        return reduce_program(self, self.memoize)
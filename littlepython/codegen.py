@@ -0,0 +1,346 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import sys
+
+from littlepython.ast import Function, Block, Assign, SetArrayItem, FunctionDef, Return, ControlBlock, ForLoop, NoOp, \
+    Var, Int, Array, BinaryOp, UnaryOp, GetArrayItem, Call
+from littlepython.batch import Batched
+from littlepython.closure import ClosureProg
+from littlepython.cost import UNIFORM
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from littlepython.feature import Features
+from littlepython.interpreter import Array as LPArray, LPProg, ScopedSymbolTable, EXECUTION_COUNT_EXCEEDED_MSG, \
+    load_state, dump_state, reduce_program, replayable, replayed
+
+
+binaryOps = {"+": "({} + {})",
+             "-": "({} - {})",
+             "*": "({} * {})",
+             # This might become a problem in future versions this works for integers only
+             "/": "({} // {})",
+             "%": "({} % {})",
+             "or": "({} or {})",
+             "and": "({} and {})",
+             "is": "({} == {})",
+             "is not": "({} != {})",
+             "<": "({} < {})",
+             ">": "({} > {})",
+             "<=": "({} <= {})",
+             ">=": "({} >= {})"}
+unaryOps = {"not": "(not {})",
+            "+": "({})",
+            "-": "(-{})"}
+
+
+class PythonFunction(Function):
+    """A function value whose body is a Python function generated for a single run."""
+    def __init__(self, function, code):
+        super(PythonFunction, self).__init__(function.sig, function.block)
+        self.params = tuple(param.value for param in function.sig.params)
+        self.code = code
+
+
+def is_safe(node):
+    """Returns True if the expression can't raise or have side effects, so skipping it can't be noticed."""
+    if isinstance(node, Int):
+        return True
+    if isinstance(node, Var):
+        return node.value != "rand"
+    if isinstance(node, UnaryOp):
+        return node.op.value == "not" and is_safe(node.right)
+    if isinstance(node, BinaryOp):
+        return node.op.value in ("is", "is not", "and", "or") and is_safe(node.left) and is_safe(node.right)
+    return False
+
+
+class PythonCodeGenerator(object):
+    """Translates an AST into the source code of a Python function.
+
+    Every LP function becomes a nested Python function, for loops become while loops and control blocks become if/else
+    statements. Variables are still read and written through the ScopedSymbolTable so scoping works exactly like it
+    does in LPProg.
+
+    When budget is True the operations are charged once at the start of each basic block (a run of statements without
+    any control flow) instead of once per node. A run which completes does so for exactly the same max_op_count as
+    in LPProg, but the code can raise ExecutionCountExceededException where LPProg would have failed in another way
+    part way through the basic block, so PythonProg replays the runs which raise it.
+    """
+    def __init__(self, features, budget):
+        self.features = features
+        self.budget = budget
+        self.functions = []
+        self.lines = []
+        self.indent = 0
+        self.in_func = False
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def charge(self, count):
+        if self.budget and count:
+            self.emit("_c -= {}".format(count))
+            self.emit("if _c <= 0: raise _Exceeded(_MSG)")
+
+    def generate(self, ast):
+        self.emit("def __lp_program(_sym_tbl, _random, _c):")
+        self.indent += 1
+        self.emit("_G = _sym_tbl.global_state")
+        self.emit("_get = _G.get")
+        self.emit("_resolve = _sym_tbl.resolve")
+        self.emit("_set = _sym_tbl.set")
+        self.emit("_enter_scope = _sym_tbl.enter_scope")
+        self.emit("_exit_scope = _sym_tbl.exit_scope")
+        self.emit("_randint = _random.randint")
+        self.emit("")
+        self.emit("def _call(func, *args):")
+        self.emit("    assert len(func.params) == len(args)")
+        self.emit("    _enter_scope()")
+        self.emit("    for param, arg in zip(func.params, args):")
+        self.emit("        _set(param, arg)")
+        self.emit("    rtn = func.code()")
+        self.emit("    _exit_scope()")
+        self.emit("    return rtn")
+        self.emit("")
+        body_start = len(self.lines)
+        self.block(ast)
+        body = self.lines[body_start:]
+        del self.lines[body_start:]
+
+        for i, function in enumerate(self.functions):
+            self.emit("def _f{}():".format(i))
+            self.indent += 1
+            if self.budget:
+                self.emit("nonlocal _c")
+            self.in_func = True
+            self.block(function.block)
+            # A function which doesn't return a value returns 0.
+            self.emit("return 0")
+            self.indent -= 1
+            self.emit("_fn{i} = _Function(_functions[{i}], _f{i})".format(i=i))
+            self.emit("")
+        self.lines += body
+        # The program returns the operations it has left.
+        self.emit("return _c")
+        return "\n".join(self.lines) + "\n"
+
+    def block(self, node, extra=()):
+        """Emits a block, and any extra statements which follow it, as a series of basic blocks."""
+        statements = list(node.children) + list(extra)
+        pending = 1  # The operation for the block itself.
+        segment = []
+        i = 0
+        while i < len(statements):
+            statement = statements[i]
+            i += 1
+            if isinstance(statement, Block):
+                # A nested block is straight line code, so it is spliced into this one.
+                pending += 1
+                statements[i:i] = statement.children
+                continue
+            if isinstance(statement, (ControlBlock, ForLoop)):
+                self.charge(pending + sum(UNIFORM.cost(s) for s in segment) + UNIFORM.entry_cost(statement))
+                for s in segment:
+                    self.statement(s)
+                pending, segment = 0, []
+                self.statement(statement)
+                continue
+            segment.append(statement)
+            if isinstance(statement, Return):
+                # Everything after a return in the same block can never run.
+                break
+        self.charge(pending + sum(UNIFORM.cost(s) for s in segment))
+        for s in segment:
+            self.statement(s)
+
+    def statement(self, node):
+        if isinstance(node, Assign):
+            self.assign(node.left.value, self.expression(node.right))
+        elif isinstance(node, SetArrayItem):
+            self.emit("_t = " + self.expression(node.left))
+            self.emit("_t[{}] = {}".format(self.expression(node.right), self.expression(node.expr)))
+        elif isinstance(node, FunctionDef):
+            self.functions.append(node.function)
+            self.assign(node.name.value, "_fn{}".format(len(self.functions) - 1))
+        elif isinstance(node, Return):
+            if self.in_func:
+                self.emit("return " + self.expression(node.expr))
+            else:
+                # A return outside of any function ends the program, the value is still evaluated for its effects.
+                self.emit(self.expression(node.expr))
+                self.emit("return _c")
+        elif isinstance(node, ControlBlock):
+            self.controlblock(node)
+        elif isinstance(node, ForLoop):
+            self.forloop(node)
+        elif isinstance(node, NoOp):
+            self.emit("pass")
+        else:
+            self.emit(self.expression(node))
+
+    def assign(self, name, value):
+        if self.in_func:
+            self.emit("_set({!r}, {})".format(name, value))
+        else:
+            self.emit("_G[{!r}] = {}".format(name, value))
+
+    def controlblock(self, node):
+        # The first ctrl is charged by the basic block the control block is in.
+        self.emit("if {}:".format(self.expression(node.ifs[0].ctrl)))
+        self.indented_block(node.ifs[0].block)
+        depth = 0
+        for _if in node.ifs[1:]:
+            if self.budget:
+                self.emit("else:")
+                self.indent += 1
+                depth += 1
+                self.charge(UNIFORM.cost(_if.ctrl))
+                self.emit("if {}:".format(self.expression(_if.ctrl)))
+            else:
+                self.emit("elif {}:".format(self.expression(_if.ctrl)))
+            self.indented_block(_if.block)
+        self.emit("else:")
+        self.indented_block(node.else_block)
+        self.indent -= depth
+
+    def forloop(self, node):
+        # The init is charged by the basic block the loop is in.
+        self.statement(node.init)
+        if self.budget:
+            self.emit("while True:")
+            self.indent += 1
+            self.charge(UNIFORM.cost(node.ctrl))
+            self.emit("if not {}: break".format(self.expression(node.ctrl)))
+            self.block(node.block, [node.inc])
+            self.indent -= 1
+        else:
+            self.emit("while {}:".format(self.expression(node.ctrl)))
+            self.indented_block(node.block, [node.inc])
+
+    def indented_block(self, node, extra=()):
+        self.indent += 1
+        start = len(self.lines)
+        self.block(node, extra)
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indent -= 1
+
+    def load(self, name):
+        if self.in_func:
+            return "_resolve({!r})".format(name)
+        return "_get({!r}, 0)".format(name)
+
+    def expression(self, node):
+        if isinstance(node, Int):
+            return repr(node.value)
+        if isinstance(node, Var):
+            if node.value == "rand" and Features.RANDOM_VAR in self.features:
+                return "_randint(-2147483647, 2147483647)"
+            return self.load(node.value)
+        if isinstance(node, NoOp):
+            return "None"
+        if isinstance(node, Array):
+            return "_Array([{}])".format(", ".join(map(self.expression, node.vals)))
+        if isinstance(node, BinaryOp):
+            op = node.op.value
+            if op in ("and", "or") and not is_safe(node.right):
+                # LP always evaluates both sides, so python's short circuiting can't be used here.
+                return "_{}({}, {})".format(op, self.expression(node.left), self.expression(node.right))
+            return binaryOps[op].format(self.expression(node.left), self.expression(node.right))
+        if isinstance(node, UnaryOp):
+            return unaryOps[node.op.value].format(self.expression(node.right))
+        if isinstance(node, GetArrayItem):
+            return "{}[{}]".format(self.expression(node.left), self.expression(node.right))
+        if isinstance(node, Call):
+            # The called function is always looked up by name, even rand.
+            args = [self.load(node.func.value)] + [self.expression(arg) for arg in node.arglist]
+            return "_call({})".format(", ".join(args))
+        raise NotImplementedError("No expression for {}.".format(type(node).__name__))
+
+
+def _and(a, b):
+    return a and b
+
+
+def _or(a, b):
+    return a or b
+
+
+class PythonProg(Batched):
+    """A program translated into Python source code which is compiled with the built-in compile().
+
+    Two versions of the program are generated, one which tracks max_op_count and one for runs without a limit, so
+    unlimited runs don't pay for counting. Both are generated when the program is created, so running it never
+    changes the program and it can be run from many threads at once. If the generated code is too deeply nested for
+    Python to compile it the program is run with a ClosureProg instead.
+
+    A run with a max_op_count which raises ExecutionCountExceededException is replayed by an LPProg counting node by
+    node (see LPProg.replay), so it raises exactly what LPProg raises.
+    """
+    def __init__(self, ast, features):
+        self.ast = ast
+        self.features = features
+        self.random = random
+        self.fallback = None
+        self.replayer = None
+        self.random_var = Features.RANDOM_VAR in features
+        self.entries = {}
+        self.sources = {}
+        try:
+            for budget in (False, True):
+                self.generate(budget)
+            self.replayer = LPProg(ast, features)
+        except (SyntaxError, RecursionError, MemoryError):
+            self.fallback = ClosureProg(ast, features)
+
+    def generate(self, budget):
+        generator = PythonCodeGenerator(self.features, budget)
+        source = generator.generate(self.ast)
+        namespace = {"_Array": LPArray, "_Function": PythonFunction, "_Exceeded": ExecutionCountExceededException,
+                     "_MSG": EXECUTION_COUNT_EXCEEDED_MSG, "_and": _and, "_or": _or, "_functions": generator.functions}
+        exec(compile(source, "<littlepython>", "exec"), namespace)
+        self.sources[budget] = source
+        self.entries[budget] = namespace["__lp_program"]
+
+    @property
+    def source(self):
+        return self.sources.get(False)
+
+    def run(self, static_vars=None, max_op_count=-1, random=None):
+        if self.fallback is not None:
+            return self.fallback.run(static_vars, max_op_count, random)
+        if max_op_count > 0:
+            return dump_state(self.counted_run(static_vars, max_op_count, random)[0])
+        sym_tbl = ScopedSymbolTable(load_state(static_vars))
+        try:
+            self.entries[False](sym_tbl, self.random if random is None else random, max_op_count)
+        except ZeroDivisionError:
+            raise DivisionByZeroException()
+        return dump_state(sym_tbl.dump_cur_state())
+
+    def run_counted(self, static_vars=None, max_op_count=-1, random=None):
+        """Runs the program like run and returns its end state along with the number of operations it used."""
+        if self.fallback is not None:
+            return self.fallback.run_counted(static_vars, max_op_count, random)
+        # A run without a max_op_count isn't counted, so it is given one it can't use up.
+        count = max_op_count if max_op_count > 0 else sys.maxsize
+        state, remaining = self.counted_run(static_vars, count, random)
+        return dump_state(state), count - remaining
+
+    def counted_run(self, static_vars, max_op_count, random):
+        """Runs the program with a positive max_op_count, returns its global state and the operations it has left."""
+        random = replayable(self.random if random is None else random, self.random_var)
+        sym_tbl = ScopedSymbolTable(load_state(static_vars))
+        try:
+            remaining = self.entries[True](sym_tbl, random, max_op_count)
+        except ZeroDivisionError:
+            raise DivisionByZeroException()
+        except ExecutionCountExceededException:
+            ctx = self.replayer.replay(static_vars, max_op_count, replayed(random))
+            return ctx.dump_cur_state(), ctx.count_remaining
+        return sym_tbl.dump_cur_state(), remaining
+
+    def __reduce__(self):
+        return reduce_program(self)
@@ -0,0 +1,98 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from littlepython.ast import Array, BinaryOp, Block, Call, ControlBlock, ForLoop, FunctionDef, Int, UnaryOp, Var, \
+    iter_child_nodes
+
+
+class CostModel(object):
+    """The number of operations evaluating each node of a program charges against the max_op_count of a run.
+
+    Every node costs 1 unless the model says otherwise, which is how every engine counts operations. Running a
+    program with another model only changes how many operations it charges, not what it does.
+
+    Args:
+        nodes (dict): Maps types of AST nodes, eg. Call, to what evaluating one of them costs.
+        binary_ops (dict): Maps binary operators, eg. "%", to what a BinaryOp with that operator costs.
+        unary_ops (dict): Maps unary operators, eg. "not", to what a UnaryOp with that operator costs.
+        array_item (int): What each value of an Array literal costs on top of the Array itself.
+        arg (int): What binding each arg of a Call to its param costs on top of the Call itself.
+    """
+    def __init__(self, nodes=None, binary_ops=None, unary_ops=None, array_item=0, arg=0):
+        self.nodes = dict(nodes or {})
+        self.binary_ops = dict(binary_ops or {})
+        self.unary_ops = dict(unary_ops or {})
+        self.array_item = array_item
+        self.arg = arg
+        # Every node has to cost something, otherwise a loop could run forever without using up max_op_count.
+        for costs in (self.nodes, self.binary_ops, self.unary_ops):
+            for key, value in costs.items():
+                if not isinstance(value, int) or value < 1:
+                    raise ValueError("The cost of {} must be a positive int, got {!r}.".format(key, value))
+        for name, value in (("array_item", array_item), ("arg", arg)):
+            if not isinstance(value, int) or value < 0:
+                raise ValueError("The cost of {} must be an int of at least 0, got {!r}.".format(name, value))
+
+    def key(self):
+        """Returns the costs as a tuple, two models with the same key charge the same for every node."""
+        return (tuple(sorted((node_type.__name__, cost) for node_type, cost in self.nodes.items())),
+                tuple(sorted(self.binary_ops.items())), tuple(sorted(self.unary_ops.items())),
+                self.array_item, self.arg)
+
+    def __eq__(self, other):
+        return isinstance(other, CostModel) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def node_cost(self, node):
+        """Returns what evaluating node costs, not counting its children."""
+        node_type = type(node)
+        if node_type is BinaryOp and node.op.value in self.binary_ops:
+            return self.binary_ops[node.op.value]
+        if node_type is UnaryOp and node.op.value in self.unary_ops:
+            return self.unary_ops[node.op.value]
+        cost = self.nodes.get(node_type, 1)
+        if node_type is Array:
+            cost += self.array_item * len(node.vals)
+        elif node_type is Call:
+            cost += self.arg * len(node.arglist)
+        return cost
+
+    def cost(self, node):
+        """Returns what evaluating the expression or simple statement node costs.
+
+        Calls are only charged for the call and its arguments, the function body charges for itself when it runs, and
+        defining a function only charges for the definition.
+        """
+        if type(node) is FunctionDef:
+            return self.node_cost(node)
+        return self.node_cost(node) + sum(map(self.cost, iter_child_nodes(node)))
+
+    def entry_cost(self, node):
+        """Returns what is charged before the statement node runs, when it is charged by basic block.
+
+        A block charges for itself, a control block is charged for itself and its first ctrl and a loop for itself and
+        its init, the rest of them is charged as it runs. Any other statement is charged in full.
+        """
+        node_type = type(node)
+        if node_type is Block:
+            return 0
+        if node_type is ControlBlock:
+            return self.node_cost(node) + self.cost(node.ifs[0].ctrl)
+        if node_type is ForLoop:
+            return self.node_cost(node) + self.cost(node.init)
+        return self.cost(node)
+
+
+# Every node costs 1 operation, the way every engine counts operations.
+UNIFORM = CostModel()
+
+# Costs relative to an Int, measured by timing LPProg running each kind of node in a loop, so equal budgets take
+# roughly equal time. Looking up a variable goes through every scope, a call sets up a scope and binds its args and
+# an Array literal builds a dict. The operators all cost about the same as an Int.
+CALIBRATED = CostModel({Int: 1, Var: 2, Array: 5, Call: 7}, arg=1)
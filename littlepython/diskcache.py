@@ -0,0 +1,125 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import zlib
+
+from littlepython.version import version
+
+# Every entry starts with MAGIC, the version of its format and the digest of the key it was stored under, followed by
+# the CRC32 of the payload. An entry which doesn't match all of them is compiled again.
+MAGIC = b"LPC"
+FORMAT = 1
+KEY_START = len(MAGIC) + 1
+CRC_START = KEY_START + 32
+HEADER_SIZE = CRC_START + 4
+
+# The highest protocol every supported Python version can read.
+PICKLE_PROTOCOL = 4
+
+
+def entry_key(source, features, engine, optimize, inline, memoize, cost_model):
+    """Returns the digest which names the entry of a compiled program.
+
+    It covers everything the compiled program depends on: the source, the features, the options it was compiled with
+    and the version of littlepython, so a newer littlepython never loads an entry stored by an older one.
+    """
+    parts = [version, source, ",".join(sorted(feature.name for feature in features)), engine, optimize, inline,
+             memoize, cost_model.key()]
+    return hashlib.sha256(repr(parts).encode("utf-8")).digest()
+
+
+class DiskCache(object):
+    """Stores compiled programs as files in a directory, so they don't have to be compiled again after a restart.
+
+    An entry holds the pickled program, which is made of the AST the program was compiled from (see
+    littlepython.interpreter.reduce_program), compressed with zlib. Loading it skips tokenizing, parsing and
+    optimizing the source. Entries are written to a temporary file which is then renamed over the entry, so many
+    processes can share the directory and a reader never sees a half written entry. An entry which can't be read, is
+    corrupted or belongs to another key is counted in rebuilt and replaced.
+
+    Loading an entry unpickles it, which can run any code the entry contains. The CRC32 only catches damaged entries,
+    not ones which were changed on purpose, so the directory must only be writable by the user running littlepython.
+
+    Args:
+        directory (str): The directory to keep the entries in, it is created if it doesn't exist, only accessible by
+            its owner.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilt = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, binascii.hexlify(key).decode("ascii") + ".lpc")
+
+    def load(self, key):
+        """Returns the program stored under key, or None if there is no valid entry for it."""
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            program = self.decode(key, data)
+        except Exception:
+            # Whatever is wrong with the entry, compiling the program again replaces it.
+            with self.lock:
+                self.rebuilt += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return program
+
+    def store(self, key, program):
+        """Stores program under key.
+
+        A program which can't be pickled, or a directory which can't be written to, leaves the program uncached.
+        """
+        try:
+            payload = zlib.compress(pickle.dumps(program, PICKLE_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        data = MAGIC + struct.pack(">B", FORMAT) + key + struct.pack(">I", zlib.crc32(payload)) + payload
+        try:
+            os.makedirs(self.directory, 0o700, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, self.path(key))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except (IOError, OSError):
+            pass
+
+    def decode(self, key, data):
+        if len(data) < HEADER_SIZE or data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not an entry of a compiled program.")
+        if struct.unpack(">B", data[len(MAGIC):KEY_START])[0] != FORMAT:
+            raise ValueError("The entry was stored in another format.")
+        if data[KEY_START:CRC_START] != key:
+            raise ValueError("The entry was stored under another key.")
+        payload = data[HEADER_SIZE:]
+        if zlib.crc32(payload) != struct.unpack(">I", data[CRC_START:HEADER_SIZE])[0]:
+            raise ValueError("The entry is corrupted.")
+        return pickle.loads(zlib.decompress(payload))
+
+    def clear(self):
+        """Removes every entry from the directory."""
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".lpc"):
+                    os.remove(os.path.join(self.directory, name))
@@ -18,3 +18,7 @@ class InvalidSyntaxException(LittlePythonBaseExcetion):
 
 class DivisionByZeroException(LittlePythonBaseExcetion):
     pass
+
+
+class CallDepthExceededException(LittlePythonBaseExcetion):
+    pass
@@ -19,6 +19,16 @@ class Feature(object):
     def __sub__(self, other):
         return FeatureSet(self) - other
 
+    def __eq__(self, other):
+        # Features are compared by name so a Feature is still the same feature after it is pickled.
+        return isinstance(other, Feature) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.name)
+
     def __str__(self):
         return self.name
 
@@ -32,7 +42,7 @@ class FeatureSet(object):
         if isinstance(val, FeatureSet):
             val = val.val
         assert isinstance(val, Iterable)
-        self.val = set(val)
+        self.val = frozenset(val)
 
     def __contains__(self, item):
         return FeatureSet(item).val - self.val == set()
@@ -45,6 +55,15 @@ class FeatureSet(object):
     def __sub__(self, other):
         return FeatureSet(self.val - FeatureSet(other).val)
 
+    def __eq__(self, other):
+        return isinstance(other, FeatureSet) and self.val == other.val
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.val)
+
     def __str__(self):
         return "<FeatureSet " + ",".join(map(str, self.val)) + ">"
 
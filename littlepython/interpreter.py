@@ -3,18 +3,21 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import random
+import sys
 from copy import copy
 
-from collections import defaultdict
+from collections import defaultdict, deque
 
-from multiprocessing import Lock
-
-from littlepython.ast import SetArrayItem, GetArrayItem, ForLoop, FunctionDef, Call, Function
+from littlepython.ast import Function, Block, ControlBlock, ForLoop, Return, If, iter_child_nodes
+from littlepython.batch import Batched
+from littlepython.cost import UNIFORM
 from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
-from littlepython.parser import Assign, Block, ControlBlock, If, BinaryOp, UnaryOp
 from littlepython.feature import Features
 
 
+EXECUTION_COUNT_EXCEEDED_MSG = "Running this program would require more operations than allowed."
+
+
 class Array(defaultdict):
     def __init__(self, *args):
         super(Array, self).__init__(int)
@@ -54,8 +57,122 @@ def convert_lp_type_to_python_type(var):
     return copy(var)
 
 
-class StopFunc(Exception):
-    pass
+def load_state(static_vars):
+    """Converts the static vars passed to a run into the initial global state."""
+    state = {}
+    if static_vars is not None:
+        for key, var in static_vars.items():
+            state[key] = convert_python_type_to_lp_type(var)
+    return state
+
+
+def dump_state(state):
+    """Converts the global state at the end of a run into the returned end state."""
+    end_state = {}
+    for key, var in state.items():
+        # Names starting with $ are temporaries added by the optimizer, a program can't use them.
+        if isinstance(var, Function) or key.startswith("$"):
+            continue
+        else:
+            end_state[key] = convert_lp_type_to_python_type(var)
+    return end_state
+
+
+def reduce_program(program, *args):
+    """Returns how pickle rebuilds a program: by creating it again from its AST, features and args.
+
+    The engines keep compiled code and caches that can't be pickled, so only what a program was created from is
+    pickled, along with the parts of the program the Compiler's optimizer removed.
+    """
+    state = {"removed": program.removed} if "removed" in program.__dict__ else None
+    return type(program), (program.ast, program.features) + args, state
+
+
+def call_plan(node, func):
+    """Returns the names of the params the args of the Call node are bound to when it calls func.
+
+    The plan is kept in the node's inline cache along with the function it was made for, so calling the same function
+    again skips checking the args and building the plan. Calling a different function, after the name has been
+    rebound, replaces the cache.
+
+    The cache lives in the shared AST, so runs in other threads write it too. That is harmless: the cache is replaced
+    as a whole by a single assignment and read once, and the plan only depends on the function it is stored with, so
+    any cache a run reads is a correct one. At worst a run builds a plan another thread just built.
+    """
+    cache = node.cache
+    if cache is None or cache[0] is not func:
+        # make sure that the arglist length matches the func signature
+        assert len(func.sig.params) == len(node.arglist)
+        cache = node.cache = (func, tuple(param.value for param in func.sig.params))
+    return cache[1]
+
+
+def plan_block(node, cost_model=UNIFORM):
+    """Splits the children of a Block into basic blocks, returning a (charge, statements) pair for each one.
+
+    A basic block runs straight through, so all of its operations are charged up front. It ends after a statement
+    which has blocks of its own, which are charged as they run, and a return ends the last one.
+    """
+    plan = []
+    charge = cost_model.node_cost(node)  # The operations for the block itself.
+    statements = []
+    for child in node.children:
+        charge += cost_model.entry_cost(child)
+        statements.append(child)
+        if type(child) is Return:
+            break
+        if type(child) in (Block, ControlBlock, ForLoop):
+            plan.append((charge, tuple(statements)))
+            charge, statements = 0, []
+    if statements or not plan:
+        plan.append((charge, tuple(statements)))
+    return tuple(plan)
+
+
+class Returned(object):
+    """Signals that a return statement ran, it is passed back up through the enclosing statements to the call.
+
+    Returning it instead of raising an exception keeps returns cheap, and keeps the returned value out of the
+    variables of the program.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class RecordedRandom(object):
+    """Wraps the random number generator of a run, keeping every number it draws so the run can be replayed."""
+    def __init__(self, random):
+        self.random = random
+        self.draws = []
+
+    def randint(self, a, b):
+        value = self.random.randint(a, b)
+        self.draws.append(value)
+        return value
+
+
+class ReplayedRandom(object):
+    """Draws the numbers a RecordedRandom drew again, and then goes on drawing from its random number generator."""
+    def __init__(self, recorded):
+        self.random = recorded.random
+        self.draws = deque(recorded.draws)
+
+    def randint(self, a, b):
+        if self.draws:
+            return self.draws.popleft()
+        return self.random.randint(a, b)
+
+
+def replayable(random, random_var):
+    """Returns the random number generator for a run which might have to be replayed, see LPProg.replay."""
+    return RecordedRandom(random) if random_var else random
+
+
+def replayed(random):
+    """Returns the random number generator for the replay of a run which ran with random, see replayable."""
+    return ReplayedRandom(random) if type(random) is RecordedRandom else random
 
 
 class SymbolTable(object):
@@ -134,8 +251,40 @@ class ScopedSymbolTable(SymbolTable):
         return copy(self.global_state)
 
 
-class LPProg(object):
-    # TODO: allow multithreaded execution.
+class Context(ScopedSymbolTable):
+    """The state of a single run of an LPProg.
+
+    Besides the scopes and variables of the run it holds the handlers the run uses, the operations it has left and
+    the random number generator for rand.
+    """
+    def __init__(self, global_state, handlers, count_remaining, random):
+        super(Context, self).__init__(global_state)
+        self.handlers = handlers
+        self.count_remaining = count_remaining
+        self.random = random
+
+    def charge(self, count):
+        self.count_remaining -= count
+        if self.count_remaining <= 0:
+            raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+
+
+class LPProg(Batched):
+    """Runs a program by walking its AST.
+
+    Every node a run evaluates is one operation, or as many as the cost_model (a littlepython.cost.CostModel) says it
+    is, and a run with a positive max_op_count raises ExecutionCountExceededException when its operations reach
+    max_op_count. The operations are charged once at the start of each basic block (see plan_block) instead of one at
+    a time, so a run which completes does so for exactly the same max_op_count as it would counting node by node.
+    Charging up front can raise ExecutionCountExceededException before the run would have failed in another way part
+    way through the basic block, or in a function called from it. So a run which raises it is replayed one node at a
+    time, see replay, which raises whatever counting node by node raises. A run without a max_op_count doesn't count
+    operations at all.
+
+    Everything a run changes is kept in the run's Context. The only part of the program a run writes to is the inline
+    cache of each Call node, see call_plan, which is safe to share. So the same LPProg can be run from many threads at
+    once, or from inside one of its own runs, without a lock.
+    """
     binaryOps = {"+": lambda a, b: a + b,
                  "-": lambda a, b: a - b,
                  "*": lambda a, b: a * b,
@@ -154,134 +303,218 @@ class LPProg(object):
                 "+": lambda a: a,
                 "-": lambda a: -a}
 
-    def __init__(self, ast, features):
+    def __init__(self, ast, features, cost_model=UNIFORM):
         self.ast = ast
         self.features = features
-        self.running_lock = Lock()
-        self.count_remaining = -1
+        self.cost_model = cost_model
         self.random = random
+        self.random_var = Features.RANDOM_VAR in features
+        # Maps each type of node in the AST to its handler.
+        self.dispatch = {}
+        # The handlers used for runs with a max_op_count, the nodes with blocks in them are charged by basic block.
+        self.budget_dispatch = {}
+        # The handlers used to replay a run, which charge every node as it is evaluated.
+        self.exact_dispatch = {}
+        # Maps the id of each node with blocks in it to how it is charged, see the budget_ handlers.
+        self.plans = {}
+        self.validate(ast)
+
+    def validate(self, node):
+        """Checks the structure of the AST and looks up the handler for every type of node in it.
+
+        This is done once when the program is loaded so handle doesn't have to look up handlers or check nodes.
+        """
+        node_type = type(node)
+        if node_type not in self.dispatch:
+            name = 'handle_' + node_type.__name__.lower()
+            handler = getattr(self, name, None)
+            if handler is None:
+                raise NotImplementedError("No {} found.".format(name))
+            self.dispatch[node_type] = handler
+            self.budget_dispatch[node_type] = getattr(self, 'budget_' + node_type.__name__.lower(), handler)
+            self.exact_dispatch[node_type] = self.exact(handler)
+        costs = self.cost_model
+        if node_type is Block:
+            self.plans[id(node)] = plan_block(node, costs)
+        elif node_type is ControlBlock:
+            for _if in node.ifs:
+                assert isinstance(_if, If)
+            # The first ctrl is charged by the enclosing block.
+            ifs = tuple((0 if i == 0 else costs.cost(_if.ctrl), _if.ctrl, costs.entry_cost(_if.block), _if.block)
+                        for i, _if in enumerate(node.ifs))
+            self.plans[id(node)] = (ifs, costs.entry_cost(node.else_block), node.else_block)
+        elif node_type is ForLoop:
+            # The init is charged by the enclosing block and the inc is charged along with the next ctrl.
+            self.plans[id(node)] = (costs.cost(node.ctrl), costs.entry_cost(node.block),
+                                    costs.cost(node.inc) + costs.cost(node.ctrl))
+        for child in iter_child_nodes(node):
+            self.validate(child)
+
+    def exact(self, handler):
+        """Returns a handler which charges for the node before handler evaluates it."""
+        node_cost = self.cost_model.node_cost
+
+        def charged(node, ctx):
+            ctx.charge(node_cost(node))
+            return handler(node, ctx)
+        return charged
 
     def handle_noop(self, *args, **kwargs):
         pass
 
-    def handle_var(self, node, sym_tbl):
-        if node.value == "rand" and Features.RANDOM_VAR in self.features:
-            return self.random.randint(-2147483647, 2147483647)
-        return sym_tbl[node.value]
+    def handle_var(self, node, ctx):
+        if self.random_var and node.value == "rand":
+            return ctx.random.randint(-2147483647, 2147483647)
+        return ctx[node.value]
 
-    def handle_int(self, node, sym_tbl):
+    def handle_int(self, node, ctx):
         return node.value
 
-    def handle_array(self, node, sym_tbl):
+    def handle_array(self, node, ctx):
         # array =
         # for i, val in enumerate(node.vals):
-        #     array[i] = self.handle(node, sym_tbl)
-        return Array(self.handle(val, sym_tbl) for val in node.vals)
+        #     array[i] = self.handle(node, ctx)
+        return Array(self.handle(val, ctx) for val in node.vals)
+
+    def handle_assign(self, node, ctx):
+        ctx[node.left.value] = self.handle(node.right, ctx)
 
-    def handle_assign(self, node, sym_tbl):
-        assert isinstance(node, Assign)
-        sym_tbl[node.left.value] = self.handle(node.right, sym_tbl)
+    # Statements return None, or a Returned if a return statement ran which ends the enclosing function.
 
-    def handle_block(self, node, sym_tbl):
-        assert isinstance(node, Block)
+    def handle_block(self, node, ctx):
         for child in node.children:
-            self.handle(child, sym_tbl)
+            rtn = self.handle(child, ctx)
+            if type(rtn) is Returned:
+                return rtn
 
-    def handle_controlblock(self, node, sym_tbl):
-        assert isinstance(node, ControlBlock)
+    def handle_controlblock(self, node, ctx):
         for _if in node.ifs:
-            assert isinstance(_if, If)
-            if self.handle(_if.ctrl, sym_tbl):
-                self.handle(_if.block, sym_tbl)
-                return
-        self.handle(node.else_block, sym_tbl)
-
-    def handle_forloop(self, node, sym_tbl):
-        assert isinstance(node, ForLoop)
-        self.handle(node.init, sym_tbl)
-        while self.handle(node.ctrl, sym_tbl):
-            self.handle(node.block, sym_tbl)
-            self.handle(node.inc, sym_tbl)
-
-    def handle_binaryop(self, node, sym_tbl):
-        assert isinstance(node, BinaryOp)
+            if self.handle(_if.ctrl, ctx):
+                return self.handle(_if.block, ctx)
+        return self.handle(node.else_block, ctx)
+
+    def handle_forloop(self, node, ctx):
+        self.handle(node.init, ctx)
+        while self.handle(node.ctrl, ctx):
+            rtn = self.handle(node.block, ctx)
+            if rtn is not None:
+                return rtn
+            self.handle(node.inc, ctx)
+
+    def budget_block(self, node, ctx):
+        for charge, statements in self.plans[id(node)]:
+            ctx.charge(charge)
+            for child in statements:
+                rtn = self.handle(child, ctx)
+                if type(rtn) is Returned:
+                    return rtn
+
+    def budget_controlblock(self, node, ctx):
+        ifs, else_charge, else_block = self.plans[id(node)]
+        for ctrl_charge, ctrl, block_charge, block in ifs:
+            ctx.charge(ctrl_charge)
+            if self.handle(ctrl, ctx):
+                ctx.charge(block_charge)
+                return self.handle(block, ctx)
+        ctx.charge(else_charge)
+        return self.handle(else_block, ctx)
+
+    def budget_forloop(self, node, ctx):
+        ctrl_charge, block_charge, inc_charge = self.plans[id(node)]
+        self.handle(node.init, ctx)
+        ctx.charge(ctrl_charge)
+        while self.handle(node.ctrl, ctx):
+            ctx.charge(block_charge)
+            rtn = self.handle(node.block, ctx)
+            if rtn is not None:
+                return rtn
+            ctx.charge(inc_charge)
+            self.handle(node.inc, ctx)
+
+    def handle_binaryop(self, node, ctx):
         try:
-            return self.binaryOps[node.op.value](self.handle(node.left, sym_tbl), self.handle(node.right, sym_tbl))
+            return self.binaryOps[node.op.value](self.handle(node.left, ctx), self.handle(node.right, ctx))
         except ZeroDivisionError:
             raise DivisionByZeroException()
 
-    def handle_unaryop(self, node, sym_tbl):
-        assert isinstance(node, UnaryOp)
-        return self.unaryOps[node.op.value](self.handle(node.right, sym_tbl))
+    def handle_unaryop(self, node, ctx):
+        return self.unaryOps[node.op.value](self.handle(node.right, ctx))
 
-    def handle_getarrayitem(self, node, sym_tbl):
-        assert isinstance(node, GetArrayItem)
-        var = self.handle(node.left, sym_tbl)
-        return var[self.handle(node.right, sym_tbl)]
+    def handle_getarrayitem(self, node, ctx):
+        var = self.handle(node.left, ctx)
+        return var[self.handle(node.right, ctx)]
 
-    def handle_setarrayitem(self, node, sym_tbl):
-        assert isinstance(node, SetArrayItem)
-        var = self.handle(node.left, sym_tbl)
-        var[self.handle(node.right, sym_tbl)] = self.handle(node.expr, sym_tbl)
+    def handle_setarrayitem(self, node, ctx):
+        var = self.handle(node.left, ctx)
+        var[self.handle(node.right, ctx)] = self.handle(node.expr, ctx)
 
-    def handle_functiondef(self, node, sym_tbl):
-        assert isinstance(node, FunctionDef)
-        sym_tbl[node.name.value] = node.function
+    def handle_functiondef(self, node, ctx):
+        ctx[node.name.value] = node.function
 
-    def handle_call(self, node, sym_tbl):
-        assert isinstance(node, Call)
+    def handle_call(self, node, ctx):
         # Look up variable that contains the function.
-        func = sym_tbl[node.func.value]
-        # make sure that the arglist length matches the func signature
-        assert len(func.sig.params) == len(node.arglist)
-        args_copy = []
-        for var in node.arglist:
-            args_copy += [self.handle(var, sym_tbl)]
+        func = ctx.resolve(node.func.value)
+        params = call_plan(node, func)
+        args = [self.handle(arg, ctx) for arg in node.arglist]
+
+        ctx.enter_scope()
+
+        for param, arg in zip(params, args):
+            ctx.set(param, arg)
+
+        # Now run the function, a function which doesn't return a value returns 0.
+        rtn = self.handle(func.block, ctx)
+        ctx.exit_scope()
+        return 0 if rtn is None else rtn.value
 
-        sym_tbl.enter_scope()
+    def handle_return(self, node, ctx):
+        return Returned(self.handle(node.expr, ctx))
 
-        for arg, param in zip(args_copy, func.sig.params):
-            sym_tbl[param.value] = arg
+    def handle(self, node, ctx):
+        return ctx.handlers[type(node)](node, ctx)
 
-        # Now run the function
+    def context(self, static_vars=None, max_op_count=-1, random=None):
+        """Returns a new Context for a run of the program."""
+        handlers = self.budget_dispatch if max_op_count > 0 else self.dispatch
+        return Context(load_state(static_vars), handlers, max_op_count, self.random if random is None else random)
+
+    def execute(self, ctx):
+        """Runs the program in ctx, which can only be used for one run."""
+        self.handle(self.ast, ctx)
+
+    def replay(self, static_vars, max_op_count, random):
+        """Runs the program from the start charging every node as it is evaluated, and returns its Context.
+
+        random has to draw the same numbers the run which is replayed drew, see replayed.
+        """
+        ctx = Context(load_state(static_vars), self.exact_dispatch, max_op_count, random)
+        self.execute(ctx)
+        return ctx
+
+    def counted_run(self, static_vars, max_op_count, random):
+        """Runs the program with a positive max_op_count and returns its Context."""
+        random = replayable(self.random if random is None else random, self.random_var)
+        ctx = self.context(static_vars, max_op_count, random)
         try:
-            self.handle(func.block, sym_tbl)
-        except StopFunc:
-            pass  # This means we hit a return statement
-        rtn = sym_tbl["return"]
-        sym_tbl.exit_scope()
-        return rtn
-
-    def handle_return(self, node, sym_tbl):
-        sym_tbl["return"] = self.handle(node.expr, sym_tbl)
-        raise StopFunc()
-
-    def handle(self, node, sym_tbl):
-        self.count_remaining -= 1
-        if self.count_remaining == 0:
-            raise ExecutionCountExceededException("Running this program would require more operations than allowed.")
-        name = 'handle_' + type(node).__name__.lower()
-        handler = getattr(self, name, None)
-        if handler is None:
-            raise NotImplementedError("No {} found.".format(name))
-        return handler(node, sym_tbl)
+            self.execute(ctx)
+        except ExecutionCountExceededException:
+            return self.replay(static_vars, max_op_count, replayed(random))
+        return ctx
 
     def run(self, static_vars=None, max_op_count=-1, random=None):
-        with self.running_lock:
-            self.count_remaining = max_op_count
-            if random is not None:
-                self.random = random
-            state = {}
-            if static_vars is not None:
-                for key, var in static_vars.items():
-                    state[key] = convert_python_type_to_lp_type(var)
-            sym_tbl = ScopedSymbolTable(state)
-            self.handle(self.ast, sym_tbl)
-            end_state = {}
-            for key, var in sym_tbl.dump_cur_state().items():
-                if isinstance(var, Function):
-                    continue
-                else:
-                    end_state[key] = convert_lp_type_to_python_type(var)
-
-            return end_state
+        if max_op_count > 0:
+            ctx = self.counted_run(static_vars, max_op_count, random)
+        else:
+            ctx = self.context(static_vars, max_op_count, random)
+            self.execute(ctx)
+        return dump_state(ctx.dump_cur_state())
+
+    def run_counted(self, static_vars=None, max_op_count=-1, random=None):
+        """Runs the program like run and returns its end state along with the number of operations it used."""
+        # A run without a max_op_count isn't counted, so it is given one it can't use up.
+        count = max_op_count if max_op_count > 0 else sys.maxsize
+        ctx = self.counted_run(static_vars, count, random)
+        return dump_state(ctx.dump_cur_state()), count - ctx.count_remaining
+
+    def __reduce__(self):
+        return reduce_program(self, self.cost_model)
@@ -1,20 +1,177 @@
 # Copyright (C) Jonathan Beaulieu (beau0307@d.umn.edu)
-from littlepython.feature import Features
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
+from functools import partial
+
+from littlepython.closure import ClosureProg
+from littlepython.codegen import PythonProg
+from littlepython.cost import UNIFORM
+from littlepython.diskcache import DiskCache, entry_key
+from littlepython.feature import Features, FeatureSet
 from littlepython.interpreter import LPProg
+from littlepython.optimizer import optimize as optimize_ast, Inliner, InlinedProg
 from littlepython.parser import Parser
+from littlepython.stack import StackProg
 from littlepython.tokenizer import Tokenizer
+from littlepython.version import version
+from littlepython.vm import VMProg
+
+
+ENGINES = {"interpreter": LPProg,
+           "closure": ClosureProg,
+           "python": PythonProg,
+           "stack": StackProg,
+           "vm": VMProg}
+
+# The counters of a Compiler's cache, see Compiler.cache_info.
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "size", "max_size"])
 
 
 class Compiler(object):
-    def compile(self, prog, features=Features.ALL):
-        """Currently this compiler simply returns an interpreter instead of compiling
-        TODO: Write this compiler to increase LPProg run speed and to prevent exceeding maximum recursion depth
+    """Compiles programs, keeping the most recently compiled ones in a cache.
+
+    Compiling the same source with the same features and options again returns the program from the cache instead of
+    tokenizing and parsing the source again. A compiled program can be run any number of times, from any number of
+    threads, so the cached program is shared by everyone who compiles its source.
+
+    With a cache_dir the compiled programs are also stored on disk, like .pyc files, so compiling a source after a
+    restart loads the program from there instead. See littlepython.diskcache.DiskCache, available as disk_cache.
+    Loading a program from cache_dir unpickles it, so the directory must be trusted and private: anyone who can write
+    to it can make the Compiler run their code.
+
+    Args:
+        cache_size (int): The number of compiled programs to keep, the least recently used one is evicted when the
+            cache is full. 0 turns the cache off.
+        cache_dir (str): The directory to store compiled programs in, None to only keep them in memory. It is created
+            with permissions for its owner only if it doesn't exist.
+    """
+    def __init__(self, cache_size=128, cache_dir=None):
+        self.cache_size = cache_size
+        self.disk_cache = None if cache_dir is None else DiskCache(cache_dir)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, prog, features=Features.ALL, engine="closure", optimize=False, inline=False,
+                memoize=False, cost_model=UNIFORM):
+        """Compiles a program into a runnable program object.
+
+        The "closure" engine (the default) compiles every node of the program into a Python closure once so running
+        the program doesn't pay for interpreting the AST on every evaluation.
+        The "python" engine translates the program into Python source code and compiles that with the built-in
+        compile(), which gives the lowest cost per operation but charges max_op_count per basic block.
+        The "stack" engine keeps LP calls on an explicit stack instead of the Python stack, so deeply recursive
+        programs are only limited by its max_call_depth and not by Python's maximum recursion depth. Its state is
+        explicit, so it can also run a program as an asyncio coroutine with StackProg.run_async, or pause a run
+        which used up its max_op_count and resume it later, see the suspend argument of StackProg.run.
+        The "vm" engine compiles the program to instructions for a register based virtual machine, which also keeps
+        LP calls off the Python stack. Use littlepython.vm.dis to see the instructions.
+        The "interpreter" engine returns the tree-walking LPProg.
+
+        With optimize the parsed program is simplified before it is handed to the engine, see
+        littlepython.optimizer. The end state of an optimized program is the same, and it usually runs fewer
+        operations, so it can finish within a max_op_count that the original program would exceed. That isn't
+        guaranteed: a for loop which runs zero or one times can use more operations, since the temporaries and the
+        guard added to hoist its invariant expressions cost more than they save. The parts of the program the
+        optimizer removed are listed in the removed attribute of the returned program, as
+        littlepython.optimizer.Removal tuples.
+
+        With inline calls to small functions are replaced by the expression the function returns, see
+        littlepython.optimizer.Inliner. Like optimize this lowers the op count of a program. The returned program falls
+        back to running the program without inlined calls if the static vars of a run contain one of the names the
+        inlined functions assign to.
+
+        Every program can also be run for a whole batch of static vars at once with run_batch, which evaluates simple
+        programs over numpy vectors when numpy is installed, see littlepython.batch.
 
         Args:
             prog (str): A string containing the program.
             features (FeatureSet): The set of features to enable during compilation.
+            engine (str): The name of the engine (one of ENGINES) to compile the program for.
+            optimize (bool): Whether to run the optimization passes over the program.
+            inline (bool): Whether to inline calls to small functions.
+            memoize (bool): Whether to cache the results of pure functions during a run, only the "closure" engine
+                supports this. See ClosureProg.
+            cost_model (CostModel): The number of operations each node charges against max_op_count, only the
+                "interpreter" engine supports models other than littlepython.cost.UNIFORM. See
+                littlepython.cost.CALIBRATED for costs which follow the time each node takes.
 
         Returns:
-            LPProg
+            A program object with a run method, eg. ClosureProg, PythonProg, StackProg, VMProg or LPProg
         """
-        return LPProg(Parser(Tokenizer(prog, features), features).program(), features)
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine {}, expected one of: {}".format(engine, ", ".join(sorted(ENGINES))))
+        if memoize and engine != "closure":
+            raise ValueError("The {} engine can't memoize functions, only the closure engine can.".format(engine))
+        if cost_model != UNIFORM and engine != "interpreter":
+            raise ValueError("The {} engine only counts one operation per node, only the interpreter engine can use "
+                             "another cost model.".format(engine))
+        features = FeatureSet(features)
+        if self.cache_size > 0:
+            key = (hashlib.sha256(prog.encode("utf-8")).digest(), features, version, engine, optimize, inline, memoize,
+                   cost_model)
+            with self.lock:
+                program = self.cache.get(key)
+                if program is not None:
+                    self.hits += 1
+                    self.cache.move_to_end(key)
+                    return program
+                self.misses += 1
+        # Compile outside of the lock, so threads compiling different programs don't wait for each other.
+        program = None
+        if self.disk_cache is not None:
+            disk_key = entry_key(prog, features, engine, optimize, inline, memoize, cost_model)
+            program = self.disk_cache.load(disk_key)
+        if program is None:
+            program = self.build(prog, features, engine, optimize, inline, memoize, cost_model)
+            if self.disk_cache is not None:
+                self.disk_cache.store(disk_key, program)
+        if self.cache_size > 0:
+            with self.lock:
+                self.cache[key] = program
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                    self.evictions += 1
+        return program
+
+    def build(self, prog, features, engine, optimize, inline, memoize, cost_model):
+        """Compiles a program without looking in the cache, see compile."""
+        ast = Parser(Tokenizer(prog, features), features).program()
+        removed = []
+        inliner = Inliner(removed)
+        if inline:
+            ast = inliner.run(ast)
+        if optimize:
+            ast = optimize_ast(ast, removed)
+        if memoize:
+            program = ClosureProg(ast, features, memoize=True)
+        elif cost_model != UNIFORM:
+            program = LPProg(ast, features, cost_model)
+        else:
+            program = ENGINES[engine](ast, features)
+        program.removed = removed
+        if inliner.assumed_names:
+            # A partial, unlike a lambda, can be pickled along with the program.
+            program = InlinedProg(program, inliner.assumed_names,
+                                  partial(self.compile, prog, features, engine, optimize=optimize, memoize=memoize,
+                                          cost_model=cost_model))
+        return program
+
+    def cache_info(self):
+        """Returns the CacheInfo of the cache."""
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, len(self.cache), self.cache_size)
+
+    def clear_cache(self):
+        """Empties the cache and resets its counters."""
+        with self.lock:
+            self.cache.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __reduce__(self):
+        # The programs cached in memory and the lock aren't pickled along with the Compiler, eg. in the fallback of an
+        # InlinedProg.
+        return Compiler, (self.cache_size, None if self.disk_cache is None else self.disk_cache.directory)
@@ -0,0 +1,754 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
+
+from littlepython.ast import Int, Var, NoOp, Array, BinaryOp, UnaryOp, Block, ControlBlock, If, Return, Call, Assign, \
+    SetArrayItem, GetArrayItem, FunctionDef, ForLoop, iter_child_nodes
+from littlepython.batch import Batched
+from littlepython.interpreter import LPProg
+from littlepython.tokenizer import Token, TokenTypes
+
+
+ARITHMETIC_OPS = ("+", "-", "*", "/", "%")
+COMPARISON_OPS = ("is", "is not", "<", ">", "<=", ">=")
+
+# Names of the temporaries the optimizer adds start with this, it can't start a name in a program.
+TEMP_PREFIX = "$"
+
+# An entry in the report of an optimization pass, code is the source of the part of the program which was removed.
+Removal = namedtuple("Removal", ["reason", "code"])
+
+
+def const(value):
+    return Int(Token(TokenTypes.INT, value))
+
+
+def var(name):
+    return Var(Token(TokenTypes.VAR, name))
+
+
+def assign(name, expr):
+    return Assign(Token(TokenTypes.ASSIGN, "="), var(name), expr)
+
+
+def is_const(node, value=None):
+    """Returns True if node is a literal, with the given value if there is one."""
+    if type(node) is not Int:
+        return False
+    return value is None or (type(node.value) is type(value) and node.value == value)
+
+
+def is_int(node):
+    """Returns True if node always evaluates to an int (and never to a bool or an array), or raises."""
+    if type(node) is Int:
+        return type(node.value) is int
+    if type(node) is BinaryOp:
+        if node.op.value in ARITHMETIC_OPS:
+            return True
+        if node.op.value in ("and", "or"):
+            return is_int(node.left) and is_int(node.right)
+    if type(node) is UnaryOp:
+        return node.op.value == "-" or node.op.value == "+" and is_int(node.right)
+    return False
+
+
+def is_bool(node):
+    """Returns True if node always evaluates to a bool, or raises."""
+    if type(node) is Int:
+        return type(node.value) is bool
+    if type(node) is BinaryOp:
+        if node.op.value in COMPARISON_OPS:
+            return True
+        if node.op.value in ("and", "or"):
+            return is_bool(node.left) and is_bool(node.right)
+    if type(node) is UnaryOp:
+        return node.op.value == "not" or node.op.value == "+" and is_bool(node.right)
+    return False
+
+
+def always_returns(node):
+    """Returns True if every way through the statement ends in a return."""
+    if type(node) is Return:
+        return True
+    if type(node) is Block:
+        return any(map(always_returns, node.children))
+    if type(node) is ControlBlock:
+        return all(always_returns(_if.block) for _if in node.ifs) and always_returns(node.else_block)
+    return False
+
+
+def referenced_names(node, names=None):
+    """Returns the set of names the node reads, including the names of the functions it calls."""
+    if names is None:
+        names = set()
+    if type(node) is Var:
+        names.add(node.value)
+    elif type(node) is Call:
+        names.add(node.func.value)
+    for child in iter_child_nodes(node):
+        referenced_names(child, names)
+    return names
+
+
+def walk(node):
+    """Yields node and every node below it, including the nodes iter_child_nodes leaves out."""
+    yield node
+    if type(node) is Assign:
+        yield node.left
+    elif type(node) is Call:
+        yield node.func
+    elif type(node) is FunctionDef:
+        yield node.name
+    for child in iter_child_nodes(node):
+        for descendant in walk(child):
+            yield descendant
+
+
+def assigned_names(node):
+    """Returns the set of names the node assigns to or defines a function as."""
+    names = set()
+    for descendant in walk(node):
+        if type(descendant) is Assign:
+            names.add(descendant.left.value)
+        elif type(descendant) is FunctionDef:
+            names.add(descendant.name.value)
+    return names
+
+
+def contains(node, *node_types):
+    return any(type(descendant) in node_types for descendant in walk(node))
+
+
+def reads_rand(node):
+    return any(type(descendant) is Var and descendant.value == "rand" for descendant in walk(node))
+
+
+def top_level_assigned_names(node, names=None):
+    """Returns the set of names the top level code assigns to, these are the only names which become globals."""
+    if names is None:
+        names = set()
+    if type(node) is Assign:
+        names.add(node.left.value)
+    elif type(node) is FunctionDef:
+        names.add(node.name.value)
+        return names
+    for child in iter_child_nodes(node):
+        top_level_assigned_names(child, names)
+    return names
+
+
+class Transformer(object):
+    """Walks an AST bottom up letting each visit_<node type> method replace the node it is given.
+
+    Nodes without a visit method of their own just have their children visited. The AST is changed in place. Every
+    part of the program a pass removes is added to report as a Removal.
+    """
+    def __init__(self, report=None):
+        self.report = [] if report is None else report
+
+    def removed(self, reason, node):
+        self.report.append(Removal(reason, str(node)))
+
+    def run(self, ast):
+        return self.visit(ast)
+
+    def visit(self, node):
+        visitor = getattr(self, 'visit_' + type(node).__name__.lower(), self.generic_visit)
+        return visitor(node)
+
+    def generic_visit(self, node):
+        node_type = type(node).__name__
+        if node_type in ("BinaryOp", "GetArrayItem"):
+            node.left = self.visit(node.left)
+            node.right = self.visit(node.right)
+        elif node_type in ("Assign", "UnaryOp"):
+            node.right = self.visit(node.right)
+        elif node_type == "Block":
+            node.children = [self.visit(child) for child in node.children]
+        elif node_type == "Array":
+            node.vals = [self.visit(val) for val in node.vals]
+        elif node_type == "ControlBlock":
+            for _if in node.ifs:
+                _if.ctrl = self.visit(_if.ctrl)
+                _if.block = self.visit(_if.block)
+            node.else_block = self.visit(node.else_block)
+        elif node_type == "ForLoop":
+            node.init = self.visit(node.init)
+            node.ctrl = self.visit(node.ctrl)
+            node.block = self.visit(node.block)
+            node.inc = self.visit(node.inc)
+        elif node_type == "SetArrayItem":
+            node.left = self.visit(node.left)
+            node.expr = self.visit(node.expr)
+            node.right = self.visit(node.right)
+        elif node_type == "Call":
+            node.arglist = [self.visit(arg) for arg in node.arglist]
+        elif node_type == "Return":
+            node.expr = self.visit(node.expr)
+        elif node_type == "FunctionDef":
+            node.function.block = self.visit(node.function.block)
+        return node
+
+
+class ConstantFolder(Transformer):
+    """Evaluates operations on literals at compile time and simplifies operations which don't change their operand.
+
+    Folding uses the same operators as LPProg so the results are identical, including comparisons resulting in bools.
+    Divisions and modulos by a literal zero are left alone so the DivisionByZeroException is raised when (and only if)
+    the program reaches them. Identities like x + 0 and x * 1 are only simplified when x is known to be an int,
+    because True + 0 is 1 and [1] + 0 raises. The ctrl of an if or a for loop only has to be truthy, so not not x is
+    simplified to x there. If arms whose ctrl is a literal are pruned, as are control blocks which are left without
+    any arms.
+    """
+    def visit_binaryop(self, node):
+        node = self.generic_visit(node)
+        op = node.op.value
+        left, right = node.left, node.right
+        if is_const(left) and is_const(right):
+            if op in ("/", "%") and right.value == 0:
+                return node
+            return const(LPProg.binaryOps[op](left.value, right.value))
+        if op in ("+", "-") and is_const(right, 0) and is_int(left):
+            return left
+        if op == "+" and is_const(left, 0) and is_int(right):
+            return right
+        if op in ("*", "/") and is_const(right, 1) and is_int(left):
+            return left
+        if op == "*" and is_const(left, 1) and is_int(right):
+            return right
+        return node
+
+    def visit_unaryop(self, node):
+        node = self.generic_visit(node)
+        op = node.op.value
+        if is_const(node.right):
+            return const(LPProg.unaryOps[op](node.right.value))
+        if op == "+" and (is_int(node.right) or is_bool(node.right)):
+            return node.right
+        if op == "not" and type(node.right) is UnaryOp and node.right.op.value == "not" and is_bool(node.right.right):
+            return node.right.right
+        return node
+
+    def ctrl(self, node):
+        """Simplifies an expression which is only used for its truthiness."""
+        while type(node) is UnaryOp and node.op.value == "not" and type(node.right) is UnaryOp and \
+                node.right.op.value == "not":
+            node = node.right.right
+        return node
+
+    def visit_controlblock(self, node):
+        node = self.generic_visit(node)
+        ifs = []
+        else_block = node.else_block
+        for i, _if in enumerate(node.ifs):
+            ctrl = self.ctrl(_if.ctrl)
+            if is_const(ctrl):
+                if ctrl.value:
+                    for unreachable in node.ifs[i + 1:]:
+                        self.removed("an earlier condition is always true", unreachable)
+                    if node.else_block.children:
+                        self.removed("an earlier condition is always true", node.else_block)
+                    else_block = _if.block
+                    break
+                self.removed("the condition is always false", _if)
+                continue
+            ifs.append(If(ctrl, _if.block))
+        if not ifs:
+            # The block still counts as a node, just like the control block it replaces.
+            return else_block
+        return ControlBlock(ifs, else_block)
+
+    def visit_forloop(self, node):
+        node = self.generic_visit(node)
+        node.ctrl = self.ctrl(node.ctrl)
+        return node
+
+
+class DeadCodeEliminator(Transformer):
+    """Removes statements which can never run.
+
+    These are the statements following a statement which always returns and for loops whose ctrl is always false,
+    which are replaced by their init. A for loop without a ctrl never runs either, as the missing ctrl is falsy.
+    """
+    def visit_block(self, node):
+        node = self.generic_visit(node)
+        for i, child in enumerate(node.children):
+            if always_returns(child):
+                for unreachable in node.children[i + 1:]:
+                    self.removed("it follows a return", unreachable)
+                del node.children[i + 1:]
+                break
+        return node
+
+    def visit_forloop(self, node):
+        node = self.generic_visit(node)
+        if type(node.ctrl) is NoOp or is_const(node.ctrl) and not node.ctrl.value:
+            self.removed("the loop condition is always false", node)
+            return node.init
+        return node
+
+
+class UnusedFunctionEliminator(Transformer):
+    """Empties the body of every function which is never called or referred to by name.
+
+    The definitions are kept, because defining a function still replaces the value of a variable with the same name.
+    """
+    def run(self, ast):
+        self.names = referenced_names(ast)
+        return self.visit(ast)
+
+    def visit_functiondef(self, node):
+        if node.name.value not in self.names and node.function.block.children:
+            self.removed("the function is never used", node)
+            node.function.block = Block()
+            return node
+        return self.generic_visit(node)
+
+
+class LoopInvariantCodeMotion(Transformer):
+    """Moves the expressions of a for loop that give the same value on every iteration out of the loop.
+
+    An expression is invariant if it doesn't read rand or any variable the loop assigns to, and it only reads from
+    arrays if the loop doesn't set any array items. Loops which call a function are left alone, since the function
+    could assign to any global. Each invariant expression is evaluated once into a temporary before the loop, and
+    identical expressions share their temporary. The temporaries are left out of the end state of a run.
+
+    Only expressions the loop evaluates on every iteration are moved, otherwise hoisting x / y out of if y { ... }
+    could raise an error the program never would. Expressions from the ctrl are evaluated before the loop. Expressions
+    from the body and inc are evaluated behind an extra copy of the ctrl, so they are only evaluated when the loop runs
+    at least once, which means they can only be moved if the ctrl doesn't read rand. A program which raises an error in
+    a loop can raise it from a moved expression instead, if that is evaluated first.
+
+    Assigning the temporaries and evaluating the copy of the ctrl cost operations too, so a loop which runs zero or one
+    times uses more operations than before, and can exceed a max_op_count the original loop fit in.
+    """
+    def __init__(self, report=None):
+        super(LoopInvariantCodeMotion, self).__init__(report)
+        self.temps = 0
+
+    def visit_forloop(self, node):
+        node = self.generic_visit(node)
+        if contains(node, Call):
+            return node
+        self.written = assigned_names(node.ctrl) | assigned_names(node.block) | assigned_names(node.inc)
+        self.sets_items = contains(node.ctrl, SetArrayItem) or contains(node.block, SetArrayItem) or \
+            contains(node.inc, SetArrayItem)
+        self.hoisted = OrderedDict()
+
+        node.ctrl = self.hoist(node.ctrl)
+        ctrl_temps = list(self.hoisted.values())
+        if not any(type(n) is Var and n.value == "rand" for n in walk(node.ctrl)):
+            if not self.hoist_statements(node.block.children):
+                # Without a return in the body the inc is evaluated whenever the body is.
+                inc = [node.inc]
+                self.hoist_statements(inc)
+                node.inc = inc[0]
+        body_temps = list(self.hoisted.values())[len(ctrl_temps):]
+        if not self.hoisted:
+            return node
+
+        statements = [node.init] + [assign(name, expr) for name, expr in ctrl_temps]
+        if body_temps:
+            guard = If(deepcopy(node.ctrl), Block([assign(name, expr) for name, expr in body_temps]))
+            statements.append(ControlBlock([guard]))
+        node.init = NoOp()
+        statements.append(node)
+        return Block(statements)
+
+    def hoist_statements(self, statements):
+        """Hoists from the parts of the statements that are always evaluated, returns True if they can return."""
+        for i, statement in enumerate(statements):
+            statement_type = type(statement)
+            if statement_type is Block:
+                if self.hoist_statements(statement.children):
+                    return True
+                continue
+            if statement_type in (Assign, Return):
+                attr = "right" if statement_type is Assign else "expr"
+                setattr(statement, attr, self.hoist(getattr(statement, attr)))
+            elif statement_type is SetArrayItem:
+                statement.left = self.hoist(statement.left)
+                statement.expr = self.hoist(statement.expr)
+                statement.right = self.hoist(statement.right)
+            elif statement_type is ControlBlock:
+                statement.ifs[0].ctrl = self.hoist(statement.ifs[0].ctrl)
+            elif statement_type is ForLoop:
+                init = [statement.init]
+                self.hoist_statements(init)
+                statement.init = init[0]
+                statement.ctrl = self.hoist(statement.ctrl)
+            elif statement_type not in (FunctionDef, NoOp):
+                statements[i] = self.hoist(statement)
+            if contains(statement, Return):
+                return True
+        return False
+
+    def is_invariant(self, node):
+        for descendant in walk(node):
+            descendant_type = type(descendant)
+            if descendant_type is Var and (descendant.value == "rand" or descendant.value in self.written):
+                return False
+            if descendant_type is GetArrayItem and self.sets_items:
+                return False
+            if descendant_type not in (Int, Var, BinaryOp, UnaryOp, GetArrayItem):
+                return False
+        return True
+
+    def hoist(self, node):
+        """Replaces the largest invariant expressions in node with temporaries, returns the new node."""
+        node_type = type(node)
+        if node_type in (BinaryOp, UnaryOp, GetArrayItem) and self.is_invariant(node):
+            key = str(node)
+            if key not in self.hoisted:
+                self.hoisted[key] = (TEMP_PREFIX + str(self.temps), node)
+                self.temps += 1
+            return var(self.hoisted[key][0])
+        if node_type in (BinaryOp, GetArrayItem):
+            node.left = self.hoist(node.left)
+            node.right = self.hoist(node.right)
+        elif node_type is UnaryOp:
+            node.right = self.hoist(node.right)
+        elif node_type is Array:
+            node.vals = [self.hoist(val) for val in node.vals]
+        return node
+
+
+def known_functions(ast):
+    """Returns the FunctionDefs whose function is always the one that is called by their name.
+
+    This is the case for a function which is defined once, by a statement at the top level, if its name isn't assigned
+    to or used as a param anywhere. Calls to it in the top level statements after the definition, and in the
+    functions that are defined by them, always call the function. So does a call in the function itself.
+    """
+    defined = []
+    excluded = set()
+    for node in walk(ast):
+        if type(node) is FunctionDef:
+            defined.append(node.name.value)
+            excluded.update(param.value for param in node.function.sig.params)
+        elif type(node) is Assign:
+            excluded.add(node.left.value)
+    return OrderedDict((node.name.value, node) for node in getattr(ast, "children", ())
+                       if type(node) is FunctionDef and defined.count(node.name.value) == 1 and
+                       node.name.value not in excluded)
+
+
+class PurityChecker(object):
+    """Checks whether the body of a function only depends on its args.
+
+    Reading a name the function hasn't assigned to yet looks it up in the caller or the global state, so every name
+    the function reads must be a param or definitely assigned by then. The function can't read rand, set array items
+    (the array could be an arg), define functions or call anything but the functions in calls. It also has to end in a
+    return on every path, without a return the result is looked up in the caller.
+    """
+    def __init__(self, function):
+        self.params = {param.value for param in function.sig.params}
+        self.calls = set()
+        self.pure = always_returns(function.block)
+        if self.pure:
+            self.block(function.block.children, set(self.params))
+
+    def reads(self, node, assigned):
+        node_type = type(node)
+        if node_type is Var:
+            if node.value == "rand" or node.value not in assigned:
+                self.pure = False
+        elif node_type is Call:
+            self.calls.add(node.func.value)
+        elif node_type in (SetArrayItem, FunctionDef):
+            self.pure = False
+        for child in iter_child_nodes(node):
+            self.reads(child, assigned)
+
+    def block(self, statements, assigned):
+        """Checks the statements, adding the names they definitely assign to assigned."""
+        for statement in statements:
+            statement_type = type(statement)
+            if statement_type is Assign:
+                self.reads(statement.right, assigned)
+                assigned.add(statement.left.value)
+            elif statement_type is Block:
+                self.block(statement.children, assigned)
+            elif statement_type is ControlBlock:
+                branches = []
+                for _if in statement.ifs:
+                    self.reads(_if.ctrl, assigned)
+                    branches.append(self.block(_if.block.children, set(assigned)))
+                branches.append(self.block(statement.else_block.children, set(assigned)))
+                assigned |= set.intersection(*branches)
+            elif statement_type is ForLoop:
+                self.block([statement.init], assigned)
+                self.reads(statement.ctrl, assigned)
+                body = self.block(statement.block.children, set(assigned))
+                self.block([statement.inc], body)
+            elif statement_type is Return:
+                self.reads(statement.expr, assigned)
+            elif statement_type is not NoOp:
+                self.reads(statement, assigned)
+        return assigned
+
+
+def pure_functions(ast):
+    """Returns the FunctionDefs, by name, whose result only depends on their args.
+
+    These are the known_functions which pass the PurityChecker and only call each other. They assign to their params,
+    return and the other names they assign to, which is only pure if those names aren't globals. So functions which
+    assign to a name the top level assigns to are left out, but the static vars of a run still have to be checked
+    against assigned_names.
+    """
+    top_level_names = top_level_assigned_names(ast)
+    pure = OrderedDict()
+    calls = {}
+    for name, node in known_functions(ast).items():
+        checker = PurityChecker(node.function)
+        if checker.pure and not (function_assigned_names(node.function) & top_level_names):
+            pure[name] = node
+            calls[name] = checker.calls
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not calls[name] <= set(pure):
+                del pure[name]
+                changed = True
+    return pure
+
+
+def function_assigned_names(function):
+    """Returns the names a call to the function assigns to, including its params."""
+    names = {param.value for param in function.sig.params}
+    return names | {node.left.value for node in walk(function.block) if type(node) is Assign}
+
+
+class Substitution(Transformer):
+    def __init__(self, values):
+        super(Substitution, self).__init__()
+        self.values = values
+
+    def visit_var(self, node):
+        if node.value in self.values:
+            return deepcopy(self.values[node.value])
+        return node
+
+
+def substitute(node, values):
+    """Returns a copy of the expression with every variable named in values replaced by a copy of its value."""
+    return Substitution(values).visit(deepcopy(node))
+
+
+class Inliner(Transformer):
+    """Replaces calls to small functions with the expression the function returns.
+
+    Only functions whose body is a series of assignments followed by a return, without calls or rand, are inlined. The
+    assignments are substituted into the returned expression, followed by the args. As the function can only read its
+    params, the names it assigned and names it doesn't assign which it looks up in its caller, the substituted
+    expression gives the same value when it is evaluated in the caller. Calls whose args contain a call or rand aren't
+    inlined, since the call or rand would then run after the names the expression reads are looked up. Other args
+    which are not a literal or a variable can only be substituted for a param which is used once, in the same order
+    as the args.
+
+    A call can only be inlined if it is certain which function it calls, see known_functions.
+
+    Calling a function also assigns to its params, the names it assigns and return, which changes the global state
+    if they are globals. The top level of the program must not assign to these names, but the static vars of a run
+    could still contain them. The names are collected in assumed_names so the run can be checked for them.
+    """
+    # The largest number of nodes the returned expression of an inlined function can have.
+    max_size = 20
+
+    def __init__(self, report=None):
+        super(Inliner, self).__init__(report)
+        self.inlinable = {}
+        self.functions = {}
+        self.assumed_names = set()
+
+    def run(self, ast):
+        if type(ast) is not Block:
+            return ast
+        top_level_names = top_level_assigned_names(ast)
+        for name, node in known_functions(ast).items():
+            self.add_function(node.function, name, top_level_names)
+
+        children = []
+        for node in ast.children:
+            children.append(self.visit(node))
+            if type(node) is FunctionDef and node.name.value in self.inlinable:
+                self.functions[node.name.value] = self.inlinable[node.name.value]
+        ast.children = children
+        return ast
+
+    def add_function(self, function, name, top_level_names):
+        statements = function.block.children
+        params = tuple(param.value for param in function.sig.params)
+        if not statements or type(statements[-1]) is not Return or len(set(params)) != len(params):
+            return
+        if any(type(statement) is not Assign for statement in statements[:-1]):
+            return
+        if contains(function.block, Call) or reads_rand(function.block):
+            return
+        names = set(params) | {statement.left.value for statement in statements[:-1]}
+        if names & top_level_names:
+            return
+        expr = statements[-1].expr
+        for statement in reversed(statements[:-1]):
+            expr = substitute(expr, {statement.left.value: statement.right})
+        if len(list(walk(expr))) > self.max_size:
+            return
+        self.inlinable[name] = (params, expr, names)
+
+    def visit_call(self, node):
+        node = self.generic_visit(node)
+        if node.func.value not in self.functions:
+            return node
+        params, expr, names = self.functions[node.func.value]
+        if len(params) != len(node.arglist):
+            return node
+        # The function's expression can read names an arg with a call assigns to, or a call can read names an
+        # earlier arg depends on, so only args without side effects can be evaluated in another order.
+        if any(contains(arg, Call) or reads_rand(arg) for arg in node.arglist):
+            return node
+        uses = [n.value for n in walk(expr) if type(n) is Var and n.value in params]
+        order = []
+        for param, arg in zip(params, node.arglist):
+            if type(arg) is Int or type(arg) is Var and arg.value != "rand":
+                continue
+            if uses.count(param) != 1:
+                return node
+            order.append(uses.index(param))
+        if order != sorted(order):
+            return node
+        self.assumed_names |= names
+        return substitute(expr, dict(zip(params, node.arglist)))
+
+
+class InlinedProg(Batched):
+    """Runs a program with inlined calls, or the program without them when a run breaks the Inliner's assumptions.
+
+    That happens when the static vars contain one of the names the Inliner assumed isn't a global. The program
+    without inlined calls is only compiled, by calling fallback, the first time it is needed. Every other attribute is
+    the inlined program's.
+    """
+    def __init__(self, program, assumed_names, fallback):
+        self.program = program
+        self.assumed_names = assumed_names
+        self.compile_fallback = fallback
+        self.fallback = None
+
+    def select(self, static_vars):
+        """Returns the program to run with static_vars."""
+        if static_vars and not self.assumed_names.isdisjoint(static_vars):
+            if self.fallback is None:
+                self.fallback = self.compile_fallback()
+            return self.fallback
+        return self.program
+
+    def run(self, static_vars=None, *args, **kwargs):
+        return self.select(static_vars).run(static_vars, *args, **kwargs)
+
+    def run_counted(self, static_vars=None, *args, **kwargs):
+        return self.select(static_vars).run_counted(static_vars, *args, **kwargs)
+
+    def run_async(self, static_vars=None, *args, **kwargs):
+        return self.select(static_vars).run_async(static_vars, *args, **kwargs)
+
+    def start(self, static_vars=None, *args, **kwargs):
+        return self.select(static_vars).start(static_vars, *args, **kwargs)
+
+    def __reduce__(self):
+        # The fallback is compiled again after unpickling, when it is needed.
+        return InlinedProg, (self.program, self.assumed_names, self.compile_fallback)
+
+    def __getattr__(self, name):
+        return getattr(self.program, name)
+
+
+class TailCallEliminator(Transformer):
+    """Turns a function which returns a call to itself into a loop.
+
+    The body of the function is run by a for loop which runs it again for as long as it ends in a tail call. A
+    return f(args) statement in the function f evaluates the args into temporaries, assigns them to the params and
+    sets the loop variable, and the statements which would follow it in the body are skipped by checking that
+    variable. The names assigned by the previous run of the body are still in the scope, so reading a name before it
+    is assigned finds the same value dynamic scoping would have found in the caller's frame. This gives the same
+    result as the call without growing the stack.
+
+    Only functions which are known to be called by their name (see known_functions), and return statements which
+    aren't inside a for loop, are changed.
+    """
+    def __init__(self, report=None):
+        super(TailCallEliminator, self).__init__(report)
+        self.loops = 0
+
+    def run(self, ast):
+        for name, node in known_functions(ast).items():
+            self.eliminate(name, node.function)
+        return ast
+
+    def eliminate(self, name, function):
+        params = [param.value for param in function.sig.params]
+        self.name = name
+        self.params = params
+        if len(set(params)) != len(params) or not self.has_tail_call(function.block):
+            return
+        self.go = "{}tail{}".format(TEMP_PREFIX, self.loops)
+        self.loops += 1
+        body = self.rewrite_block(function.block)
+        loop = ForLoop(assign(self.go, const(1)), var(self.go), NoOp(),
+                       Block([assign(self.go, const(0))] + body.children))
+        function.block = Block([loop])
+
+    def is_tail_call(self, node):
+        return type(node) is Return and type(node.expr) is Call and node.expr.func.value == self.name and \
+            len(node.expr.arglist) == len(self.params)
+
+    def has_tail_call(self, node):
+        if self.is_tail_call(node):
+            return True
+        if type(node) in (ForLoop, FunctionDef):
+            return False
+        return any(self.has_tail_call(child) for child in iter_child_nodes(node))
+
+    def rewrite_block(self, node):
+        children = []
+        for i, child in enumerate(node.children):
+            jumps = self.has_tail_call(child)
+            children.append(self.rewrite(child))
+            if jumps and i + 1 < len(node.children):
+                rest = self.rewrite_block(Block(node.children[i + 1:]))
+                children.append(ControlBlock([If(UnaryOp(Token(TokenTypes.NOT, "not"), var(self.go)), rest)]))
+                break
+        return Block(children)
+
+    def rewrite(self, node):
+        if self.is_tail_call(node):
+            temps = ["{}_{}".format(self.go, i) for i in range(len(self.params))]
+            return Block([assign(temp, arg) for temp, arg in zip(temps, node.expr.arglist)] +
+                         [assign(param, var(temp)) for param, temp in zip(self.params, temps)] +
+                         [assign(self.go, const(1))])
+        if not self.has_tail_call(node):
+            return node
+        if type(node) is Block:
+            return self.rewrite_block(node)
+        # Only a control block is left.
+        for _if in node.ifs:
+            _if.block = self.rewrite_block(_if.block)
+        node.else_block = self.rewrite_block(node.else_block)
+        return node
+
+
+PASSES = [ConstantFolder, DeadCodeEliminator, TailCallEliminator, UnusedFunctionEliminator, LoopInvariantCodeMotion]
+
+
+def optimize(ast, report=None):
+    """Runs all of the optimization passes over the AST and returns the optimized AST.
+
+    Args:
+        ast (AST): The program to optimize.
+        report (list): If given every Removal the passes make is appended to it.
+    """
+    for optimization in PASSES:
+        ast = optimization(report).run(ast)
+    return ast
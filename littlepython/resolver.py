@@ -0,0 +1,110 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from littlepython.ast import Var, Assign, FunctionDef, Call, iter_child_nodes
+from littlepython.feature import Features
+
+# The kinds of names.
+RAND = 0  # The rand builtin.
+GLOBAL = 1  # A name read or written outside of any function, always in the global state.
+LOCAL = 2  # A name the function itself assigns to, so it can be in the function's own frame.
+DYNAMIC = 3  # A name the function only reads, it is found in a calling function's frame or the global state.
+
+
+class Unset(object):
+    """The value of a slot for a name which hasn't been assigned to."""
+    def __repr__(self):
+        return "UNSET"
+
+
+UNSET = Unset()
+
+
+class Layout(object):
+    """The slots of a function's frame, one for each name the function can assign to in its own scope.
+
+    The params come first, in order, followed by the other names the function assigns to.
+    """
+    def __init__(self, function):
+        self.slots = {}
+        for param in function.sig.params:
+            self.add(param.value)
+        self.add_assigned(function.block)
+
+    def add(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+
+    def add_assigned(self, node):
+        if type(node) is Assign:
+            self.add(node.left.value)
+        elif type(node) is FunctionDef:
+            # The body of a nested function assigns to its own frame.
+            self.add(node.name.value)
+            return
+        for child in iter_child_nodes(node):
+            self.add_assigned(child)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class Resolver(object):
+    """Classifies every name in a program at compile time and assigns it a slot.
+
+    Every name in the program gets a slot in the list that holds the global state. Top level code can only ever see
+    the global state, so its names are always GLOBAL. Inside a function LP uses dynamic scoping, a name is looked up in
+    the scope of the function and then in the scopes of its callers before the global state. A function's own scope
+    can only hold the names it assigns to (including its params), so those are LOCAL and get a slot in
+    the function's frame. Any other name is DYNAMIC and is looked up through the frames of the active calls at run
+    time, which is what ScopedSymbolTable.resolve does for every name.
+    """
+    def __init__(self, features):
+        self.random_var = Features.RANDOM_VAR in features
+        self.globals = {}
+        # Maps the id of each Function in the program to its Layout.
+        self.layouts = {}
+
+    def resolve(self, ast):
+        self.add_names(ast)
+        return self
+
+    def add_names(self, node):
+        node_type = type(node)
+        if node_type is Var:
+            self.add_global(node.value)
+        elif node_type is Assign:
+            self.add_global(node.left.value)
+        elif node_type is Call:
+            self.add_global(node.func.value)
+        elif node_type is FunctionDef:
+            self.add_global(node.name.value)
+            layout = Layout(node.function)
+            self.layouts[id(node.function)] = layout
+            for name in layout.slots:
+                self.add_global(name)
+        for child in iter_child_nodes(node):
+            self.add_names(child)
+
+    def add_global(self, name):
+        if name not in self.globals:
+            self.globals[name] = len(self.globals)
+
+    def layout(self, function):
+        return self.layouts[id(function)]
+
+    def classify(self, name, function=None, call=False):
+        """Returns the kind of name and its slot when used in function, or at the top level if function is None.
+
+        The slot of a GLOBAL is in the global state, the slot of a LOCAL is in the function's frame and a DYNAMIC or
+        RAND has no slot. The name of a called function is always looked up, even if it is rand.
+        """
+        if name == "rand" and self.random_var and not call:
+            return RAND, None
+        if function is None:
+            return GLOBAL, self.globals[name]
+        slots = self.layout(function).slots
+        if name in slots:
+            return LOCAL, slots[name]
+        return DYNAMIC, None
@@ -0,0 +1,179 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+from collections import deque, namedtuple
+
+from littlepython.error import ExecutionCountExceededException
+from littlepython.interpreter import EXECUTION_COUNT_EXCEEDED_MSG
+from littlepython.optimizer import InlinedProg
+from littlepython.stack import StackProg
+from littlepython.tournament import Result
+
+# What the Scheduler measured for one program: the operations it ran, the number of slices it ran them in, the time
+# those slices took and the most operations other programs ran between two of its slices.
+ProgramStats = namedtuple("ProgramStats", ["op_count", "slices", "seconds", "max_wait"])
+
+# What the Scheduler measured over all of its runs. fairness is Jain's fairness index of the operations each program
+# ran per unit of priority, over the programs which haven't ended: 1.0 when they all got the same share, down to
+# 1 / n when one of the n programs got everything.
+SchedulerStats = namedtuple("SchedulerStats", ["op_count", "slices", "seconds", "ops_per_second", "fairness",
+                                               "programs"])
+
+
+class Task(object):
+    """A program added to a Scheduler, along with the Continuation of its run."""
+    def __init__(self, run, max_op_count, priority, clock):
+        self.run = run
+        self.max_op_count = max_op_count
+        self.priority = priority
+        self.result = None
+        self.slices = 0
+        self.seconds = 0.0
+        self.max_wait = 0
+        # The operations left of the task's turn, a turn can be cut short by the max_ops of a run.
+        self.turn = 0
+        # The Scheduler's clock at the end of the task's last slice.
+        self.last = clock
+
+    def ops_left(self):
+        """Returns the operations the task can still run, or None when it has no max_op_count."""
+        if self.max_op_count > 0:
+            # Like run, a run can use one operation less than max_op_count.
+            return self.max_op_count - 1 - self.run.op_count
+        return None
+
+    def stats(self):
+        return ProgramStats(self.run.op_count, self.slices, self.seconds, self.max_wait)
+
+
+class Scheduler(object):
+    """Runs many programs in one thread, taking turns in fixed quanta of operations.
+
+    The programs take turns in the order they were added. On its turn a program runs quantum operations for each unit
+    of its priority, or until it ends or uses up its max_op_count. The order of the turns only depends on the
+    operations the programs run, never on time, so running the same programs again interleaves them in exactly the
+    same way. A program ends in the same state as it would when it is run on its own.
+
+    The programs are paused between turns, so they have to be compiled with the "stack" engine, see
+    littlepython.stack.Continuation.
+
+    Args:
+        quantum (int): The number of operations a program runs on its turn for each unit of its priority.
+    """
+    def __init__(self, quantum=100):
+        if quantum < 1:
+            raise ValueError("The quantum must be at least 1, got {}.".format(quantum))
+        self.quantum = quantum
+        self.tasks = []
+        self.pending = deque()
+        self.seconds = 0.0
+        # The number of operations all programs have run, the wait of a program is measured with it.
+        self.clock = 0
+
+    def add(self, program, static_vars=None, max_op_count=-1, priority=1, random=None):
+        """Adds a run of a program to the scheduler and returns its index in the Results.
+
+        Args:
+            program: A program compiled with the "stack" engine.
+            static_vars (dict): The variables to start the program with.
+            max_op_count (int): The maximum number of operations the program can run, unlimited if not positive.
+            priority (int): The number of quanta the program runs on its turn.
+            random: The random number generator to use for rand, pass a seeded random.Random to make the run
+                reproducible.
+
+        Raises:
+            ValueError: If program wasn't compiled with the "stack" engine, or priority isn't a positive int.
+        """
+        # A program with inlined calls falls back to a program compiled with the same engine.
+        if not isinstance(program.program if isinstance(program, InlinedProg) else program, StackProg):
+            raise ValueError("Only programs compiled with the stack engine can be scheduled.")
+        if not isinstance(priority, int) or priority < 1:
+            raise ValueError("The priority must be a positive int, got {!r}.".format(priority))
+        task = Task(program.start(static_vars, random), max_op_count, priority, self.clock)
+        self.tasks.append(task)
+        self.pending.append(task)
+        self.check_exhausted(task)
+        return len(self.tasks) - 1
+
+    def run(self, max_ops=-1):
+        """Runs the programs until all of them have ended, or until they ran max_ops operations if it is positive.
+
+        When max_ops runs out the programs stay paused, and the next call goes on with the rest of the turn it cut
+        short.
+
+        Returns:
+            list: The Result of each program in the order they were added, None for the programs which haven't ended.
+                A program which used up its max_op_count gets an ExecutionCountExceededException as its error, and
+                one which failed gets the exception it raised.
+        """
+        start = time.perf_counter()
+        used = 0
+        pending = self.pending
+        while pending:
+            task = pending[0]
+            if task.turn == 0:
+                task.turn = self.quantum * task.priority
+            ops = task.turn
+            left = task.ops_left()
+            if left is not None:
+                ops = min(ops, left)
+            if max_ops > 0:
+                ops = min(ops, max_ops - used)
+                if ops < 1:
+                    break
+            pending.popleft()
+            task.max_wait = max(task.max_wait, self.clock - task.last)
+            before = task.run.op_count
+            slice_start = time.perf_counter()
+            try:
+                done = task.run.resume(ops)
+            except Exception as e:
+                task.result = Result(None, None, e)
+                done = True
+            task.seconds += time.perf_counter() - slice_start
+            task.slices += 1
+            ran = task.run.op_count - before
+            used += ran
+            self.clock += ran
+            task.last = self.clock
+            task.turn -= ran
+            if done:
+                if task.result is None:
+                    task.result = Result(task.run.state, task.run.op_count, None)
+            elif not self.check_exhausted(task):
+                if task.turn > 0:
+                    # max_ops ran out during the turn, the next run finishes it.
+                    pending.appendleft(task)
+                else:
+                    pending.append(task)
+        self.seconds += time.perf_counter() - start
+        return self.results()
+
+    def check_exhausted(self, task):
+        """Ends the task if it can't run another operation within its max_op_count, returns whether it did."""
+        left = task.ops_left()
+        if left is not None and left < 1:
+            error = ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            task.result = Result(None, task.max_op_count, error)
+            if task in self.pending:
+                self.pending.remove(task)
+            return True
+        return False
+
+    def results(self):
+        """Returns the Result of each program so far, see run."""
+        return [task.result for task in self.tasks]
+
+    def stats(self):
+        """Returns the SchedulerStats of every run so far."""
+        programs = [task.stats() for task in self.tasks]
+        op_count = sum(program.op_count for program in programs)
+        shares = [task.run.op_count / task.priority for task in self.pending]
+        fairness = None
+        if shares and any(shares):
+            fairness = sum(shares) ** 2 / (len(shares) * sum(share * share for share in shares))
+        ops_per_second = op_count / self.seconds if self.seconds else None
+        return SchedulerStats(op_count, sum(program.slices for program in programs), self.seconds, ops_per_second,
+                              fairness, programs)
@@ -0,0 +1,334 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import asyncio
+import random
+
+from littlepython.ast import Int, Var, NoOp, Block, Assign, BinaryOp, UnaryOp, Array, GetArrayItem, SetArrayItem, \
+    ControlBlock, ForLoop, FunctionDef, Call, Return
+from littlepython.batch import Batched
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException, CallDepthExceededException
+from littlepython.feature import Features
+from littlepython.interpreter import LPProg, Array as LPArray, ScopedSymbolTable, \
+    EXECUTION_COUNT_EXCEEDED_MSG, load_state, dump_state, call_plan, reduce_program
+
+# The kinds of work items, the first entry of every tuple on the work stack.
+VISIT = 0  # (VISIT, node): evaluate node, charging an operation for it.
+POP = 1  # (POP,): throw away the value on top of the value stack.
+ASSIGN = 2  # (ASSIGN, name)
+BINARY = 3  # (BINARY, op)
+UNARY = 4  # (UNARY, op)
+ARRAY = 5  # (ARRAY, length)
+GET_ITEM = 6  # (GET_ITEM,)
+SET_ITEM = 7  # (SET_ITEM,)
+BLOCK = 8  # (BLOCK, children, index): run the rest of a block's children.
+IF = 9  # (IF, node, index): the ctrl of node.ifs[index] is on the value stack.
+LOOP_CTRL = 10  # (LOOP_CTRL, node): evaluate the loop ctrl, the previous statement's value is on the value stack.
+LOOP_TEST = 11  # (LOOP_TEST, node): the loop ctrl is on the value stack.
+CALL = 12  # (CALL, func, params): the args are on the value stack.
+CALL_RETURN = 13  # (CALL_RETURN, value): the called function has finished and returns value.
+RETURN = 14  # (RETURN,): the returned value is on the value stack.
+
+
+class StackProg(Batched):
+    """An interpreter which keeps the pending work and the LP call frames on explicit stacks.
+
+    LPProg evaluates nodes by recursing on the Python stack so deeply recursive LP programs hit Python's recursion
+    limit. This interpreter never recurses, instead the number of LP calls that can be active at once is limited by
+    max_call_depth which has nothing to do with sys.getrecursionlimit(). Apart from that it gives exactly the same
+    results as LPProg, including the op count.
+    """
+    max_call_depth = 10000
+
+    def __init__(self, ast, features):
+        self.ast = ast
+        self.features = features
+        self.random = random
+        self.random_var = Features.RANDOM_VAR in features
+
+    def execute(self, run, count, pause=False):
+        """Continues run until it ends or count reaches 0 and returns what is left of count.
+
+        When count reaches 0 the run raises ExecutionCountExceededException, or with pause it stops before the node
+        it was about to evaluate and 1 is returned, so the run used one operation less than count.
+        """
+        binary_ops = LPProg.binaryOps
+        unary_ops = LPProg.unaryOps
+        random_var = self.random_var
+        sym_tbl = run.sym_tbl
+        resolve = sym_tbl.resolve
+        set_var = sym_tbl.set
+        random = run.random
+        max_call_depth = run.max_call_depth
+        work = run.work
+        values = run.values
+        frames = run.frames
+
+        while work:
+            item = work.pop()
+            kind = item[0]
+            if kind == VISIT:
+                count -= 1
+                if count == 0:
+                    if pause:
+                        work.append(item)
+                        return 1
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+                node = item[1]
+                node_type = type(node)
+                if node_type is Int:
+                    values.append(node.value)
+                elif node_type is Var:
+                    if random_var and node.value == "rand":
+                        values.append(random.randint(-2147483647, 2147483647))
+                    else:
+                        values.append(resolve(node.value))
+                elif node_type is BinaryOp:
+                    work.append((BINARY, node.op.value))
+                    work.append((VISIT, node.right))
+                    work.append((VISIT, node.left))
+                elif node_type is Assign:
+                    work.append((ASSIGN, node.left.value))
+                    work.append((VISIT, node.right))
+                elif node_type is Block:
+                    work.append((BLOCK, node.children, 0))
+                    values.append(None)
+                elif node_type is ControlBlock:
+                    work.append((IF, node, 0))
+                    work.append((VISIT, node.ifs[0].ctrl))
+                elif node_type is ForLoop:
+                    work.append((LOOP_CTRL, node))
+                    work.append((VISIT, node.init))
+                elif node_type is UnaryOp:
+                    work.append((UNARY, node.op.value))
+                    work.append((VISIT, node.right))
+                elif node_type is GetArrayItem:
+                    work.append((GET_ITEM,))
+                    work.append((VISIT, node.right))
+                    work.append((VISIT, node.left))
+                elif node_type is SetArrayItem:
+                    # LPProg evaluates the array, then the value and then the index.
+                    work.append((SET_ITEM,))
+                    work.append((VISIT, node.right))
+                    work.append((VISIT, node.expr))
+                    work.append((VISIT, node.left))
+                elif node_type is Call:
+                    func = resolve(node.func.value)
+                    work.append((CALL, func, call_plan(node, func)))
+                    for arg in reversed(node.arglist):
+                        work.append((VISIT, arg))
+                elif node_type is Return:
+                    work.append((RETURN,))
+                    work.append((VISIT, node.expr))
+                elif node_type is FunctionDef:
+                    set_var(node.name.value, node.function)
+                    values.append(None)
+                elif node_type is Array:
+                    work.append((ARRAY, len(node.vals)))
+                    for val in reversed(node.vals):
+                        work.append((VISIT, val))
+                elif node_type is NoOp:
+                    values.append(None)
+                else:
+                    raise NotImplementedError("No handler for {} found.".format(node_type.__name__))
+            elif kind == BLOCK:
+                children, index = item[1], item[2]
+                if index < len(children):
+                    # Every statement leaves a value, the block replaces the previous one with its own.
+                    values.pop()
+                    work.append((BLOCK, children, index + 1))
+                    work.append((VISIT, children[index]))
+            elif kind == BINARY:
+                right = values.pop()
+                left = values.pop()
+                try:
+                    values.append(binary_ops[item[1]](left, right))
+                except ZeroDivisionError:
+                    raise DivisionByZeroException()
+            elif kind == ASSIGN:
+                set_var(item[1], values.pop())
+                values.append(None)
+            elif kind == POP:
+                values.pop()
+            elif kind == LOOP_CTRL:
+                values.pop()
+                node = item[1]
+                work.append((LOOP_TEST, node))
+                work.append((VISIT, node.ctrl))
+            elif kind == LOOP_TEST:
+                node = item[1]
+                if values.pop():
+                    work.append((LOOP_CTRL, node))
+                    work.append((VISIT, node.inc))
+                    work.append((POP,))
+                    work.append((VISIT, node.block))
+                else:
+                    values.append(None)
+            elif kind == IF:
+                node, index = item[1], item[2]
+                if values.pop():
+                    work.append((VISIT, node.ifs[index].block))
+                elif index + 1 < len(node.ifs):
+                    work.append((IF, node, index + 1))
+                    work.append((VISIT, node.ifs[index + 1].ctrl))
+                else:
+                    work.append((VISIT, node.else_block))
+            elif kind == UNARY:
+                values.append(unary_ops[item[1]](values.pop()))
+            elif kind == GET_ITEM:
+                index = values.pop()
+                var = values.pop()
+                values.append(var[index])
+            elif kind == SET_ITEM:
+                index = values.pop()
+                value = values.pop()
+                var = values.pop()
+                var[index] = value
+                values.append(None)
+            elif kind == CALL:
+                func, params = item[1], item[2]
+                arg_count = len(params)
+                if len(frames) >= max_call_depth:
+                    raise CallDepthExceededException("Running this program would require more than {} nested calls."
+                                                     .format(max_call_depth))
+                args = values[len(values) - arg_count:]
+                del values[len(values) - arg_count:]
+                sym_tbl.enter_scope()
+                for param, arg in zip(params, args):
+                    set_var(param, arg)
+                # A function which doesn't return a value returns 0.
+                work.append((CALL_RETURN, 0))
+                frames.append((len(work), len(values)))
+                work.append((VISIT, func.block))
+            elif kind == CALL_RETURN:
+                del values[frames.pop()[1]:]
+                values.append(item[1])
+                sym_tbl.exit_scope()
+            elif kind == RETURN:
+                if not frames:
+                    # A return outside of any function ends the program.
+                    del work[:]
+                    return count
+                # Skip the rest of the function, the CALL_RETURN is left on top of the work stack.
+                del work[frames[-1][0]:]
+                work[-1] = (CALL_RETURN, values.pop())
+            elif kind == ARRAY:
+                length = item[1]
+                vals = values[len(values) - length:]
+                del values[len(values) - length:]
+                values.append(LPArray(vals))
+        return count
+
+    def run(self, static_vars=None, max_op_count=-1, random=None, max_call_depth=None, suspend=False):
+        """Runs the program.
+
+        With suspend the run doesn't raise ExecutionCountExceededException when it uses up max_op_count, instead it
+        stops right where it would have raised and returns a Continuation which can go on from there with
+        Continuation.resume. A Continuation is returned even if the run ends, check its done attribute.
+
+        Args:
+            static_vars (dict): The variables to start the program with.
+            max_op_count (int): The maximum number of operations to run, unlimited if not positive.
+            random: The random number generator to use for rand, defaults to the random module.
+            max_call_depth (int): The maximum number of LP function calls which can be active at the same time,
+                defaults to StackProg.max_call_depth.
+            suspend (bool): Whether to return a Continuation instead of raising when max_op_count is used up.
+
+        Returns:
+            dict: The end state of the program, or the Continuation of the run with suspend.
+        """
+        if suspend:
+            run = self.start(static_vars, random, max_call_depth)
+            run.advance(max_op_count)
+            return run
+        return self.run_counted(static_vars, max_op_count, random, max_call_depth)[0]
+
+    def run_counted(self, static_vars=None, max_op_count=-1, random=None, max_call_depth=None):
+        """Runs the program like run and returns its end state along with the number of operations it used."""
+        run = self.start(static_vars, random, max_call_depth)
+        # A run without a max_op_count counts down from -1 without ever reaching 0.
+        remaining = self.execute(run, max_op_count)
+        return dump_state(run.sym_tbl.dump_cur_state()), max_op_count - remaining
+
+    def start(self, static_vars=None, random=None, max_call_depth=None):
+        """Returns a Continuation for a run of the program which hasn't run any operations yet.
+
+        The arguments are the same as for run.
+        """
+        if max_call_depth is None:
+            max_call_depth = self.max_call_depth
+        return Continuation(self, ScopedSymbolTable(load_state(static_vars)), self.random if random is None else random,
+                            max_call_depth)
+
+    async def run_async(self, static_vars=None, max_op_count=-1, random=None, slice_ops=1000, max_call_depth=None):
+        """Runs the program like run, as a coroutine which lets other tasks run every slice_ops operations.
+
+        Await it to get the end state of the program. Every slice runs without yielding, so slice_ops bounds how long
+        the program keeps other tasks waiting.
+        """
+        if slice_ops < 1:
+            raise ValueError("slice_ops must be at least 1, got {}.".format(slice_ops))
+        run = self.start(static_vars, random, max_call_depth)
+        while True:
+            ops = slice_ops
+            if max_op_count > 0:
+                # Like run, a run can use one operation less than max_op_count.
+                ops = min(ops, max_op_count - 1 - run.op_count)
+                if ops < 1:
+                    raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            if run.resume(ops):
+                return run.state
+            await asyncio.sleep(0)
+
+    def __reduce__(self):
+        return reduce_program(self)
+
+
+class Continuation(object):
+    """A run of a StackProg which can stop after any operation and go on from there later.
+
+    All the state of the run lives here: the work and value stacks, the frames of the active LP calls, the symbol
+    table and the random number generator for rand. Once the run has ended done is True and state is its end state.
+    A run which raised can't be resumed.
+
+    A Continuation for a run which used up its max_op_count is returned by StackProg.run with suspend, and one for
+    a new run by StackProg.start. Resuming it with more operations goes on exactly where it stopped, so splitting a
+    run over any number of resumes gives the same end state, and the same op count, as running it in one go.
+    littlepython.checkpoint saves a Continuation as bytes, so it can be resumed in another process.
+    """
+    def __init__(self, program, sym_tbl, random, max_call_depth):
+        self.program = program
+        self.sym_tbl = sym_tbl
+        self.random = random
+        self.max_call_depth = max_call_depth
+        self.work = [(VISIT, program.ast)]
+        self.values = []
+        # One (work height, value height) pair for each active LP call.
+        self.frames = []
+        # The number of operations the run has used so far.
+        self.op_count = 0
+        self.state = None
+
+    @property
+    def done(self):
+        return not self.work
+
+    def resume(self, more_ops=-1):
+        """Runs at most more_ops more operations, or until the run ends if more_ops isn't positive.
+
+        Returns:
+            bool: Whether the run has ended.
+        """
+        return self.advance(more_ops + 1 if more_ops > 0 else -1)
+
+    def advance(self, count):
+        """Runs until the run ends or count reaches 0, counting down like StackProg.execute. Returns done."""
+        if not self.done:
+            self.op_count += count - self.program.execute(self, count, pause=True)
+            if self.done:
+                self.state = dump_state(self.sym_tbl.dump_cur_state())
+        return self.done
+
+    def __repr__(self):
+        return "Continuation(op_count={}, done={})".format(self.op_count, self.done)
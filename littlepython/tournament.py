@@ -0,0 +1,113 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from littlepython.error import ExecutionCountExceededException
+from littlepython.lp import Compiler
+
+
+class Job(namedtuple("Job", ["program", "static_vars", "max_op_count", "seed"])):
+    """One run of a program in a Tournament.
+
+    program is either the source of a program or a compiled program. The run starts with static_vars and is limited to
+    max_op_count operations. seed seeds the random number generator for rand, with None every run gets a different
+    one.
+    """
+    __slots__ = ()
+
+
+Job.__new__.__defaults__ = (None, -1, None)
+
+# The outcome of a Job: its end state, the number of operations it used and the exception it raised. A run which
+# raises has no end state, and only a run which raises ExecutionCountExceededException has an op count, its
+# max_op_count.
+Result = namedtuple("Result", ["state", "op_count", "error"])
+
+
+def run_job(job, compiled):
+    """Runs a Job, looking up the compiled program for its source in compiled."""
+    try:
+        program = compiled[job.program] if isinstance(job.program, str) else job.program
+        state, op_count = program.run_counted(job.static_vars, job.max_op_count, random.Random(job.seed))
+        return Result(state, op_count, None)
+    except ExecutionCountExceededException as e:
+        return Result(None, job.max_op_count, e)
+    except Exception as e:
+        return Result(None, None, e)
+
+
+def run_chunk(compile_options, jobs):
+    """Runs a list of Jobs in a worker process, compiling each source the jobs use once."""
+    compiler = Compiler()
+    compiled = {}
+    results = []
+    for job in jobs:
+        if isinstance(job.program, str) and job.program not in compiled:
+            try:
+                compiled[job.program] = compiler.compile(job.program, **compile_options)
+            except Exception as e:
+                results.append(Result(None, None, e))
+                continue
+        results.append(run_job(job, compiled))
+    return results
+
+
+class Tournament(object):
+    """Runs batches of Jobs across a pool of worker processes.
+
+    The jobs are split into chunks which are handed to the workers, so each worker compiles a source once per chunk
+    and the cost of sending jobs and results between processes is spread over many runs. Compiled programs are
+    pickled to the workers and compiled again there, see littlepython.interpreter.reduce_program.
+
+    Args:
+        workers (int): The number of worker processes, defaults to the number of CPUs. With 0 the jobs are run in
+            this process.
+        **compile_options: The arguments for Compiler.compile used to compile the sources in the jobs, eg. engine.
+    """
+    def __init__(self, workers=None, **compile_options):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.compile_options = compile_options
+        self.executor = None
+
+    def run(self, jobs, chunk_size=None):
+        """Runs the jobs and returns their Results in the same order.
+
+        Args:
+            jobs (list): Jobs or tuples of the fields of a Job.
+            chunk_size (int): The number of jobs sent to a worker at a time, defaults to splitting the jobs into four
+                chunks per worker.
+
+        Returns:
+            list: The Result of each job.
+        """
+        jobs = [Job(*job) for job in jobs]
+        if self.workers == 0:
+            return run_chunk(self.compile_options, jobs)
+        if chunk_size is None:
+            chunk_size = max(1, len(jobs) // (self.workers * 4))
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        results = []
+        for chunk in self.executor.map(run_chunk, [self.compile_options] * len(chunks), chunks):
+            results += chunk
+        return results
+
+    def close(self):
+        """Shuts down the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
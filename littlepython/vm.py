@@ -0,0 +1,490 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import sys
+from array import array
+
+from littlepython.ast import Function, Int, Var, NoOp, Block, Assign, BinaryOp, UnaryOp, Array, GetArrayItem, \
+    SetArrayItem, ControlBlock, ForLoop, FunctionDef, Call, Return
+from littlepython.batch import Batched
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException, CallDepthExceededException
+from littlepython.feature import Features
+from littlepython.interpreter import Array as LPArray, ScopedSymbolTable, EXECUTION_COUNT_EXCEEDED_MSG, \
+    load_state, dump_state, reduce_program, replayable, replayed
+from littlepython.stack import StackProg
+
+# Opcodes, every instruction is four ints: the opcode and the operands a, b and c.
+LOAD_CONST = 0  # regs[a] = consts[b]
+LOAD_VAR = 1  # regs[a] = the variable names[b]
+LOAD_RAND = 2  # regs[a] = a random int
+STORE_VAR = 3  # the variable names[a] = regs[b]
+MOVE = 4  # regs[a] = regs[b]
+ADD = 5  # regs[a] = regs[b] + regs[c], the same goes for all the binary ops down to GREATER_EQUAL.
+SUB = 6
+MULT = 7
+DIV = 8
+MOD = 9
+AND = 10
+OR = 11
+EQUAL = 12
+NOT_EQUAL = 13
+LESS = 14
+GREATER = 15
+LESS_EQUAL = 16
+GREATER_EQUAL = 17
+NOT = 18  # regs[a] = not regs[b]
+NEG = 19  # regs[a] = -regs[b]
+NEW_ARRAY = 20  # regs[a] = an array of the c registers starting at regs[b]
+GET_ITEM = 21  # regs[a] = regs[b][regs[c]]
+SET_ITEM = 22  # regs[a][regs[b]] = regs[c]
+MAKE_FUNC = 23  # the variable names[a] = functions[b]
+CALL = 24  # regs[a] = call the function in the variable names[call_sites[b]] with the registers from regs[c]
+RETURN = 25  # return regs[a]
+JUMP = 26  # jump to a
+JUMP_IF_FALSE = 27  # jump to b if regs[a] is false
+NOP = 28  # nothing, used to charge for nodes which don't result in an instruction
+END = 29  # the end of the code, return from the function without a return value.
+
+OPNAMES = ["LOAD_CONST", "LOAD_VAR", "LOAD_RAND", "STORE_VAR", "MOVE", "ADD", "SUB", "MULT", "DIV", "MOD", "AND", "OR",
+           "EQUAL", "NOT_EQUAL", "LESS", "GREATER", "LESS_EQUAL", "GREATER_EQUAL", "NOT", "NEG", "NEW_ARRAY",
+           "GET_ITEM", "SET_ITEM", "MAKE_FUNC", "CALL", "RETURN", "JUMP", "JUMP_IF_FALSE", "NOP", "END"]
+
+binaryOps = {"+": ADD,
+             "-": SUB,
+             "*": MULT,
+             "/": DIV,
+             "%": MOD,
+             "and": AND,
+             "or": OR,
+             "is": EQUAL,
+             "is not": NOT_EQUAL,
+             "<": LESS,
+             ">": GREATER,
+             "<=": LESS_EQUAL,
+             ">=": GREATER_EQUAL}
+unaryOps = {"not": NOT,
+            "+": MOVE,
+            "-": NEG}
+
+
+class Code(object):
+    """The instructions for the main program or for one function.
+
+    code holds four ints per instruction and costs holds the number of operations each instruction is charged, which
+    is the number of AST nodes it stands for, so a program uses up the same amount of max_op_count as in LPProg.
+    """
+    def __init__(self, name, params=()):
+        self.name = name
+        self.params = tuple(params)
+        self.code = array('i')
+        self.costs = array('i')
+        self.reg_count = 0
+
+
+class VMFunction(Function):
+    """A function value which runs the given Code."""
+    def __init__(self, function, code):
+        super(VMFunction, self).__init__(function.sig, function.block)
+        self.code = code
+
+
+class CodeGenerator(object):
+    """Flattens an AST into a list of Codes, the first of which is the main program.
+
+    Temporary values are kept in registers, which are allocated like a stack while generating the code for an
+    expression, so every Code knows how many registers a call to it needs.
+    """
+    def __init__(self, features):
+        self.features = features
+        self.consts = []
+        self.names = []
+        self.functions = []
+        self.call_sites = []
+        self.indexes = {}
+        self.codes = []
+        self.code = None
+        self.pending = 0
+        self.top = 0
+
+    def generate(self, ast):
+        main = self.function_code(Code("<main>"), ast)
+        # Functions are added to the list as they are found in the code being generated.
+        i = 0
+        while i < len(self.functions):
+            function = self.functions[i]
+            self.function_code(function.code, function.block)
+            i += 1
+        return main
+
+    def function_code(self, code, block):
+        self.code = code
+        self.codes.append(code)
+        self.top = 0
+        self.statement(block)
+        self.emit(END)
+        return code
+
+    def index(self, table, value):
+        """Returns the position of value in one of the consts, names or call_sites tables, adding it if needed."""
+        # The type is part of the key so True and 1 are different constants.
+        key = (id(table), type(value), value)
+        if key not in self.indexes:
+            self.indexes[key] = len(table)
+            table.append(value)
+        return self.indexes[key]
+
+    def alloc(self, count=1):
+        reg = self.top
+        self.top += count
+        self.code.reg_count = max(self.code.reg_count, self.top)
+        return reg
+
+    def free(self, count=1):
+        self.top -= count
+
+    def emit(self, op, a=0, b=0, c=0, cost=0):
+        """Adds an instruction, charging any pending cost with it, and returns its position."""
+        self.code.code.extend((op, a, b, c))
+        self.code.costs.append(cost + self.pending)
+        self.pending = 0
+        return len(self.code.costs) - 1
+
+    def label(self):
+        """Returns the position of the next instruction for use as a jump target."""
+        if self.pending:
+            # The pending cost belongs to the code before the label and must not be charged on jumps to it.
+            self.emit(NOP)
+        return len(self.code.costs)
+
+    def patch(self, pos, operand, target):
+        self.code.code[pos * 4 + operand] = target
+
+    def statement(self, node):
+        node_type = type(node)
+        if node_type is Block:
+            self.pending += 1
+            for child in node.children:
+                self.statement(child)
+        elif node_type is Assign:
+            reg = self.alloc()
+            self.expression(node.right, reg)
+            self.emit(STORE_VAR, self.index(self.names, node.left.value), reg, cost=1)
+            self.free()
+        elif node_type is SetArrayItem:
+            # LPProg evaluates the array, then the value and then the index.
+            reg = self.alloc(3)
+            self.expression(node.left, reg)
+            self.expression(node.expr, reg + 2)
+            self.expression(node.right, reg + 1)
+            self.emit(SET_ITEM, reg, reg + 1, reg + 2, cost=1)
+            self.free(3)
+        elif node_type is ControlBlock:
+            self.pending += 1
+            reg = self.alloc()
+            ends = []
+            for _if in node.ifs:
+                self.expression(_if.ctrl, reg)
+                jump = self.emit(JUMP_IF_FALSE, reg)
+                self.statement(_if.block)
+                ends.append(self.emit(JUMP))
+                self.patch(jump, 2, self.label())
+            self.free()
+            self.statement(node.else_block)
+            end = self.label()
+            for jump in ends:
+                self.patch(jump, 1, end)
+        elif node_type is ForLoop:
+            self.pending += 1
+            self.statement(node.init)
+            start = self.label()
+            reg = self.alloc()
+            self.expression(node.ctrl, reg)
+            jump = self.emit(JUMP_IF_FALSE, reg)
+            self.free()
+            self.statement(node.block)
+            self.statement(node.inc)
+            self.emit(JUMP, start)
+            self.patch(jump, 2, self.label())
+        elif node_type is FunctionDef:
+            code = Code(node.name.value, [param.value for param in node.function.sig.params])
+            self.functions.append(VMFunction(node.function, code))
+            self.emit(MAKE_FUNC, self.index(self.names, node.name.value), len(self.functions) - 1, cost=1)
+        elif node_type is Return:
+            reg = self.alloc()
+            self.expression(node.expr, reg)
+            self.emit(RETURN, reg, cost=1)
+            self.free()
+        elif node_type is NoOp:
+            self.pending += 1
+        else:
+            reg = self.alloc()
+            self.expression(node, reg)
+            self.free()
+
+    def expression(self, node, dst):
+        node_type = type(node)
+        if node_type is Int:
+            self.emit(LOAD_CONST, dst, self.index(self.consts, node.value), cost=1)
+        elif node_type is Var:
+            if node.value == "rand" and Features.RANDOM_VAR in self.features:
+                self.emit(LOAD_RAND, dst, cost=1)
+            else:
+                self.emit(LOAD_VAR, dst, self.index(self.names, node.value), cost=1)
+        elif node_type is BinaryOp:
+            self.expression(node.left, dst)
+            reg = self.alloc()
+            self.expression(node.right, reg)
+            self.emit(binaryOps[node.op.value], dst, dst, reg, cost=1)
+            self.free()
+        elif node_type is UnaryOp:
+            self.expression(node.right, dst)
+            self.emit(unaryOps[node.op.value], dst, dst, cost=1)
+        elif node_type is GetArrayItem:
+            self.expression(node.left, dst)
+            reg = self.alloc()
+            self.expression(node.right, reg)
+            self.emit(GET_ITEM, dst, dst, reg, cost=1)
+            self.free()
+        elif node_type is Call:
+            base = self.alloc(len(node.arglist))
+            for i, arg in enumerate(node.arglist):
+                self.expression(arg, base + i)
+            call_site = self.index(self.call_sites, (self.index(self.names, node.func.value), len(node.arglist)))
+            self.emit(CALL, dst, call_site, base, cost=1)
+            self.free(len(node.arglist))
+        elif node_type is Array:
+            base = self.alloc(len(node.vals))
+            for i, val in enumerate(node.vals):
+                self.expression(val, base + i)
+            self.emit(NEW_ARRAY, dst, base, len(node.vals), cost=1)
+            self.free(len(node.vals))
+        elif node_type is NoOp:
+            self.emit(LOAD_CONST, dst, self.index(self.consts, None), cost=1)
+        else:
+            raise NotImplementedError("No code for {} found.".format(node_type.__name__))
+
+
+class VMProg(Batched):
+    """A program compiled to instructions for a small register based virtual machine.
+
+    Each function is a flat array of instructions with jumps for control blocks and loops, which is run by a single
+    dispatch loop. Like StackProg the LP calls are kept on an explicit stack so the depth of recursion is only limited
+    by max_call_depth. The op count matches LPProg: a run raises ExecutionCountExceededException exactly when LPProg
+    would, although operations are charged as each instruction runs and so in a different order.
+
+    An instruction is charged after the instructions for its operands have run, so a run with a max_op_count can fail
+    in another way where LPProg would already have used up max_op_count. Such a run is replayed by a StackProg, which
+    charges every node before evaluating it like LPProg does, so it raises exactly what LPProg raises.
+    """
+    max_call_depth = 10000
+
+    def __init__(self, ast, features):
+        self.ast = ast
+        self.features = features
+        self.random = random
+        generator = CodeGenerator(features)
+        self.main = generator.generate(ast)
+        self.codes = generator.codes
+        self.consts = generator.consts
+        self.names = generator.names
+        self.functions = generator.functions
+        self.call_sites = generator.call_sites
+        self.random_var = Features.RANDOM_VAR in features
+        self.replayer = StackProg(ast, features)
+
+    def execute(self, sym_tbl, count, random, max_call_depth):
+        consts = self.consts
+        names = self.names
+        functions = self.functions
+        call_sites = self.call_sites
+        resolve = sym_tbl.resolve
+        set_var = sym_tbl.set
+        # The saved (code, costs, pc, regs, dst) of every caller.
+        frames = []
+        code = self.main.code
+        costs = self.main.costs
+        regs = [None] * self.main.reg_count
+        pc = 0
+
+        while True:
+            count -= costs[pc]
+            if count <= 0:
+                raise ExecutionCountExceededException(EXECUTION_COUNT_EXCEEDED_MSG)
+            i = pc * 4
+            op = code[i]
+            pc += 1
+            if op == LOAD_VAR:
+                regs[code[i + 1]] = resolve(names[code[i + 2]])
+            elif op == LOAD_CONST:
+                regs[code[i + 1]] = consts[code[i + 2]]
+            elif op == STORE_VAR:
+                set_var(names[code[i + 1]], regs[code[i + 2]])
+            elif op == JUMP_IF_FALSE:
+                if not regs[code[i + 1]]:
+                    pc = code[i + 2]
+            elif op == JUMP:
+                pc = code[i + 1]
+            elif op == ADD:
+                regs[code[i + 1]] = regs[code[i + 2]] + regs[code[i + 3]]
+            elif op == SUB:
+                regs[code[i + 1]] = regs[code[i + 2]] - regs[code[i + 3]]
+            elif op == MULT:
+                regs[code[i + 1]] = regs[code[i + 2]] * regs[code[i + 3]]
+            elif op == LESS:
+                regs[code[i + 1]] = regs[code[i + 2]] < regs[code[i + 3]]
+            elif op == GET_ITEM:
+                regs[code[i + 1]] = regs[code[i + 2]][regs[code[i + 3]]]
+            elif op == SET_ITEM:
+                regs[code[i + 1]][regs[code[i + 2]]] = regs[code[i + 3]]
+            elif op == EQUAL:
+                regs[code[i + 1]] = regs[code[i + 2]] == regs[code[i + 3]]
+            elif op == NOT_EQUAL:
+                regs[code[i + 1]] = regs[code[i + 2]] != regs[code[i + 3]]
+            elif op == GREATER:
+                regs[code[i + 1]] = regs[code[i + 2]] > regs[code[i + 3]]
+            elif op == LESS_EQUAL:
+                regs[code[i + 1]] = regs[code[i + 2]] <= regs[code[i + 3]]
+            elif op == GREATER_EQUAL:
+                regs[code[i + 1]] = regs[code[i + 2]] >= regs[code[i + 3]]
+            elif op == DIV or op == MOD:
+                try:
+                    if op == DIV:
+                        regs[code[i + 1]] = regs[code[i + 2]] // regs[code[i + 3]]
+                    else:
+                        regs[code[i + 1]] = regs[code[i + 2]] % regs[code[i + 3]]
+                except ZeroDivisionError:
+                    raise DivisionByZeroException()
+            elif op == AND:
+                regs[code[i + 1]] = regs[code[i + 2]] and regs[code[i + 3]]
+            elif op == OR:
+                regs[code[i + 1]] = regs[code[i + 2]] or regs[code[i + 3]]
+            elif op == NOT:
+                regs[code[i + 1]] = not regs[code[i + 2]]
+            elif op == NEG:
+                regs[code[i + 1]] = -regs[code[i + 2]]
+            elif op == MOVE:
+                regs[code[i + 1]] = regs[code[i + 2]]
+            elif op == CALL:
+                name, arg_count = call_sites[code[i + 2]]
+                func = resolve(names[name])
+                # make sure that the arglist length matches the func signature
+                assert len(func.sig.params) == arg_count
+                if len(frames) >= max_call_depth:
+                    raise CallDepthExceededException("Running this program would require more than {} nested calls."
+                                                     .format(max_call_depth))
+                base = code[i + 3]
+                args = regs[base:base + arg_count]
+                frames.append((code, costs, pc, regs, code[i + 1]))
+                sym_tbl.enter_scope()
+                for arg, param in zip(args, func.sig.params):
+                    set_var(param.value, arg)
+                code = func.code.code
+                costs = func.code.costs
+                regs = [None] * func.code.reg_count
+                pc = 0
+            elif op == RETURN or op == END:
+                if not frames:
+                    # The end of the main program or a return outside of any function.
+                    return count
+                # A function which doesn't return a value returns 0.
+                rtn = regs[code[i + 1]] if op == RETURN else 0
+                sym_tbl.exit_scope()
+                code, costs, pc, regs, dst = frames.pop()
+                regs[dst] = rtn
+            elif op == MAKE_FUNC:
+                set_var(names[code[i + 1]], functions[code[i + 2]])
+            elif op == LOAD_RAND:
+                regs[code[i + 1]] = random.randint(-2147483647, 2147483647)
+            elif op == NEW_ARRAY:
+                base = code[i + 2]
+                regs[code[i + 1]] = LPArray(regs[base:base + code[i + 3]])
+            elif op == NOP:
+                pass
+            else:
+                raise NotImplementedError("Unknown opcode {}.".format(op))
+
+    def run(self, static_vars=None, max_op_count=-1, random=None, max_call_depth=None):
+        """Runs the program.
+
+        Args:
+            static_vars (dict): The variables to start the program with.
+            max_op_count (int): The maximum number of operations to run, unlimited if not positive.
+            random: The random number generator to use for rand, defaults to the random module.
+            max_call_depth (int): The maximum number of LP function calls which can be active at the same time,
+                defaults to VMProg.max_call_depth.
+
+        Returns:
+            dict: The end state of the program.
+        """
+        return self.run_counted(static_vars, max_op_count, random, max_call_depth)[0]
+
+    def run_counted(self, static_vars=None, max_op_count=-1, random=None, max_call_depth=None):
+        """Runs the program like run and returns its end state along with the number of operations it used."""
+        if max_call_depth is None:
+            max_call_depth = self.max_call_depth
+        # A run without a max_op_count is given one it can't use up.
+        count = max_op_count if max_op_count > 0 else sys.maxsize
+        random = self.random if random is None else random
+        if max_op_count > 0:
+            random = replayable(random, self.random_var)
+        sym_tbl = ScopedSymbolTable(load_state(static_vars))
+        try:
+            remaining = self.execute(sym_tbl, count, random, max_call_depth)
+        except ExecutionCountExceededException:
+            raise
+        except Exception:
+            if max_op_count <= 0:
+                raise
+            return self.replayer.run_counted(static_vars, max_op_count, replayed(random), max_call_depth)
+        return dump_state(sym_tbl.dump_cur_state()), count - remaining
+
+    def __reduce__(self):
+        return reduce_program(self)
+
+
+def dis(prog):
+    """Returns a human readable listing of the instructions a VMProg was compiled to.
+
+    Each line shows the position of the instruction, the operations it is charged, the opcode and its operands
+    followed by the names, constants and functions the operands refer to.
+    """
+    lines = []
+    for code in prog.codes:
+        if code is prog.main:
+            lines.append("{}:".format(code.name))
+        else:
+            lines.append("{}({}):".format(code.name, ", ".join(code.params)))
+        for pc in range(len(code.costs)):
+            op, a, b, c = code.code[pc * 4:pc * 4 + 4]
+            if op in (LOAD_CONST,):
+                operands, note = "r{}, {}".format(a, b), repr(prog.consts[b])
+            elif op in (LOAD_VAR,):
+                operands, note = "r{}, {}".format(a, b), prog.names[b]
+            elif op == STORE_VAR:
+                operands, note = "{}, r{}".format(a, b), prog.names[a]
+            elif op in (LOAD_RAND, RETURN):
+                operands, note = "r{}".format(a), ""
+            elif op in (MOVE, NOT, NEG):
+                operands, note = "r{}, r{}".format(a, b), ""
+            elif op == NEW_ARRAY:
+                operands, note = "r{}, r{}, {}".format(a, b, c), ""
+            elif op == MAKE_FUNC:
+                operands, note = "{}, {}".format(a, b), "{} = <function {}>".format(prog.names[a], b)
+            elif op == CALL:
+                name, arg_count = prog.call_sites[b]
+                operands, note = "r{}, {}, r{}".format(a, b, c), "{}({} args)".format(prog.names[name], arg_count)
+            elif op == JUMP:
+                operands, note = "{}".format(a), ""
+            elif op == JUMP_IF_FALSE:
+                operands, note = "r{}, {}".format(a, b), ""
+            elif op in (NOP, END):
+                operands, note = "", ""
+            else:
+                operands, note = "r{}, r{}, r{}".format(a, b, c), ""
+            line = "  {:>4} {:>3}  {:<14}{:<16}".format(pc, code.costs[pc], OPNAMES[op], operands)
+            if note:
+                line += "; " + note
+            lines.append(line.rstrip())
+    return "\n".join(lines)
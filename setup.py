@@ -20,6 +20,7 @@ setup(name='littlepython',
       packages=['littlepython'],
       zip_safe=False,
       install_requires=['enum34;python_version<"3.4"'],
+      extras_require={'numpy': ['numpy']},
       setup_requires=['pytest-runner'],
       tests_require=['pytest', 'pytest-timeout'],
       scripts=['bin/littlepy'],
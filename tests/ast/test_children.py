@@ -0,0 +1,26 @@
+import pytest
+
+from littlepython.ast import iter_child_nodes, NoOp
+from tests import c, v, add, asg, blk, _if, ctrl, _for, _def, sig, ret, call, getitem, setitem, _not
+
+
+@pytest.mark.parametrize("node, children", [
+    (c(1), []),
+    (v("a"), []),
+    (NoOp(), []),
+    (add(c(1), v("a")), [c(1), v("a")]),
+    (_not(v("a")), [v("a")]),
+    (asg(v("a"), c(1)), [c(1)]),
+    (blk([asg(v("a"), c(1)), v("b")]), [asg(v("a"), c(1)), v("b")]),
+    (ctrl([_if(v("a"), blk([c(1)])), _if(v("b"), blk())], blk([c(2)])),
+     [v("a"), blk([c(1)]), v("b"), blk(), blk([c(2)])]),
+    (_for(asg(v("i"), c(0)), v("i"), asg(v("i"), c(1)), blk([c(2)])),
+     [asg(v("i"), c(0)), v("i"), blk([c(2)]), asg(v("i"), c(1))]),
+    (getitem(v("a"), c(1)), [v("a"), c(1)]),
+    (setitem(v("a"), c(1), c(2)), [v("a"), c(2), c(1)]),
+    (call(v("f"), [c(1), c(2)]), [c(1), c(2)]),
+    (ret(c(1)), [c(1)]),
+    (_def(v("f"), sig([v("a")]), blk([ret(v("a"))])), [blk([ret(v("a"))])]),
+])
+def test_iter_child_nodes(node, children):
+    assert list(iter_child_nodes(node)) == children
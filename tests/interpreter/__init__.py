@@ -1,9 +1,9 @@
 from littlepython import Compiler, Features
 
 
-def compile(code, features=Features.ALL):
+def compile(code, features=Features.ALL, **kargs):
     compiler = Compiler()
-    return compiler.compile(code, features=features)
+    return compiler.compile(code, features=features, **kargs)
 
 
 def run(code, max_op_count=-1, **kargs):
@@ -0,0 +1,18 @@
+import pytest
+
+from littlepython.lp import ENGINES
+from tests.interpreter import compile
+
+
+@pytest.fixture(params=list(ENGINES))
+def engine(request):
+    """Runs the test for every engine Compiler.compile can compile a program for."""
+    return request.param
+
+
+@pytest.fixture
+def compile_engine(engine):
+    """Returns a function which compiles a program for the engine, like compile."""
+    def compile_for(code, **kargs):
+        return compile(code, engine=engine, **kargs)
+    return compile_for
@@ -0,0 +1,82 @@
+import asyncio
+import random
+
+import pytest
+
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from tests.interpreter import compile
+from tests.interpreter.test_engines import PROGRAMS
+
+
+def run_loop(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def run_async(prog, in_state, max_op_count=-1, slice_ops=1000):
+    try:
+        return run_loop(prog.run_async(dict(in_state), max_op_count, random.Random(4), slice_ops))
+    except (ExecutionCountExceededException, DivisionByZeroException) as e:
+        return type(e)
+
+
+def run(prog, in_state, max_op_count=-1):
+    try:
+        return prog.run(dict(in_state), max_op_count, random.Random(4))
+    except (ExecutionCountExceededException, DivisionByZeroException) as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+@pytest.mark.parametrize("slice_ops", [1, 3, 1000])
+def test_same_end_state(code, in_state, slice_ops):
+    prog = compile(code, engine="stack")
+    expected = run(compile(code, engine="interpreter"), in_state)
+    assert run_async(prog, in_state, slice_ops=slice_ops) == expected
+
+
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+@pytest.mark.parametrize("max_op_count", [1, 2, 5, 10, 50])
+@pytest.mark.parametrize("slice_ops", [1, 4])
+def test_same_op_count(code, in_state, max_op_count, slice_ops):
+    prog = compile(code, engine="stack")
+    expected = run(compile(code, engine="interpreter"), in_state, max_op_count)
+    assert run_async(prog, in_state, max_op_count, slice_ops) == expected
+
+
+def test_interleaved():
+    prog = compile("x = 0 for i = 0; i < 50; i = i + 1 { x = x + i }", engine="stack")
+    order = []
+
+    async def bot(name):
+        state = await prog.run_async(slice_ops=10)
+        order.append(name)
+        return state
+
+    async def ticker():
+        for _ in range(5):
+            order.append("tick")
+            await asyncio.sleep(0)
+
+    async def main():
+        return await asyncio.gather(bot("a"), bot("b"), ticker())
+
+    states = run_loop(main())
+    assert states[0] == states[1] == {"x": 1225, "i": 50}
+    # The ticker gets to run while the bots are still running.
+    assert order[:5] == ["tick"] * 5
+    assert sorted(order[5:]) == ["a", "b"]
+
+
+def test_inlined():
+    prog = compile("func f(n) { return n + 1 } a = f(1)", engine="stack", inline=True)
+    assert run_loop(prog.run_async()) == {"a": 2}
+    assert run_loop(prog.run_async({"n": 5})) == prog.run({"n": 5})
+
+
+def test_invalid_slice():
+    with pytest.raises(ValueError):
+        run_loop(compile("a = 1", engine="stack").run_async(slice_ops=0))
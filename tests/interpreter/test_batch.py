@@ -0,0 +1,120 @@
+import pytest
+
+from littlepython import batch
+from littlepython.cost import CALIBRATED
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from tests.interpreter import compile
+
+PROGRAMS = [
+    "a = b * 2 + c c = -a % 7 d = a / 3 e = a and b f = a or 0 g = not b h = a is not b",
+    "if a < 3 { b = 1 } elif a < 6 { b = 2 c = b * a } else { b = 3 }",
+    "x = 0 for i = 0; i < n; i = i + 1 { if i % 2 is 0 { x = x + i } else { x = x - 1 } }",
+    "x = 1 for i = 0; i < n; i = i + 1 { for j = 0; j < i; j = j + 1 { x = x * 3 % 1000003 } }",
+    "for ;; { x = 1 } y = 5",
+    "if n > 20 { for ; n > 0; { n = n - 1 } }",
+    "a = n * n * n * n * n * n * n * n * n * n * n * n * n * n * n * n",
+    "a = 10 / n b = 4",
+    "a = 9223372036854775807 + n",
+]
+
+BATCH = [{"n": n, "a": n % 9, "b": n - 4, "c": 7} for n in range(1, 40)] + [{}, {"n": -3}, {"b": 10 ** 30}]
+
+
+def expected(prog, batch, max_op_count=-1):
+    return [prog.run(static_vars, max_op_count) for static_vars in batch]
+
+
+def typed(states):
+    # 0 == False, so the types of the values are compared as well.
+    return [{name: (type(value), value) for name, value in state.items()} for state in states]
+
+
+@pytest.mark.parametrize("code", PROGRAMS)
+def test_same_end_states(compile_engine, code):
+    prog = compile_engine(code)
+    vector_batch = [static_vars for static_vars in BATCH if static_vars.get("n")]
+    assert typed(prog.run_batch(vector_batch)) == typed(expected(prog, vector_batch))
+
+
+@pytest.mark.parametrize("code", PROGRAMS[:4])
+def test_missing_vars(code):
+    prog = compile(code)
+    assert prog.run_batch(BATCH + [{}] * 8) == expected(prog, BATCH + [{}] * 8)
+
+
+def test_arrays_and_big_ints():
+    prog = compile(PROGRAMS[1])
+    states = BATCH + [{"a": 4, "b": [1, 2]}, {"a": 4, "c": [3]}, {"a": 2 ** 62}, {"a": -2 ** 70}]
+    assert prog.run_batch(states) == expected(prog, states)
+
+
+@pytest.mark.parametrize("code", PROGRAMS)
+@pytest.mark.parametrize("max_op_count", [5, 30, 200])
+def test_max_op_count(code, max_op_count):
+    prog = compile(code, engine="interpreter")
+    vector_batch = [static_vars for static_vars in BATCH if static_vars.get("n")]
+    try:
+        results = expected(prog, vector_batch, max_op_count)
+    except (ExecutionCountExceededException, DivisionByZeroException) as e:
+        with pytest.raises(type(e)):
+            prog.run_batch(vector_batch, max_op_count)
+    else:
+        assert prog.run_batch(vector_batch, max_op_count) == results
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_bools(compile_engine, optimize):
+    prog = compile_engine("y = n < 0 z = not n w = t and n v = n or t u = -t + 1 k = 1 < 2", optimize=optimize)
+    states = [{"n": n, "t": n % 3 == 0} for n in range(40)]
+    assert typed(prog.run_batch(states)) == typed(expected(prog, states))
+
+
+def test_first_error():
+    prog = compile("a = 10 / n", engine="interpreter")
+    with pytest.raises(DivisionByZeroException):
+        prog.run_batch([{"n": n} for n in range(-20, 20)])
+
+
+def test_unsupported_programs():
+    prog = compile("func f(n) { return n * 2 } a = f(n) b = [n] c = rand % 1", engine="closure")
+    assert not batch.vectorizable(prog)
+    assert prog.run_batch([{"n": n} for n in range(10)]) == expected(prog, [{"n": n} for n in range(10)])
+    prog = compile("func f(n) { return n + 1 } a = f(n)", engine="stack", inline=True)
+    assert prog.run_batch([{"n": n} for n in range(10)]) == expected(prog, [{"n": n} for n in range(10)])
+
+
+def test_without_numpy(monkeypatch):
+    monkeypatch.setattr(batch, "numpy", None)
+    prog = compile(PROGRAMS[2])
+    assert prog.run_batch(BATCH) == expected(prog, BATCH)
+
+
+@pytest.mark.parametrize("code", PROGRAMS)
+@pytest.mark.parametrize("cost_model", [None, CALIBRATED])
+def test_lanes(code, cost_model):
+    pytest.importorskip("numpy")
+    options = {} if cost_model is None else {"cost_model": cost_model}
+    prog = compile(code, engine="interpreter", **options)
+    states = [static_vars for static_vars in BATCH if static_vars.get("n") and batch.vector_state(static_vars)]
+    lanes = batch.Lanes(states, prog.cost_model, 10 ** 6)
+    lanes.run(prog.ast)
+    for lane, static_vars in enumerate(states):
+        if not lanes.scalar[lane]:
+            assert (lanes.state(lane), lanes.ops[lane]) == prog.run_counted(static_vars)
+
+
+def test_divergent_lanes():
+    pytest.importorskip("numpy")
+    prog = compile(PROGRAMS[2])
+    lanes = batch.Lanes([{"n": n} for n in range(40)], batch.UNIFORM, -1)
+    lanes.run(prog.ast)
+    # The loop kept running for fewer than MIN_LANES lanes, those are run on their own.
+    assert list(lanes.scalar) == [False] * (41 - batch.MIN_LANES) + [True] * (batch.MIN_LANES - 1)
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_overflowed_lanes_dont_warn():
+    # The lanes where a * 4 overflowed hold -2 ** 63, dividing it by -1 overflows again.
+    prog = compile("a = n * 4 b = a / -1 c = a % -1")
+    states = [{"n": 2 ** 61}] * 20 + [{"n": n} for n in range(20)]
+    assert prog.run_batch(states) == expected(prog, states)
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from littlepython.ast import Call, Var
+from littlepython.cost import CostModel, UNIFORM, CALIBRATED
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from littlepython.feature import Features
+from littlepython.interpreter import plan_block
+from littlepython.parser import Parser
+from littlepython.tokenizer import Tokenizer
+from tests.interpreter import compile
+
+
+def parse(code):
+    return Parser(Tokenizer(code, Features.ALL), Features.ALL).program()
+
+
+def test_plan_block():
+    ast = parse("a = 1 b = a + 2 if a { c = 1 } d = 2")
+    a, b, control, d = ast.children
+    # The block, both assigns and the control block with its first ctrl, then the assign after it.
+    assert plan_block(ast) == ((9, (a, b, control)), (2, (d,)))
+
+
+def test_plan_empty_block():
+    assert plan_block(parse("")) == ((1, ()),)
+
+
+def test_plan_ends_at_return():
+    ast = parse("func f() { a = 1 return a b = 2 }")
+    block = ast.children[0].function.block
+    assert plan_block(block) == ((5, tuple(block.children[:2])),)
+
+
+@pytest.mark.parametrize("code, op_count", [
+    ("a = 1 b = a + 2", 7),
+    ("x = 0 for i = 0; i < 3; i = i + 1 { x = x + i }", 45),
+    ("if 0 { a = 1 } elif 1 { a = 2 } else { a = 3 }", 7),
+    ("func f(n) { return n * 2 } a = f(2)", 10),
+])
+def test_op_count(code, op_count):
+    prog = compile(code, engine="interpreter")
+    prog.run(max_op_count=op_count + 1)
+    with pytest.raises(ExecutionCountExceededException):
+        prog.run(max_op_count=op_count)
+
+
+def test_unlimited_run_isnt_counted():
+    prog = compile("x = 0 for i = 0; i < 3; i = i + 1 { x = x + i }", engine="interpreter")
+    ctx = prog.context()
+    prog.execute(ctx)
+    assert ctx.dump_cur_state() == {"x": 3, "i": 3}
+    assert ctx.count_remaining == -1
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "python"])
+def test_exceeded_run_replayed(engine):
+    prog = compile("a = 0 b = 1 / a c = 1 + 2 + 3", engine=engine)
+    # The whole basic block doesn't fit in 8 operations but the division does, so the replay raises.
+    with pytest.raises(DivisionByZeroException):
+        prog.run(max_op_count=8)
+    with pytest.raises(ExecutionCountExceededException):
+        prog.run(max_op_count=7)
+
+
+@pytest.mark.parametrize("engine", ["interpreter", "python", "vm"])
+def test_replay_draws_once(engine):
+    code = "a = rand b = rand % 5 c = 1 / (b - b) d = 1 + 2 + 3"
+    expected = random.Random(3)
+    with pytest.raises(DivisionByZeroException):
+        compile(code, engine="closure").run(max_op_count=15, random=expected)
+    rng = random.Random(3)
+    with pytest.raises(DivisionByZeroException):
+        compile(code, engine=engine).run(max_op_count=15, random=rng)
+    assert rng.getstate() == expected.getstate()
+
+
+@pytest.mark.parametrize("code, cost_model, op_count", [
+    ("a = b", CALIBRATED, 4),
+    ("a = 5 % 2 b = 5 + 2", CostModel(binary_ops={"%": 4}), 12),
+    ("a = not 1 b = -1", CostModel(unary_ops={"not": 3}), 9),
+    ("a = [1, 2, 3]", CostModel(array_item=2), 12),
+    ("func f(x, y) { return x } a = f(1, 2)", CostModel({Call: 3, Var: 2}, arg=1), 14),
+    ("x = 0 for i = 0; i < 3; i = i + 1 { x = x + i }", CostModel({Var: 2}), 58),
+])
+def test_cost_model(code, cost_model, op_count):
+    prog = compile(code, engine="interpreter", cost_model=cost_model)
+    prog.run(max_op_count=op_count + 1)
+    with pytest.raises(ExecutionCountExceededException):
+        prog.run(max_op_count=op_count)
+
+
+def test_uniform_cost():
+    assert UNIFORM.cost(parse("a = [1, 2] b = f(a, 3)")) == 9
+
+
+@pytest.mark.parametrize("kargs", [
+    {"nodes": {Var: 0}},
+    {"binary_ops": {"+": -1}},
+    {"unary_ops": {"-": 1.5}},
+    {"array_item": -1},
+    {"arg": None},
+])
+def test_invalid_cost_model(kargs):
+    with pytest.raises(ValueError):
+        CostModel(**kargs)
+
+
+def test_cost_model_needs_interpreter():
+    with pytest.raises(ValueError):
+        compile("a = 1", cost_model=CALIBRATED)
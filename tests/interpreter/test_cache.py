@@ -0,0 +1,103 @@
+import pickle
+import threading
+
+import pytest
+
+from littlepython import Compiler, Features
+from littlepython.cost import CALIBRATED
+from littlepython.error import InvalidSyntaxException
+
+CODE = "func f(n) { return n * 2 } a = f(3)"
+
+
+def test_hits_and_misses():
+    compiler = Compiler()
+    prog = compiler.compile(CODE)
+    assert compiler.compile(CODE) is prog
+    assert compiler.compile("a = 1") is not prog
+    assert compiler.cache_info() == (1, 2, 0, 2, 128)
+    assert prog.run() == {"a": 6}
+
+
+@pytest.mark.parametrize("options", [{"features": Features.ALL - Features.RANDOM_VAR}, {"engine": "stack"},
+                                     {"optimize": True}, {"inline": True}, {"memoize": True},
+                                     {"engine": "interpreter", "cost_model": CALIBRATED}])
+def test_options_in_key(options):
+    compiler = Compiler()
+    prog = compiler.compile(CODE)
+    other = compiler.compile(CODE, **options)
+    assert other is not prog
+    assert compiler.compile(CODE, **options) is other
+    assert compiler.compile(CODE) is prog
+
+
+def test_equal_features():
+    compiler = Compiler()
+    prog = compiler.compile(CODE, features=Features.IF | Features.FUNC)
+    assert compiler.compile(CODE, features=Features.FUNC + Features.IF) is prog
+
+
+def test_eviction():
+    compiler = Compiler(2)
+    first = compiler.compile("a = 1")
+    compiler.compile("a = 2")
+    # Using the first program makes the second one the least recently used.
+    assert compiler.compile("a = 1") is first
+    compiler.compile("a = 3")
+    assert compiler.cache_info() == (1, 3, 1, 2, 2)
+    assert compiler.compile("a = 1") is first
+    compiler.compile("a = 2")
+    assert compiler.cache_info().evictions == 2
+
+
+def test_disabled():
+    compiler = Compiler(0)
+    assert compiler.compile(CODE) is not compiler.compile(CODE)
+    assert compiler.cache_info() == (0, 0, 0, 0, 0)
+
+
+def test_errors_not_cached():
+    compiler = Compiler()
+    for _ in range(2):
+        with pytest.raises(InvalidSyntaxException):
+            compiler.compile("a = (")
+    assert compiler.cache_info().size == 0
+
+
+def test_clear_cache():
+    compiler = Compiler()
+    prog = compiler.compile(CODE)
+    compiler.clear_cache()
+    assert compiler.cache_info() == (0, 0, 0, 0, 128)
+    assert compiler.compile(CODE) is not prog
+
+
+def test_threads():
+    compiler = Compiler(4)
+    sources = ["a = {}".format(i) for i in range(8)]
+    errors = []
+
+    def compile_all():
+        try:
+            for _ in range(20):
+                for i, source in enumerate(sources):
+                    assert compiler.compile(source).run() == {"a": i}
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=compile_all) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    info = compiler.cache_info()
+    assert info.hits + info.misses == 4 * 20 * 8
+    assert info.size == 4
+
+
+def test_pickle_inlined():
+    compiler = Compiler()
+    prog = compiler.compile(CODE, inline=True)
+    copy = pickle.loads(pickle.dumps(prog))
+    assert copy.run({"n": 1}) == prog.run({"n": 1}) == {"a": 6, "n": 3}
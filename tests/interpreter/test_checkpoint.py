@@ -0,0 +1,103 @@
+import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from littlepython import checkpoint
+from littlepython.error import DivisionByZeroException
+from tests.interpreter import compile
+from tests.interpreter.test_engines import PROGRAMS
+
+FIB = "func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(8) r = rand"
+SHARED = "func f(b) { b[0] = b[0] + rand % 3 c = b return c } a = [0] for i = 0; i < 4; i = i + 1 { d = f(a) }"
+
+
+def finish(run):
+    try:
+        run.resume()
+    except DivisionByZeroException as e:
+        return type(e)
+    return run.state, run.op_count
+
+
+def restore_and_finish(code, data):
+    return finish(checkpoint.load(compile(code, engine="stack"), data))
+
+
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+@pytest.mark.parametrize("max_op_count", [1, 5, 20])
+def test_same_end_state(code, in_state, max_op_count):
+    prog = compile(code, engine="stack")
+    expected = finish(prog.run(dict(in_state), max_op_count, random.Random(4), suspend=True))
+    run = prog.run(dict(in_state), max_op_count, random.Random(4), suspend=True)
+    # A copy of the program is made of other node objects, like the program in another process.
+    copy = pickle.loads(pickle.dumps(prog))
+    assert finish(checkpoint.load(copy, checkpoint.dump(run))) == expected
+
+
+def test_checkpoint_of_checkpoint():
+    prog = compile(FIB, engine="stack")
+    expected = prog.run_counted(random=random.Random(2))
+    run = prog.run(max_op_count=40, random=random.Random(2), suspend=True)
+    for _ in range(10):
+        run = checkpoint.load(prog, checkpoint.dump(run))
+        run.resume(13)
+    assert finish(run) == expected
+
+
+def test_shared_arrays():
+    prog = compile(SHARED, engine="stack")
+    expected = prog.run_counted(random=random.Random(3))
+    for max_op_count in range(1, expected[1], 7):
+        run = prog.run(max_op_count=max_op_count, random=random.Random(3), suspend=True)
+        restored = checkpoint.load(prog, checkpoint.dump(run))
+        assert finish(restored) == expected
+        # The original run isn't touched by the checkpoint.
+        assert finish(run) == expected
+
+
+def test_another_process():
+    prog = compile(FIB, engine="stack")
+    run = prog.run(max_op_count=100, random=random.Random(5), suspend=True)
+    with ProcessPoolExecutor(1) as executor:
+        result = executor.submit(restore_and_finish, FIB, checkpoint.dump(run)).result()
+    assert result == prog.run_counted(random=random.Random(5))
+
+
+def test_finished_run():
+    prog = compile("a = [1, 2]", engine="stack")
+    run = prog.run(suspend=True)
+    restored = checkpoint.load(prog, checkpoint.dump(run))
+    assert restored.done
+    assert (restored.state, restored.op_count) == ({"a": [1, 2]}, 5)
+
+
+def test_compact():
+    # Only a program which reads rand needs the state of the random number generator.
+    prog = compile("func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(8)", engine="stack")
+    run = prog.run(max_op_count=200, suspend=True)
+    assert len(checkpoint.dump(run)) < 400
+    run = compile(FIB, engine="stack").run(max_op_count=200, suspend=True)
+    assert len(checkpoint.dump(run)) < 4000
+
+
+def test_invalid():
+    prog = compile(FIB, engine="stack")
+    data = checkpoint.dump(prog.run(max_op_count=10, suspend=True))
+    with pytest.raises(ValueError):
+        checkpoint.load(prog, b"nonsense")
+    with pytest.raises(ValueError):
+        checkpoint.load(prog, data[:4] + b"\x02" + data[5:])
+    with pytest.raises(ValueError):
+        checkpoint.load(compile("a = 1", engine="stack"), data)
+
+
+def test_random_without_state():
+    class Dice(object):
+        def randint(self, a, b):
+            return 4
+
+    run = compile(FIB, engine="stack").run(max_op_count=10, random=Dice(), suspend=True)
+    with pytest.raises(ValueError):
+        checkpoint.dump(run)
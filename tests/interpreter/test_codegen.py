@@ -0,0 +1,28 @@
+from littlepython.closure import ClosureProg
+from tests.interpreter import compile
+
+
+def test_function_per_def():
+    prog = compile("func a() { return 1 } func b() { return 2 } c = a() + b()", engine="python")
+    assert "def _f0():" in prog.source
+    assert "def _f1():" in prog.source
+    assert prog.run() == {"c": 3}
+
+
+def test_for_loop_is_while_loop():
+    prog = compile("x = 0 for i = 0; i < 10; i = i + 1 {x = x + 1}", engine="python")
+    assert "while " in prog.source
+    assert prog.run() == {"x": 10, "i": 10}
+
+
+def test_elif_chain():
+    prog = compile("if a < 1 { b = 1 } elif a < 2 { b = 2 } else { b = 3 }", engine="python")
+    assert "elif " in prog.source
+    assert [prog.run({"a": a})["b"] for a in range(3)] == [1, 2, 3]
+
+
+def test_too_deeply_nested_falls_back():
+    code = "x = 0 " + "for i = 0; i < 1; i = i + 1 {" * 30 + "x = x + 1" + "}" * 30
+    prog = compile(code, engine="python")
+    assert isinstance(prog.fallback, ClosureProg)
+    assert prog.run()["x"] == 1
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from littlepython.error import DivisionByZeroException
+from tests.interpreter import compile
+from tests.interpreter.test_engines import PROGRAMS
+
+FIB = "func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(8) r = rand"
+
+
+def expected(code, in_state):
+    try:
+        return compile(code, engine="interpreter").run_counted(dict(in_state), random=random.Random(4))
+    except DivisionByZeroException as e:
+        return type(e)
+
+
+def resumed(code, in_state, max_op_count, more_ops):
+    run = compile(code, engine="stack").run(dict(in_state), max_op_count, random.Random(4), suspend=True)
+    try:
+        while not run.resume(more_ops):
+            pass
+    except DivisionByZeroException as e:
+        return type(e)
+    return run.state, run.op_count
+
+
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+@pytest.mark.parametrize("max_op_count, more_ops", [(1, 1), (2, 3), (10, 7), (-1, 1)])
+def test_same_end_state(code, in_state, max_op_count, more_ops):
+    assert resumed(code, in_state, max_op_count, more_ops) == expected(code, in_state)
+
+
+def test_paused():
+    prog = compile(FIB, engine="stack")
+    run = prog.run(max_op_count=20, random=random.Random(1), suspend=True)
+    assert not run.done
+    assert run.state is None
+    # Like a run without suspend, the run can use one operation less than max_op_count.
+    assert run.op_count == 19
+    assert run.frames
+    assert not run.resume(5)
+    assert run.op_count == 24
+    assert run.resume()
+    assert (run.state, run.op_count) == prog.run_counted(random=random.Random(1))
+    # Resuming a finished run does nothing.
+    assert run.resume(5)
+    assert run.op_count == prog.run_counted()[1]
+
+
+def test_finished():
+    run = compile("a = 1", engine="stack").run(max_op_count=10, suspend=True)
+    assert run.done
+    assert (run.state, run.op_count) == ({"a": 1}, 3)
+    run = compile("a = 1", engine="stack").run(max_op_count=4, suspend=True)
+    assert (run.state, run.op_count) == ({"a": 1}, 3)
+    run = compile("a = 1", engine="stack").run(max_op_count=3, suspend=True)
+    assert not run.done
+
+
+def test_top_level_return():
+    run = compile("a = 1 return a b = 2", engine="stack").run(max_op_count=2, suspend=True)
+    assert not run.done
+    assert run.resume()
+    assert run.state == {"a": 1}
+
+
+def test_independent_runs():
+    prog = compile(FIB, engine="stack")
+    first = prog.run(max_op_count=30, random=random.Random(1), suspend=True)
+    second = prog.start(random=random.Random(1))
+    assert second.op_count == 0
+    second.resume(50)
+    first.resume()
+    second.resume()
+    assert first.state == second.state
+    assert first.op_count == second.op_count
+
+
+def test_inlined():
+    prog = compile("func f(n) { return n + 1 } a = f(1)", engine="stack", inline=True)
+    run = prog.run({"n": 5}, 2, suspend=True)
+    run.resume()
+    assert run.state == prog.run({"n": 5})
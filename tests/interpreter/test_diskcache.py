@@ -0,0 +1,126 @@
+import os
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from littlepython import Compiler, lp, diskcache, closure
+from littlepython.cost import CALIBRATED
+
+CODE = "func f(n) { return n * 2 } b = [1, 2] c = f(3) + rand % 5 for i = 0; i < 4; i = i + 1 { b[i] = f(i) }"
+
+
+def no_parsing(monkeypatch):
+    def parser(*args):
+        raise AssertionError("The program was parsed.")
+    monkeypatch.setattr(lp, "Parser", parser)
+
+
+def compile_in_process(directory, sources):
+    compiler = Compiler(0, directory)
+    return [compiler.compile(source).run() for source in sources]
+
+
+@pytest.mark.parametrize("options", [{}, {"inline": True}, {"optimize": True}])
+def test_load(tmp_path, monkeypatch, engine, options):
+    prog = Compiler(cache_dir=str(tmp_path)).compile(CODE, engine=engine, **options)
+    # A new Compiler, like one in a restarted process, loads the program instead of compiling it.
+    no_parsing(monkeypatch)
+    compiler = Compiler(cache_dir=str(tmp_path))
+    loaded = compiler.compile(CODE, engine=engine, **options)
+    assert (compiler.disk_cache.hits, compiler.disk_cache.misses) == (1, 0)
+    assert loaded.run_counted(random=random.Random(1)) == prog.run_counted(random=random.Random(1))
+    assert loaded.removed == prog.removed
+
+
+def test_options_in_key(tmp_path):
+    compiler = Compiler(0, str(tmp_path))
+    compiler.compile(CODE, engine="interpreter")
+    compiler.compile(CODE, engine="interpreter", cost_model=CALIBRATED)
+    compiler.compile(CODE, engine="interpreter", memoize=False, optimize=True)
+    assert (compiler.disk_cache.hits, compiler.disk_cache.misses) == (0, 3)
+    assert len(os.listdir(str(tmp_path))) == 3
+    prog = compiler.compile(CODE, engine="interpreter", cost_model=CALIBRATED)
+    assert prog.cost_model == CALIBRATED
+    assert compiler.disk_cache.hits == 1
+
+
+def test_other_version(tmp_path, monkeypatch):
+    Compiler(0, str(tmp_path)).compile(CODE)
+    monkeypatch.setattr(diskcache, "version", "0.0.0")
+    compiler = Compiler(0, str(tmp_path))
+    compiler.compile(CODE)
+    assert (compiler.disk_cache.hits, compiler.disk_cache.misses) == (0, 1)
+
+
+@pytest.mark.parametrize("damage", [lambda data: data[:len(data) // 2],
+                                    lambda data: data[:-1] + bytes(bytearray([data[-1] ^ 1])),
+                                    lambda data: data[:3] + b"\x09" + data[4:],
+                                    lambda data: b""])
+def test_damaged_entry(tmp_path, damage):
+    prog = Compiler(0, str(tmp_path)).compile(CODE)
+    path = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(damage(data))
+    compiler = Compiler(0, str(tmp_path))
+    assert compiler.compile(CODE).run(random=random.Random(1)) == prog.run(random=random.Random(1))
+    assert compiler.disk_cache.rebuilt == 1
+    # The damaged entry has been replaced.
+    compiler.compile(CODE)
+    assert compiler.disk_cache.hits == 1
+
+
+def test_memory_cache_first(tmp_path):
+    compiler = Compiler(cache_dir=str(tmp_path))
+    prog = compiler.compile(CODE)
+    assert compiler.compile(CODE) is prog
+    assert (compiler.disk_cache.hits, compiler.disk_cache.misses) == (0, 1)
+
+
+def test_unwritable_directory(tmp_path):
+    # A file where the directory should be.
+    path = str(tmp_path / "file")
+    open(path, "w").close()
+    compiler = Compiler(0, path)
+    assert compiler.compile("a = 1").run() == {"a": 1}
+    assert compiler.compile("a = 1").run() == {"a": 1}
+    assert compiler.disk_cache.misses == 2
+
+
+def test_unpicklable_program(tmp_path, monkeypatch):
+    def reduce(self):
+        raise TypeError("can't pickle")
+    monkeypatch.setattr(closure.ClosureProg, "__reduce__", reduce)
+    compiler = Compiler(0, str(tmp_path))
+    assert compiler.compile("a = 1").run() == {"a": 1}
+    compiler.disk_cache.store(b"k" * 32, lambda: 1)
+    compiler.disk_cache.store(b"k" * 32, threading.Lock())
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Needs POSIX permissions.")
+def test_private_directory(tmp_path):
+    Compiler(0, str(tmp_path / "cache")).compile("a = 1")
+    assert os.stat(str(tmp_path / "cache")).st_mode & 0o777 == 0o700
+
+
+def test_concurrent_writers(tmp_path):
+    sources = ["a = {} b = a * 2".format(i) for i in range(20)]
+    with ProcessPoolExecutor(4) as executor:
+        results = list(executor.map(compile_in_process, [str(tmp_path)] * 8, [sources] * 8))
+    assert all(result == [{"a": i, "b": i * 2} for i in range(20)] for result in results)
+    assert sorted(name.endswith(".lpc") for name in os.listdir(str(tmp_path))) == [True] * 20
+    compiler = Compiler(0, str(tmp_path))
+    for source in sources:
+        compiler.compile(source)
+    assert compiler.disk_cache.hits == 20
+
+
+def test_clear(tmp_path):
+    compiler = Compiler(0, str(tmp_path))
+    compiler.compile(CODE)
+    compiler.disk_cache.clear()
+    assert os.listdir(str(tmp_path)) == []
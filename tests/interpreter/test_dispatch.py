@@ -0,0 +1,22 @@
+import pytest
+
+from littlepython.ast import AST, Block, Assign, BinaryOp, Int, Var
+from littlepython.feature import Features
+from littlepython.interpreter import LPProg
+from tests.interpreter import compile
+
+
+class Unknown(AST):
+    def __str__(self):
+        return "unknown"
+
+
+def test_dispatch_table():
+    prog = compile("a = b + 1", engine="interpreter")
+    assert set(prog.dispatch) == {Block, Assign, BinaryOp, Var, Int}
+    assert prog.run({"b": 1}) == {"a": 2, "b": 1}
+
+
+def test_unknown_node_fails_on_load():
+    with pytest.raises(NotImplementedError):
+        LPProg(Block([Unknown()]), Features.ALL)
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from tests.interpreter import compile
+
+ENGINES = ["closure", "python", "stack", "vm"]
+
+PROGRAMS = [
+    ("", {}),
+    ("a = 1 b = a + 2 c = a < b d = not c e = -a", {}),
+    ("a = 5 / 2 b = -5 / 2 c = 7 % 3 d = -7 % 3 e = 1 and 2 f = 0 or 3 g = 2 is 2 h = 2 is not 2", {}),
+    ("a = b * 2 + c", {"b": 3}),
+    ("if a < 2 { b = 1 } elif a < 4 { b = 2 } else { b = 3 }", {"a": 3}),
+    ("if a { b = 1 }", {"a": 0}),
+    ("x = 0 for i = 0; i < 10; i = i + 1 {x = x + i}", {}),
+    ("x = 0 for ;x < 10; {x = x + 1}", {}),
+    ("for ;; { x = 1 }", {}),
+    ("a = [1, 2, [3, 4]] b = a[2][1] a[0] = 5 c = a[7]", {}),
+    ("a[1] = a[0] + 1", {"a": [4]}),
+    ("b = [] for i = 0; i < 5; i = i + 1 { b[i] = i * i }", {}),
+    ("func add(a, b) { return a + b } c = add(1, 2)", {}),
+    ("func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } d = fib(10)", {}),
+    ("x = 0 func test() { x = 2 } test()", {}),
+    ("x = 0 func test(x) { x = x + 1 } test(2)", {}),
+    ("func f() { y = 1 } f()", {}),
+    ("func f() { return y } func g() { y = 5 return f() } a = g()", {}),
+    ("func f() { z = 1 } a = f()", {}),
+    ("func f() { z = 1 } a = f()", {"return": 7}),
+    ("func f(n) { return n * 2 } g = f a = g(4)", {}),
+    ("func outer(n) { func inner(m) { return m + n } return inner(1) } a = outer(4)", {}),
+    ("func f(a) { a[0] = 9 } b = [1] f(b)", {}),
+    ("a = rand b = rand", {}),
+    ("func f(n) { for i = 0; i < n; i = i + 1 { if i is 3 { return i } } return -1 } a = f(10) b = f(2)", {}),
+    ("func f() { a = x x = 2 b = x return a + b } c = f() func g() { x = 3 return f() } d = g()", {}),
+    ("func f() { return y } func g(y) { return f() } a = g(5)", {}),
+    ("func f(x) { return x } a = f(4)", {"x": 1}),
+    ("func f() { return 1 } rand = f a = rand()", {}),
+    ("func g() { c = 1 } func f() { b = 2 return g() } d = f()", {"return": 5}),
+    ("a = 1 for i = 0; i < 5; i = i + 1 { if i is 2 { return a } a = a * 3 } b = 2", {}),
+    ("func f(n) { for i = 0; i < n; i = i + 1 { f(i) } return n } a = f(4)", {}),
+]
+
+
+# Programs which fail part way through a basic block, or in a function called from one.
+FAILING_PROGRAMS = [
+    ("a = ((0 - n) - (c and ((a / 0) - c))) c = 0 b = (0 * (c < -(b + a)))", {"n": 1, "c": 1}),
+    ("func f() { return 1 / 0 } a = 1 b = f() + 1 + 2 + 3 + 4 + 5 c = 2", {}),
+    ("a = rand b = rand % 7 c = 1 / (b - b) d = 1 + 2 + 3", {}),
+    ("for i = 0; i < 3; i = i + 1 { a = 10 / (2 - i) + 1 + 2 + 3 }", {}),
+]
+
+
+def run_engine(engine, code, in_state, max_op_count=-1):
+    prog = compile(code, engine=engine)
+    try:
+        return prog.run(dict(in_state), max_op_count=max_op_count, random=random.Random(4))
+    except (ExecutionCountExceededException, DivisionByZeroException) as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+def test_same_end_state(engine, code, in_state):
+    assert run_engine(engine, code, in_state) == run_engine("interpreter", code, in_state)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+@pytest.mark.parametrize("max_op_count", [1, 2, 5, 10, 20, 50, 100, 1000])
+def test_same_op_count(engine, code, in_state, max_op_count):
+    expected = run_engine("interpreter", code, in_state, max_op_count)
+    assert run_engine(engine, code, in_state, max_op_count) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("code, in_state", PROGRAMS)
+def test_same_counted_ops(engine, code, in_state):
+    expected = compile(code, engine="interpreter").run_counted(dict(in_state), random=random.Random(4))
+    assert compile(code, engine=engine).run_counted(dict(in_state), random=random.Random(4)) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("code, in_state", FAILING_PROGRAMS)
+def test_same_error_part_way(engine, code, in_state):
+    for max_op_count in range(1, 40):
+        expected = run_engine("interpreter", code, in_state, max_op_count)
+        assert run_engine(engine, code, in_state, max_op_count) == expected, max_op_count
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_division_by_zero(engine):
+    with pytest.raises(DivisionByZeroException):
+        compile("a = 0 b = 1 / a", engine=engine).run()
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        compile("a = 1", engine="unknown")
@@ -17,3 +17,13 @@ def test_func_scope_overlapping_global():
     b = {}
     e = run("x=0 func test(x) { x = x + 1} test(2)")
     assert e == {"x": 3}
+
+
+def test_func_no_return_in_caller():
+    e = run("func g() { c = 1 } func f() { b = 2 return g() } d = f()", in_state={"return": 5})
+    assert e == {"return": 5, "d": 0}
+
+
+def test_return_outside_func():
+    e = run("a = 1 if a { return a + 1 } b = 2")
+    assert e == {"a": 1}
@@ -0,0 +1,26 @@
+import pytest
+
+from tests.interpreter import compile
+
+ENGINES = ["interpreter", "closure", "stack"]
+
+
+def test_cache_on_call_node():
+    prog = compile("func add(a, b) { return a + b } c = add(1, 2)", engine="interpreter")
+    assert prog.run() == {"c": 3}
+    call = prog.ast.children[1].right
+    assert call.cache == (prog.ast.children[0].function, ("a", "b"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_rebound_name(engine):
+    code = "func f(a) { return a } func g(b) { return b * 2 } x = [] " \
+           "for i = 0; i < 4; i = i + 1 { if i % 2 { h = g } else { h = f } x[i] = h(i) }"
+    assert compile(code, engine=engine).run()["x"] == [0, 2, 2, 6]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_rebound_to_wrong_arity(engine):
+    code = "func f(a) { return a } func g(a, b) { return a } h = f x = h(1) h = g y = h(1)"
+    with pytest.raises(AssertionError):
+        compile(code, engine=engine).run()
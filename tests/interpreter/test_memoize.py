@@ -0,0 +1,73 @@
+import pytest
+
+from littlepython.closure import MemoStats, ClosureProg
+from littlepython.error import ExecutionCountExceededException
+from littlepython.feature import Features
+from littlepython.optimizer import pure_functions
+from littlepython.parser import Parser
+from littlepython.tokenizer import Tokenizer
+from tests.interpreter import compile
+
+FIB = "func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(m)"
+
+
+def pure(code):
+    return list(pure_functions(Parser(Tokenizer(code, Features.ALL), Features.ALL).program()))
+
+
+@pytest.mark.parametrize("code, expected", [
+    (FIB, ["fib"]),
+    ("func f(n) { x = n * 2 if n { y = 1 } else { y = 2 } return x + y }", ["f"]),
+    ("func f(n) { s = 0 for i = 0; i < n; i = i + 1 { s = s + i } return s }", ["f"]),
+    ("func f(n) { return g(n) } func g(n) { return n }", ["f", "g"]),
+    # Reads a name it hasn't assigned to.
+    ("func f(n) { return n + g }", []),
+    ("func f(n) { if n { y = 1 } return y }", []),
+    ("func f(n) { for i = 0; i < n; i = i + 1 { s = i } return s }", []),
+    # Doesn't always return.
+    ("func f(n) { if n { return 1 } }", []),
+    # Reads rand, sets an array item or calls an impure function.
+    ("func f(n) { return rand }", []),
+    ("func f(n) { n[0] = 1 return 0 }", []),
+    ("func f(n) { return g(n) } func g(n) { return h }", []),
+    # Assigns to a global.
+    ("x = 1 func f(n) { x = n return x }", []),
+    ("n = 1 func f(n) { return n }", []),
+])
+def test_pure_functions(code, expected):
+    assert pure(code) == expected
+
+
+def test_memoize():
+    prog = compile(FIB, memoize=True)
+    assert isinstance(prog, ClosureProg)
+    state, _, stats = prog.run_counted({"m": 60}, stats=True)
+    assert state == {"m": 60, "a": 1548008755920}
+    assert stats == {"fib": MemoStats(hits=58, misses=61)}
+    assert prog.run_counted({"m": 5}, stats=True)[2] == {"fib": MemoStats(hits=3, misses=6)}
+
+
+def test_fewer_ops():
+    with pytest.raises(ExecutionCountExceededException):
+        compile(FIB).run({"m": 25}, max_op_count=100000)
+    assert compile(FIB, memoize=True).run({"m": 25}, max_op_count=100000)["a"] == 75025
+
+
+def test_bounded():
+    prog = compile(FIB, memoize=True)
+    prog.memo_size = 1
+    state, _, stats = prog.run_counted({"m": 15}, stats=True)
+    assert state["a"] == 610
+    assert stats["fib"].misses > 16
+
+
+def test_not_memoized_when_static_vars_assigned():
+    prog = compile(FIB, memoize=True)
+    state, _, stats = prog.run_counted({"m": 10, "n": 3}, stats=True)
+    assert state == compile(FIB).run({"m": 10, "n": 3})
+    assert stats == {}
+
+
+def test_memoize_needs_closure_engine():
+    with pytest.raises(ValueError):
+        compile(FIB, memoize=True, engine="interpreter")
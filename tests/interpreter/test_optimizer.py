@@ -0,0 +1,315 @@
+import random
+
+import pytest
+
+from littlepython.ast import NoOp
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from littlepython.feature import Features
+from littlepython.optimizer import optimize, Removal, Inliner
+from littlepython.parser import Parser
+from littlepython.tokenizer import Tokenizer
+from tests import c, v, add, sub, mult, div, lt, asg, blk, _if, ctrl, _for, _def, sig, ret, call
+from tests.interpreter import compile
+from tests.interpreter.test_engines import PROGRAMS
+
+
+def opt(code, report=None):
+    return optimize(Parser(Tokenizer(code, Features.ALL), Features.ALL).program(), report)
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("a = 10 * 10 - 1", asg(v("a"), c(99))),
+    ("a = -7 / 2", asg(v("a"), c(-4))),
+    ("a = -7 % 3", asg(v("a"), c(2))),
+    ("a = 1 < 2", asg(v("a"), c(True))),
+    ("a = not 0", asg(v("a"), c(True))),
+    ("a = 1 and 0", asg(v("a"), c(0))),
+    ("a = b + 2 * 3", asg(v("a"), add(v("b"), c(6)))),
+])
+def test_fold(code, expected):
+    assert opt(code) == blk([expected])
+
+
+def test_fold_keeps_bools():
+    prog = compile("a = 1 < 2 b = 2 is 3", optimize=True)
+    assert prog.run() == {"a": True, "b": False}
+
+
+@pytest.mark.parametrize("code", ["a = 1 / 0", "a = 1 % (2 - 2)"])
+def test_division_by_zero_is_deferred(code):
+    prog = compile(code, optimize=True)
+    with pytest.raises(DivisionByZeroException):
+        prog.run()
+
+
+def test_unreached_division_by_zero():
+    assert compile("if a { b = 1 / 0 }", optimize=True).run() == {}
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("a = (b * 2) + 0", asg(v("a"), mult(v("b"), c(2)))),
+    ("a = 0 + (b - 1)", asg(v("a"), sub(v("b"), c(1)))),
+    ("a = (b / 3) * 1", asg(v("a"), div(v("b"), c(3)))),
+    ("a = 1 * -b", asg(v("a"), sub(v("b")))),
+    ("a = not (not (b < 1))", asg(v("a"), lt(v("b"), c(1)))),
+])
+def test_identities(code, expected):
+    assert opt(code) == blk([expected])
+
+
+@pytest.mark.parametrize("code", [
+    # b could be a bool or an array, which these operations don't leave unchanged.
+    "a = b + 0",
+    "a = b * 1",
+    "a = not (not b)",
+])
+def test_identities_need_known_type(code):
+    assert opt(code) == Parser(Tokenizer(code, Features.ALL), Features.ALL).program()
+
+
+@pytest.mark.parametrize("in_state", [{"b": True}, {"b": 3}])
+def test_identities_keep_results(in_state):
+    code = "a = b + 0 c = not (not b)"
+    assert compile(code, optimize=True).run(in_state) == compile(code).run(in_state)
+
+
+def test_identities_keep_errors():
+    with pytest.raises(TypeError):
+        compile("a = b + 0", optimize=True).run({"b": [1]})
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("if 1 < 2 { a = 1 } else { a = 2 }", blk([blk([asg(v("a"), c(1))])])),
+    ("if 0 { a = 1 } else { a = 2 }", blk([blk([asg(v("a"), c(2))])])),
+    ("if 0 { a = 1 }", blk([blk()])),
+    ("if 0 { a = 1 } elif b { a = 2 } elif 1 { a = 3 } else { a = 4 }",
+     blk([ctrl([_if(v("b"), blk([asg(v("a"), c(2))]))], blk([asg(v("a"), c(3))]))])),
+    ("if not (not b) { a = 1 }", blk([ctrl([_if(v("b"), blk([asg(v("a"), c(1))]))], blk())])),
+])
+def test_prune_if(code, expected):
+    assert opt(code) == expected
+
+
+def test_loop_ctrl():
+    expected = _for(asg(v("i"), c(0)), v("b"), asg(v("i"), add(v("i"), c(1))), blk())
+    assert opt("for i = 0; not (not b); i = i + 1 {}") == blk([expected])
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("func f() { return 1 a = 2 } b = f()", blk([_def(v("f"), sig([]), blk([ret(c(1))])), asg(v("b"), call(v("f"), []))])),
+    ("func f(a) { if a { return 1 } else { return 2 } a = 3 } b = f(1)",
+     blk([_def(v("f"), sig([v("a")]), blk([ctrl([_if(v("a"), blk([ret(c(1))]))], blk([ret(c(2))]))])),
+          asg(v("b"), call(v("f"), [c(1)]))])),
+    ("func f() { if 1 { return 1 } a = 2 } b = f()",
+     blk([_def(v("f"), sig([]), blk([blk([ret(c(1))])])), asg(v("b"), call(v("f"), []))])),
+    ("return 1 a = 2", blk([ret(c(1))])),
+    ("for i = 0; 0; i = i + 1 { a = 1 }", blk([asg(v("i"), c(0))])),
+    ("for ;; { a = 1 }", blk([NoOp()])),
+    ("func f() { a = 1 } b = 2", blk([_def(v("f"), sig([]), blk()), asg(v("b"), c(2))])),
+])
+def test_dead_code(code, expected):
+    assert opt(code) == expected
+
+
+@pytest.mark.parametrize("code", [
+    "func f() { a = 1 } f()",
+    "func f() { a = 1 } g = f g()",
+    "func f() { a = 1 } func g() { f() } g()",
+    "if b { return 1 } a = 2",
+    "for i = 0; i < 2; i = i + 1 { return 1 }",
+])
+def test_live_code(code):
+    assert opt(code) == Parser(Tokenizer(code, Features.ALL), Features.ALL).program()
+
+
+def test_report():
+    report = []
+    opt("func f() { return 1 a = 2 } f() func g() { b = 1 } if 0 { c = 1 } elif d { c = 2 } for ;0; {}", report)
+    assert report == [
+        Removal("the condition is always false", "if 0 {\n  c = 1\n}"),
+        Removal("it follows a return", "a = 2"),
+        Removal("the loop condition is always false", "for ; 0;  {\n\n}"),
+        Removal("the function is never used", "func g() {\n  b = 1\n}"),
+    ]
+
+
+def test_removed():
+    assert compile("if 1 { a = 1 } else { a = 2 }", optimize=True).removed == [
+        Removal("an earlier condition is always true", "{\n  a = 2\n}")]
+    assert compile("if 1 { a = 1 } else { a = 2 }").removed == []
+
+
+def test_hoist():
+    expected = blk([blk([asg(v("i"), c(0)), asg(v("$0"), sub(v("n"), c(1))),
+                         ctrl([_if(lt(v("i"), v("$0")), blk([asg(v("$1"), mult(v("w"), v("h")))]))], blk()),
+                         _for(NoOp(), lt(v("i"), v("$0")), asg(v("i"), add(v("i"), c(1))),
+                              blk([asg(v("a"), add(v("a"), v("$1"))), asg(v("b"), v("$1"))]))])])
+    assert opt("for i = 0; i < n - 1; i = i + 1 { a = a + w * h b = w * h }") == expected
+
+
+def test_hoist_array_item():
+    code = "for i = 0; i < 3; i = i + 1 { a = a + b[0][i] }"
+    assert "$0 = b[0]" in str(opt(code))
+
+
+@pytest.mark.parametrize("code", [
+    # The expression reads a variable the loop assigns to.
+    "for i = 0; i < 3; i = i + 1 { a = i * 2 }",
+    "for i = 0; i < 3; i = i + 1 { a = w * h w = a }",
+    # The loop calls a function, which could assign to w.
+    "for i = 0; i < 3; i = i + 1 { a = w * h f() }",
+    # The loop sets an array item, which could change b[0].
+    "for i = 0; i < 3; i = i + 1 { a = b[0] * 2 c[i] = 1 }",
+    # The expression isn't evaluated on every iteration.
+    "for i = 0; i < 3; i = i + 1 { if d { a = 10 / d } }",
+    "for i = 0; i < 3; i = i + 1 { if i is 2 { return 1 } a = 10 / d }",
+    # The ctrl can't be evaluated an extra time.
+    "for i = 0; i < rand; i = i + 1 { a = w * h }",
+    "for i = 0; i < 3; i = i + 1 { a = rand * 2 }",
+])
+def test_no_hoist(code):
+    assert "$" not in str(opt(code))
+
+
+def test_temps_not_in_end_state():
+    assert compile("for i = 0; i < 3; i = i + 1 { a = w * h }", optimize=True).run({"w": 2, "h": 3}) == \
+        {"w": 2, "h": 3, "i": 3, "a": 6}
+
+
+def inline(code):
+    return Inliner().run(Parser(Tokenizer(code, Features.ALL), Features.ALL).program())
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("func f(a, b) { return a - b } c = f(x, 1)", asg(v("c"), sub(v("x"), c(1)))),
+    ("func f(a, b) { return a - b } c = f(b, a)", asg(v("c"), sub(v("b"), v("a")))),
+    ("func f(a) { return a * a } c = f(x)", asg(v("c"), mult(v("x"), v("x")))),
+    ("func f(a, b) { return a - b } c = f(x + 1, y * 2)", asg(v("c"), sub(add(v("x"), c(1)), mult(v("y"), c(2))))),
+    ("func f(a) { b = a * 2 return b + 1 } c = f(x)", asg(v("c"), add(mult(v("x"), c(2)), c(1)))),
+    ("func f(a) { return a + g } c = f(1)", asg(v("c"), add(c(1), v("g")))),
+])
+def test_inline(code, expected):
+    assert inline(code).children[1] == expected
+
+
+@pytest.mark.parametrize("code", [
+    # Functions with calls, rand or control flow aren't inlined.
+    "func f(a) { return f(a) } c = f(1)",
+    "func f(a) { return a + rand } c = f(1)",
+    "func f(a) { if a { return 1 } return 2 } c = f(1)",
+    "func f(a) { a = 1 } c = f(1)",
+    # Calling f assigns to a, which is a global.
+    "func f(a) { return a } a = 1 c = f(1)",
+    "func f(a) { b = a return b } b = 1 c = f(1)",
+    # It isn't certain which function f is.
+    "c = 1 func f(a) { return a } func f(a) { return 2 } c = f(1)",
+    "func f(a) { return a } f = 2 c = f(1)",
+    "func g(f) { return 1 } func f(a) { return a } c = f(1)",
+    "if 1 { func f(a) { return a } } c = f(1)",
+    "func g() { return f(1) } func f(a) { return a } c = g()",
+    # The args wouldn't be evaluated once in the same order.
+    "func f(a) { return a * a } c = f(x + 1)",
+    "func f(a) { return 1 } c = f(x + 1)",
+    "func f(a, b) { return b - a } c = f(x + 1, y + 1)",
+    "func f(a) { return a * a } c = f(rand)",
+    # An arg with a call or rand could change the names the expression reads.
+    "x = 1 func g() { x = 10 return 5 } func f(a) { return x + a } y = f(g())",
+    "x = 1 func g() { x = 10 return 5 } func f(a, b) { return b + a } y = f(x, g())",
+    "func f(a) { return a + 1 } c = f(rand + 1)",
+    # The arg count is wrong, which has to raise.
+    "func f(a) { return a } c = f(1, 2)",
+])
+def test_no_inline(code):
+    assert inline(code) == Parser(Tokenizer(code, Features.ALL), Features.ALL).program()
+
+
+def test_inline_falls_back():
+    prog = compile("func f(a) { return a * 2 } c = f(3)", inline=True)
+    assert prog.assumed_names == {"a"}
+    assert prog.run({"d": 1}) == {"c": 6, "d": 1}
+    assert prog.fallback is None
+    assert prog.run({"a": 1}) == {"a": 3, "c": 6}
+    assert prog.fallback is not None
+
+
+@pytest.mark.parametrize("code, y", [
+    ("x = 1 func g() { x = 10 return 5 } func f(a) { return x + a } y = f(g())", 15),
+    ("x = 1 func g() { x = 10 return 5 } func f(a, b) { return b + a } y = f(x, g())", 6),
+])
+def test_inline_keeps_arg_order(code, y):
+    expected = compile(code, engine="interpreter").run()
+    assert expected["y"] == y
+    assert compile(code, inline=True).run() == expected
+
+
+def test_tail_calls(compile_engine):
+    code = "func walk(i, acc) { if i is 0 { return acc } return walk(i - 1, acc + i) } a = walk(100000, 0)"
+    prog = compile_engine(code, optimize=True)
+    assert "$tail0" in str(prog.ast)
+    assert prog.run() == {"a": 5000050000}
+
+
+@pytest.mark.parametrize("code", [
+    "func f(n) { return f(n - 1) + 1 } a = f(1)",
+    "func f(n) { for ;n; { return f(n - 1) } } a = f(1)",
+    "func f(n) { return g(n - 1) } func g(n) { return f(n) } a = f(1)",
+    "func f(n) { return f(n - 1) } f = 1",
+])
+def test_no_tail_calls(code):
+    assert "$tail" not in str(opt(code))
+
+
+def test_fewer_ops():
+    code = "x = 0 for i = 0; i < 10; i = i + 1 { x = x + 10 * 10 - 1 }"
+    with pytest.raises(ExecutionCountExceededException):
+        compile(code).run(max_op_count=150)
+    assert compile(code, optimize=True).run(max_op_count=150) == {"x": 990, "i": 10}
+
+
+def test_more_ops_for_empty_loops():
+    # The hoisted temporaries and the guard cost more than a loop which never runs saves.
+    code = "s = 0 for i = 0; i < w * h; i = i + 1 { s = s + w * h }"
+    assert compile(code).run_counted({"w": 0, "h": 3}) == ({"w": 0, "h": 3, "s": 0, "i": 0}, 11)
+    assert compile(code, optimize=True).run_counted({"w": 0, "h": 3}) == ({"w": 0, "h": 3, "s": 0, "i": 0}, 15)
+    with pytest.raises(ExecutionCountExceededException):
+        compile(code, optimize=True).run({"w": 0, "h": 3}, max_op_count=12)
+
+
+OPTIMIZED_PROGRAMS = PROGRAMS + [
+    ("a = 3 * (2 + 4) - -1 b = a + 0 if a > 10 { c = 1 } elif 1 { c = 2 } d = not (not (a < 1))", {}),
+    ("for i = 0; 0; i = i + 1 { a = 1 }", {}),
+    ("func f(n) { if n { return 1 } else { return 2 } n = 5 } a = f(0) func g() { a = 7 }", {"g": 1}),
+    ("s = 0 for y = 0; y < h; y = y + 1 { for x = 0; x < w * 2; x = x + 1 { s = s + b[y][x] * (w * h) } }",
+     {"w": 3, "h": 2, "b": [[1, 2, 3, 4, 5, 6], [7, 8, 9, 1, 2, 3]]}),
+    ("for i = 0; i < n - 1; i = i + 1 { if d { a = 10 / d } b = k * 2 }", {"n": 4, "d": 0, "k": 3}),
+    ("for i = 0; i < 0; i = i + 1 { a = 10 / d }", {}),
+    ("func f(n) { t = 0 for i = 0; i < n; i = i + 1 { t = t + n * 2 } return t } a = f(5)", {}),
+    ("func f(a, b) { return a - b } x = 3 y = 5 c = f(y, x) d = f(x + 1, y * 2) e = f(f(1, 2), 3)", {}),
+    ("func f(a) { return a + g } func h() { g = 5 return f(1) } g = 1 c = f(2) d = h()", {}),
+    ("func f(a) { b = a * 2 a = b + 1 return a + b } c = f(3)", {}),
+    ("func f(a) { return a * 2 } c = f(3)", {"a": 7}),
+    ("func f(a) { return a * 2 } c = f(3)", {"return": 7}),
+    ("func f(a) { return a * 2 } c = f(rand) d = f(rand)", {}),
+    ("func f(n, acc) { x = x + 1 if n > 0 { t = n * 2 return f(n - 1, acc + t) } y = x return acc } a = f(30, 0)", {}),
+    ("func f(n) { if n > 0 { return f(n - 1) } } a = f(30)", {"return": 3}),
+    ("func f(a, b) { if a > 0 { return f(a - 1, a + b) } return b } c = f(30, 1)", {"a": 1}),
+    ("func f(n) { if n < 2 { return n } return f(n - 1) + f(n - 2) } a = f(10)", {}),
+    ("func f(n) { if n < 2 { return n } return f(n - 1) + f(n - 2) } a = f(n)", {"n": 10}),
+    ("func f(n) { if n < 2 { return n } return f(n - 1) + f(n - 2) } a = f(10)", {"return": 1}),
+    ("func f(n) { return [n] } a = f(1) b = f(1) a[0] = 2", {}),
+    ("x = 1 func g() { x = 10 return 5 } func f(a) { return x + a } y = f(g())", {}),
+    ("x = 1 func g() { x = 10 return 5 } func f(a, b) { return b + a } y = f(x, g())", {}),
+]
+
+
+@pytest.mark.parametrize("code, in_state", OPTIMIZED_PROGRAMS)
+@pytest.mark.parametrize("options", [{"optimize": True}, {"inline": True}, {"optimize": True, "inline": True}])
+def test_same_end_state(compile_engine, code, in_state, options):
+    expected = compile_engine(code).run(dict(in_state), random=random.Random(4))
+    assert compile_engine(code, **options).run(dict(in_state), random=random.Random(4)) == expected
+
+
+@pytest.mark.parametrize("code, in_state", OPTIMIZED_PROGRAMS)
+def test_memoized_same_end_state(code, in_state):
+    expected = compile(code).run(dict(in_state), random=random.Random(4))
+    assert compile(code, memoize=True).run(dict(in_state), random=random.Random(4)) == expected
@@ -0,0 +1,53 @@
+import pytest
+
+from littlepython.feature import Features
+from littlepython.parser import Parser
+from littlepython.resolver import Resolver, RAND, GLOBAL, LOCAL, DYNAMIC
+from littlepython.tokenizer import Tokenizer
+
+CODE = "x = 1 func f(a, b) { c = a + x func g() { d = c } return g() } y = f(1, 2)"
+
+
+def resolve(code, features=Features.ALL):
+    ast = Parser(Tokenizer(code, features), features).program()
+    return ast, Resolver(features).resolve(ast)
+
+
+def test_every_name_has_a_global_slot():
+    ast, resolver = resolve(CODE)
+    assert sorted(resolver.globals) == ["a", "b", "c", "d", "f", "g", "x", "y"]
+    assert sorted(resolver.globals.values()) == list(range(8))
+
+
+def test_layout():
+    ast, resolver = resolve(CODE)
+    f = ast.children[1].function
+    g = f.block.children[1].function
+    assert resolver.layout(f).slots == {"a": 0, "b": 1, "c": 2, "g": 3}
+    assert resolver.layout(g).slots == {"d": 0}
+
+
+@pytest.mark.parametrize("name, function, kind", [
+    ("x", None, GLOBAL),
+    ("rand", None, RAND),
+    ("a", "f", LOCAL),
+    ("c", "f", LOCAL),
+    ("x", "f", DYNAMIC),
+    ("c", "g", DYNAMIC),
+    ("d", "g", LOCAL),
+])
+def test_classify(name, function, kind):
+    ast, resolver = resolve(CODE)
+    f = ast.children[1].function
+    functions = {None: None, "f": f, "g": f.block.children[1].function}
+    assert resolver.classify(name, functions[function])[0] == kind
+
+
+def test_rand_without_feature():
+    ast, resolver = resolve("a = rand", Features.ALL - Features.RANDOM_VAR)
+    assert resolver.classify("rand") == (GLOBAL, resolver.globals["rand"])
+
+
+def test_called_rand_is_looked_up():
+    ast, resolver = resolve("a = rand()")
+    assert resolver.classify("rand", call=True) == (GLOBAL, resolver.globals["rand"])
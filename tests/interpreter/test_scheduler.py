@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from littlepython import Scheduler
+from littlepython.error import ExecutionCountExceededException, DivisionByZeroException
+from tests.interpreter import compile
+
+FIB = "func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(k) r = rand"
+LOOP = "x = 0 for i = 0; i < n; i = i + 1 { x = x + i }"
+
+
+def expected(code, static_vars, seed=None):
+    return compile(code, engine="interpreter").run_counted(static_vars, random=random.Random(seed))
+
+
+@pytest.mark.parametrize("quantum", [1, 7, 100, 100000])
+def test_same_end_state(quantum):
+    prog = compile(FIB, engine="stack")
+    scheduler = Scheduler(quantum)
+    for k in range(8):
+        scheduler.add(prog, {"k": k}, random=random.Random(k))
+    results = scheduler.run()
+    assert [(result.state, result.op_count) for result in results] == [expected(FIB, {"k": k}, k) for k in range(8)]
+    assert all(result.error is None for result in results)
+
+
+def test_round_robin():
+    prog = compile(LOOP, engine="stack")
+    scheduler = Scheduler(10)
+    for _ in range(3):
+        scheduler.add(prog, {"n": 1000})
+    scheduler.run(95)
+    # 9 turns of 10 operations and a turn cut short to 5 by max_ops.
+    assert [program.op_count for program in scheduler.stats().programs] == [35, 30, 30]
+    assert scheduler.results() == [None, None, None]
+    assert scheduler.stats().fairness < 1
+    # The next run finishes the turn which was cut short.
+    scheduler.run(5)
+    assert [program.op_count for program in scheduler.stats().programs] == [40, 30, 30]
+    scheduler.run(10)
+    assert [program.op_count for program in scheduler.stats().programs] == [40, 40, 30]
+
+
+def test_priorities():
+    prog = compile(LOOP, engine="stack")
+    scheduler = Scheduler(10)
+    scheduler.add(prog, {"n": 1000}, priority=1)
+    scheduler.add(prog, {"n": 1000}, priority=3)
+    scheduler.run(400)
+    stats = scheduler.stats()
+    assert [program.op_count for program in stats.programs] == [100, 300]
+    assert stats.fairness == 1.0
+    assert [program.max_wait for program in stats.programs] == [30, 10]
+    assert stats.op_count == 400
+    assert stats.slices == 20
+
+
+def test_budgets():
+    prog = compile(LOOP, engine="stack")
+    scheduler = Scheduler(10)
+    scheduler.add(prog, {"n": 3}, max_op_count=1000)
+    scheduler.add(prog, {"n": 1000}, max_op_count=25)
+    scheduler.add(prog, {"n": 3}, max_op_count=1)
+    scheduler.add(compile("a = 1 / 0", engine="stack"))
+    results = scheduler.run()
+    assert results[0] == (expected(LOOP, {"n": 3})[0], expected(LOOP, {"n": 3})[1], None)
+    assert results[1].state is None
+    assert results[1].op_count == 25
+    assert type(results[1].error) is ExecutionCountExceededException
+    assert type(results[2].error) is ExecutionCountExceededException
+    assert type(results[3].error) is DivisionByZeroException
+    # A program gets the same result with a budget as run does.
+    with pytest.raises(ExecutionCountExceededException):
+        prog.run({"n": 1000}, 25)
+    assert scheduler.stats().programs[1].op_count == 24
+
+
+def test_deterministic():
+    progs = [compile(FIB, engine="stack"), compile(LOOP, engine="stack", inline=True)]
+
+    def schedule():
+        scheduler = Scheduler(13)
+        for i in range(6):
+            scheduler.add(progs[i % 2], {"k": i, "n": i * 10}, priority=i % 3 + 1, random=random.Random(i))
+        return [scheduler.run(50) for _ in range(5)], [program[:2] for program in scheduler.stats().programs]
+
+    assert schedule() == schedule()
+
+
+def test_stats():
+    scheduler = Scheduler()
+    scheduler.add(compile(LOOP, engine="stack"), {"n": 100})
+    scheduler.run()
+    stats = scheduler.stats()
+    assert stats.op_count == expected(LOOP, {"n": 100})[1]
+    assert stats.seconds > 0
+    assert stats.ops_per_second > 0
+    # Only programs which haven't ended count towards fairness.
+    assert stats.fairness is None
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        Scheduler(0)
+    with pytest.raises(ValueError):
+        Scheduler().add(compile(LOOP))
+    for engine in ["interpreter", "python", "vm"]:
+        with pytest.raises(ValueError):
+            Scheduler().add(compile(LOOP, engine=engine))
+    with pytest.raises(ValueError):
+        Scheduler().add(compile("func f(n) { return n + 1 } a = f(1)", inline=True))
+    with pytest.raises(ValueError):
+        Scheduler().add(compile(LOOP, engine="stack"), priority=0)
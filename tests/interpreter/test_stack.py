@@ -0,0 +1,39 @@
+import sys
+
+import pytest
+
+from littlepython.error import CallDepthExceededException, ExecutionCountExceededException
+from tests.interpreter import compile
+
+SUM = "func sum(n) { if n is 0 { return 0 } return n + sum(n - 1) } a = sum(depth)"
+
+
+def test_deeper_than_recursion_limit():
+    depth = sys.getrecursionlimit() * 2
+    e = compile(SUM, engine="stack").run({"depth": depth})
+    assert e["a"] == depth * (depth + 1) // 2
+
+
+def test_deep_recursion_in_interpreter():
+    with pytest.raises(RecursionError):
+        compile(SUM, engine="interpreter").run({"depth": sys.getrecursionlimit() * 2})
+
+
+@pytest.mark.parametrize("depth, max_call_depth", [
+    (10, 10),
+    (10, 11),
+    (500, 1000),
+])
+def test_call_depth_limit(depth, max_call_depth):
+    prog = compile(SUM, engine="stack")
+    # sum(depth) makes depth + 1 nested calls.
+    if depth + 1 > max_call_depth:
+        with pytest.raises(CallDepthExceededException):
+            prog.run({"depth": depth}, max_call_depth=max_call_depth)
+    else:
+        assert prog.run({"depth": depth}, max_call_depth=max_call_depth)["a"] == depth * (depth + 1) // 2
+
+
+def test_op_count_exceeded_before_call_depth():
+    with pytest.raises(ExecutionCountExceededException):
+        compile(SUM, engine="stack").run({"depth": 100000}, max_op_count=1000)
@@ -0,0 +1,71 @@
+import random
+import threading
+
+from littlepython.error import ExecutionCountExceededException
+from tests.interpreter import compile
+
+CODE = """func fib(m) { if m < 2 { return m } return fib(m - 1) + fib(m - 2) }
+a = fib(n)
+r = rand"""
+
+
+def run(prog, n, max_op_count=-1):
+    try:
+        return prog.run({"n": n}, max_op_count=max_op_count, random=random.Random(n))
+    except ExecutionCountExceededException as e:
+        return type(e)
+
+
+def test_concurrent_runs(compile_engine):
+    prog = compile_engine(CODE)
+    jobs = [(n, max_op_count) for n in range(12) for max_op_count in (-1, 200)]
+    expected = [run(prog, n, max_op_count) for n, max_op_count in jobs]
+    results = [None] * len(jobs)
+
+    def worker(i):
+        for _ in range(5):
+            results[i] = run(prog, *jobs[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == expected
+
+
+def test_concurrent_counted_runs():
+    # The runs start on a program which has never run before.
+    expected = [compile(CODE, engine="python").run_counted({"n": n}, 10 ** 6, random.Random(n)) for n in range(12)]
+    prog = compile(CODE, engine="python")
+    entries = dict(prog.entries)
+    results = [None] * 48
+
+    def worker(i):
+        n = i % 12
+        results[i] = prog.run_counted({"n": n}, 10 ** 6 if i % 2 else -1, random.Random(n))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected[i % 12] for i in range(len(results))]
+    assert prog.entries == entries
+
+
+def test_reentrant_run(compile_engine):
+    prog = compile_engine(CODE)
+
+    class Nested(object):
+        """Runs the program again when the outer run reads rand."""
+        def randint(self, a, b):
+            return prog.run({"n": 5}, max_op_count=1000, random=random.Random(0))["a"]
+
+    assert prog.run({"n": 10}, max_op_count=10000, random=Nested()) == {"n": 10, "a": 55, "r": 5}
+
+
+def test_random_isnt_kept():
+    prog = compile(CODE, engine="interpreter")
+    prog.run({"n": 1}, random=random.Random(1))
+    assert prog.random is random
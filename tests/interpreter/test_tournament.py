@@ -0,0 +1,60 @@
+import pickle
+import random
+
+import pytest
+
+from littlepython import Tournament, Job
+from littlepython.error import ExecutionCountExceededException, InvalidSyntaxException
+from tests.interpreter import compile
+
+FIB = "func fib(n) { if n < 2 { return n } return fib(n - 1) + fib(n - 2) } a = fib(k) r = rand"
+
+
+def expected(code, static_vars, max_op_count, seed):
+    prog = compile(code)
+    return prog.run_counted(static_vars, max_op_count, random.Random(seed))
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_results_in_order(workers):
+    jobs = [(FIB, {"k": k}, -1, k) for k in range(10)]
+    with Tournament(workers) as tournament:
+        results = tournament.run(jobs)
+    assert [(result.state, result.op_count) for result in results] == [expected(*job) for job in jobs]
+    assert all(result.error is None for result in results)
+
+
+def test_compiled_programs(compile_engine):
+    prog = compile_engine(FIB)
+    with Tournament(2) as tournament:
+        results = tournament.run([Job(prog, {"k": 6}, seed=1), Job(prog, {"k": 7}, seed=2)])
+    assert [result.state for result in results] == [prog.run({"k": 6}, random=random.Random(1)),
+                                                     prog.run({"k": 7}, random=random.Random(2))]
+
+
+def test_errors():
+    jobs = [Job(FIB, {"k": 10}, 50),
+            Job("a = 1 / 0"),
+            Job("a = ("),
+            Job("a = 1", seed=3)]
+    results = Tournament(0).run(jobs)
+    assert type(results[0].error) is ExecutionCountExceededException
+    assert results[0].op_count == 50
+    assert results[1].state is None
+    assert type(results[2].error) is InvalidSyntaxException
+    assert results[3] == ({"a": 1}, 3, None)
+
+
+def test_compile_options():
+    # Recursing this deep needs the stack engine.
+    code = "func f(n) { if n > 0 { return f(n - 1) } return 0 } a = f(k)"
+    results = Tournament(0, engine="stack").run([Job(code, {"k": 5000})])
+    assert results[0].error is None
+
+
+@pytest.mark.parametrize("options", [{}, {"inline": True}, {"optimize": True}])
+def test_pickle(compile_engine, options):
+    prog = compile_engine("func f(a) { return a * 2 } b = [1, 2] c = f(3) + rand", **options)
+    copy = pickle.loads(pickle.dumps(prog))
+    assert copy.run_counted(random=random.Random(1)) == prog.run_counted(random=random.Random(1))
+    assert copy.run({"a": 1}, random=random.Random(1)) == prog.run({"a": 1}, random=random.Random(1))
@@ -0,0 +1,57 @@
+import sys
+
+import pytest
+
+from littlepython.error import CallDepthExceededException
+from littlepython.vm import dis, ADD, END, JUMP, JUMP_IF_FALSE, STORE_VAR
+from tests.interpreter import compile
+
+
+def ops(code):
+    return code.code[::4].tolist()
+
+
+def test_code_is_flat():
+    prog = compile("a = 1 b = a + 2", engine="vm")
+    assert ops(prog.main)[-3:] == [ADD, STORE_VAR, END]
+    assert len(prog.main.code) == 4 * len(prog.main.costs)
+
+
+def test_loop_jumps():
+    prog = compile("x = 0 for i = 0; i < 10; i = i + 1 {x = x + 1}", engine="vm")
+    assert JUMP_IF_FALSE in ops(prog.main)
+    assert JUMP in ops(prog.main)
+    assert prog.run() == {"x": 10, "i": 10}
+
+
+@pytest.mark.parametrize("code, node_count", [
+    ("", 1),
+    ("a = 1 b = a + 2", 7),
+    ("a = 1 b = [a, 2] c = b[0] b[1] = 3", 15),
+    ("if a { b = 1 } elif c { b = 2 } else { b = 3 }", 13),
+    ("for ;; {}", 6),
+    ("func f(n) { return n } d = f(1)", 8),
+])
+def test_costs_match_node_count(code, node_count):
+    # Each instruction is charged for the nodes it stands for, so the costs add up to the number of nodes.
+    prog = compile(code, engine="vm")
+    assert sum(sum(code.costs) for code in prog.codes) == node_count
+
+
+def test_dis():
+    prog = compile("func f(a, b) { return a * b } y = f(2, 3)", engine="vm")
+    listing = dis(prog).splitlines()
+    assert listing[0] == "<main>:"
+    assert "f(a, b):" in listing
+    assert any("MAKE_FUNC" in line and "f = <function 0>" in line for line in listing)
+    assert any("CALL" in line and "f(2 args)" in line for line in listing)
+    assert any("STORE_VAR" in line and "; y" in line for line in listing)
+    assert any("MULT" in line for line in listing)
+
+
+def test_deep_recursion():
+    depth = sys.getrecursionlimit() * 2
+    prog = compile("func sum(n) { if n is 0 { return 0 } return n + sum(n - 1) } a = sum(depth)", engine="vm")
+    assert prog.run({"depth": depth})["a"] == depth * (depth + 1) // 2
+    with pytest.raises(CallDepthExceededException):
+        prog.run({"depth": 100}, max_call_depth=50)
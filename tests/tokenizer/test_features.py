@@ -76,3 +76,11 @@ def test_func_loop_enabled():
     for token in tokens:
         assert tokenizer.get_next_token() == token
 
+
+
+def test_feature_set_equality():
+    assert Features.IF | Features.ELIF == Features.ELIF + Features.IF
+    assert Features.ALL - Features.FUNC != Features.ALL
+    assert Features.ALL - Features.ALL == Features.NONE
+    assert hash(Features.IF | Features.ELIF) == hash(Features.ELIF | Features.IF)
+    assert len({Features.ALL, Features.ALL - Features.NONE, Features.NONE}) == 2